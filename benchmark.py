@@ -0,0 +1,580 @@
+#!/usr/bin/python3
+
+# Micro benchmarks for the frame parsers, codecs and the SPI cost of the
+# driver. Runs without hardware, the driver talks to the Enc28j60Simulator.
+#
+#   benchmark.py [--json out.json] [--baseline old.json] [--timings-only] [capture.pcap]
+#
+# --json saves the results, --baseline compares them with saved ones and exits
+# with status 1 when something regressed. Results of the simulator - SPI
+# transfer counts and simulated throughput - are exact and must not get worse
+# at all. Timings may get slower by --threshold or by three times the spread
+# measured in this run, whichever is larger, and only count when up to
+# CONFIRMATIONS further processes measure them slower as well. Reference
+# columns (the plain Python checksum loop, the rebuilt echo reply) and host
+# wall time are reported but never fail the run. A capture is replayed
+# through the parsers as well.
+#
+# The TCP section moves a bulk transfer between a NetworkStack on the
+# simulated chip and a link partner stack; Mbit/s is in the simulated time of
+# the bus and the wire, wall ms is what the host needed.
+
+import argparse
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+from collections import deque
+from time import perf_counter
+
+from ethernet.ethernet_frame import EthernetFrame
+from ethernet.ethernet_frame_view import EthernetFrameView
+from ethernet.ip_frame import IpFrame
+from ethernet.arp_frame import ArpFrame
+from ethernet.icmp_datagram import IcmpDatagram
+from ethernet.udp_datagram import UdpDatagram
+from ethernet.icmp_echo_responder import IcmpEchoResponder
+from ethernet.checksum import internet_checksum
+from ethernet.pcap_reader import PcapReader
+from ethernet.enc28j60 import Enc28j60
+from ethernet.enc28j60_simulator import Enc28j60Simulator
+from ethernet.buffer_layout import BufferLayout
+from ethernet.network_stack import NetworkStack
+from ethernet.mac_address import MacAddress
+
+FRAME_SIZES = (64, 512, 1514)
+# simple IMIX: 7 small, 4 medium and 1 full size frame
+FRAME_MIX = [64] * 7 + [576] * 4 + [1514]
+TCP_TRANSFER = 256 * 1024
+HIGHER_IS_BETTER = frozenset(["Mbit/s"])
+# (section, column) left out of the comparison, None stands for every column
+REFERENCE_COLUMNS = frozenset([("checksums", "loop"), ("echo", "rebuild"), ("tcp", "wall ms")])
+EXACT_COLUMNS = frozenset([("spi", None), ("tcp", "Mbit/s")])
+CONFIRMATIONS = 2			# processes that measure the timings again before they count
+
+# median over best time of each measure() call, minus one
+spreads = []
+
+MY_MAC = bytes([0x02, 0x03, 0x04, 0x05, 0x06, 0x07])
+OTHER_MAC = bytes([0x30, 0x9c, 0x23, 0x0d, 0x2d, 0x7f])
+
+
+def log(message=""):
+	print(message)
+	sys.stdout.flush()
+
+
+def icmp_echo_frame(size=56):
+	icmp = bytearray(struct.pack("!BBHHH", 8, 0, 0, 0x1234, 1) + bytes(range(256)) * (size // 256) + bytes(range(size % 256)))
+	ip = bytearray(struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(icmp), 1, 0, 64, 1, 0, bytes([10, 0, 1, 1]), bytes([10, 0, 1, 254])))
+	struct.pack_into("!H", icmp, 2, internet_checksum(icmp))
+	struct.pack_into("!H", ip, 10, internet_checksum(ip))
+
+	return MY_MAC + OTHER_MAC + b"\x08\x00" + bytes(ip) + bytes(icmp)
+
+
+def udp_frame(size=512):
+	udp = struct.pack("!HHHH", 5353, 5353, 8 + size, 0) + bytes(size)
+	ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 2, 0, 64, 17, 0, bytes([10, 0, 1, 1]), bytes([224, 0, 0, 251]))
+
+	return bytes([0x01, 0x00, 0x5e, 0x00, 0x00, 0xfb]) + OTHER_MAC + b"\x08\x00" + ip + udp
+
+
+def arp_request_frame():
+	arp = struct.pack("!HHBBH6s4s6s4s", 1, 0x0800, 6, 4, 1, OTHER_MAC, bytes([10, 0, 1, 1]), bytes(6), bytes([10, 0, 1, 2]))
+
+	return b"\xff" * 6 + OTHER_MAC + b"\x08\x06" + arp + bytes(18)
+
+
+# frame of size bytes (without FCS), ICMP up to 98 bytes and UDP above
+def sized_frame(size):
+	if size <= 98:
+		return icmp_echo_frame(size - 42)
+
+	frame = bytearray(udp_frame(size - 42))
+	frame[0:6] = MY_MAC
+
+	return bytes(frame)
+
+
+# what a receive loop does with traffic it is not interested in
+def classify_and_drop(parser, view):
+	frame = parser.from_buffer(view)
+
+	return frame.type == 0x0800 and frame.payload.protocol == 1
+
+
+def full_decode(parser, view):
+	frame = parser.from_buffer(view)
+	payload = frame.payload
+	fields = [frame.dst_mac_address, frame.src_mac_address, frame.type]
+
+	if frame.type == 0x0800:
+		fields += [payload.id, payload.ttl, payload.source_address, payload.destination_address]
+
+		if payload.protocol in (1, 17):
+			fields += [payload.payload.checksum, len(payload.payload.payload)]
+	elif frame.type == 0x0806:
+		fields += [payload.oper, payload.sha, payload.spa, payload.tpa]
+
+	return fields
+
+
+# best of repeat runs of count calls, in microseconds per call
+def measure(function, args, count=20000, repeat=9):
+	times = []
+
+	for _ in range(repeat):
+		start = perf_counter()
+
+		for _ in range(count):
+			function(*args)
+
+		times.append(perf_counter() - start)
+
+	times.sort()
+	spreads.append(times[len(times) // 2] / times[0] - 1)
+
+	return times[0] / count * 1e6
+
+
+# Typical relative spread of the timings in this run
+def timing_noise():
+	if len(spreads) == 0:
+		return 0.0
+
+	return sorted(spreads)[len(spreads) // 2]
+
+
+def run_parsers():
+	frames = [
+		("icmp echo", icmp_echo_frame()),
+		("udp 512", udp_frame()),
+		("arp request", arp_request_frame()),
+	]
+	results = []
+
+	for (name, frame) in frames:
+		view = memoryview(bytearray(frame))
+
+		for (task, function) in (("classify", classify_and_drop), ("decode", full_decode)):
+			eager = measure(function, (EthernetFrame, view))
+			lazy = measure(function, (EthernetFrameView, view))
+			results.append(("{:s} {:s}".format(name, task), eager, lazy))
+
+	return results
+
+
+def decode_all(parser, frames):
+	for frame in frames:
+		full_decode(parser, frame)
+
+
+# FRAME_MIX decoded once per run, in microseconds per frame
+def run_mix():
+	mixes = [
+		("icmp/udp imix", [sized_frame(size) for size in FRAME_MIX]),
+		("with arp", [sized_frame(size) for size in FRAME_MIX] + [arp_request_frame()] * 4),
+	]
+	results = []
+
+	for (name, frames) in mixes:
+		views = [memoryview(bytearray(frame)) for frame in frames]
+		eager = measure(decode_all, (EthernetFrame, views), count=1000)
+		lazy = measure(decode_all, (EthernetFrameView, views), count=1000)
+		results.append((name, eager / len(views), lazy / len(views)))
+
+	return results
+
+
+def parse(parser, view, offset, length):
+	return parser.from_buffer(view, offset, length)
+
+
+# one header type at a time: (name, class, frame, offset of the header)
+def run_codecs():
+	codecs = [("arp", ArpFrame, arp_request_frame(), 14)]
+
+	for size in FRAME_SIZES:
+		codecs += [
+			("ethernet {:d}".format(size), EthernetFrame, sized_frame(size), 0),
+			("ipv4 {:d}".format(size), IpFrame, sized_frame(size), 14),
+			("icmp {:d}".format(size), IcmpDatagram, icmp_echo_frame(size - 42), 34),
+			("udp {:d}".format(size), UdpDatagram, udp_frame(size - 42), 34),
+		]
+
+	results = []
+
+	for (name, parser, frame, offset) in codecs:
+		view = memoryview(bytearray(frame))
+		length = len(frame) - offset
+		decoded = parser.from_buffer(view, offset, length)
+		parse_time = measure(parse, (parser, view, offset, length))
+		serialize_time = measure(bytes, (decoded,))
+		results.append((name, parse_time * 1000, serialize_time * 1000))
+
+	return results
+
+
+# word by word in Python, the way IcmpDatagram used to do it
+def checksum_loop(data):
+	checksum = 0
+
+	for i in range(0, len(data) - 1, 2):
+		checksum += data[i] * 256 + data[i + 1]
+
+	if len(data) % 2 != 0:
+		checksum += data[-1] * 256
+
+	while checksum > 0xFFFF:
+		checksum = (checksum & 0xFFFF) + (checksum >> 16)
+
+	return ~checksum & 0xFFFF
+
+
+def run_checksums():
+	results = []
+
+	for size in (64, 128, 256, 512, 1024, 1500):
+		data = memoryview(bytearray(bytes(range(256)) * 6)[:size])
+		assert checksum_loop(data) == internet_checksum(data)
+		results.append(("checksum {:d}".format(size), measure(checksum_loop, (data,)) * 1000, measure(internet_checksum, (data,)) * 1000))
+
+	return results
+
+
+# the reply is built from the request in place, so every call starts from a
+# fresh copy of it; the copy is measured separately and taken off
+def echo_in_place(responder, frame, buf):
+	buf[:] = frame
+	return responder.reply(buf)
+
+
+def copy_only(responder, frame, buf):
+	buf[:] = frame
+
+
+# reply built from parsed objects, checksum over the whole payload
+def echo_rebuild(responder, frame, buf):
+	request = EthernetFrame.from_buffer(frame)
+	ip = request.payload
+	icmp = ip.payload
+	icmp.type = 0
+	ip.source_address, ip.destination_address = ip.destination_address, ip.source_address
+	ip.payload = bytes(icmp)
+	request.dst_mac_address, request.src_mac_address = request.src_mac_address, request.dst_mac_address
+
+	return bytes(request)
+
+
+def run_echo():
+	responder = IcmpEchoResponder(MY_MAC, bytes([10, 0, 1, 254]))
+	results = []
+
+	for size in (56, 1472):
+		frame = icmp_echo_frame(size)
+		buf = bytearray(len(frame))
+		copy_time = measure(copy_only, (responder, frame, buf))
+		in_place = measure(echo_in_place, (responder, frame, buf)) - copy_time
+		rebuild = measure(echo_rebuild, (responder, frame, buf))
+		results.append(("echo {:d}".format(size), rebuild * 1000, in_place * 1000))
+
+	return results
+
+
+# every frame of a capture decoded once per run, in microseconds per frame
+def run_replay(path):
+	with PcapReader(path) as reader:
+		frames = list(reader.frames())
+		eager = measure(decode_all, (EthernetFrame, frames), count=1)
+		lazy = measure(decode_all, (EthernetFrameView, frames), count=1)
+		result = ("{:s} ({:d} frames)".format(os.path.basename(path), len(frames)), eager / len(frames), lazy / len(frames))
+		del frames
+
+	return [result]
+
+
+# SPI calls (syscalls on a real bus), chip-select framed transactions, bytes
+# and bus time at 2 MHz of one driver call, counted by the simulator
+def spi_cost(simulator, function, *args):
+	simulator.reset_counters()
+	start = simulator.now
+	function(*args)
+
+	return (simulator.calls, simulator.transactions, simulator.bytes, (simulator.now - start) * 1e6)
+
+
+def run_spi():
+	simulator = Enc28j60Simulator()
+	driver = Enc28j60(MY_MAC, spi=simulator)
+	driver.initialize()
+	buf = bytearray(1518)
+	results = []
+
+	for size in FRAME_SIZES:
+		frame = sized_frame(size)
+
+		simulator.inject(frame)
+		results.append(("receive_packet {:d}".format(size),) + spi_cost(simulator, driver.receive_packet))
+
+		simulator.inject(frame)
+		results.append(("receive_packet_into {:d}".format(size),) + spi_cost(simulator, driver.receive_packet_into, buf))
+
+		# as many as fit into the receive buffer, up to 4
+		count = sum(simulator.inject(frame) for _ in range(4))
+		cost = spi_cost(simulator, driver.receive_burst)
+		results.append(("receive_burst/{:d} {:d}".format(count, size),) + tuple(value / count for value in cost))
+
+		driver.flush_transmit()
+		results.append(("send_packet {:d}".format(size),) + spi_cost(simulator, driver.send_packet, frame))
+
+		driver.flush_transmit()
+		results.append(("send_packet offload {:d}".format(size),) + spi_cost(simulator, driver.send_packet, frame, True))
+
+	driver.flush_transmit()
+
+	return results
+
+
+# Driver for the stack at the far end of the simulated wire: what the chip
+# sends is queued for it, what it sends arrives at the chip at wire speed.
+class LinkPartner(object):
+	def __init__(self, mac_address, simulator):
+		self.mac_address = MacAddress(mac_address)
+		self.simulator = simulator
+		self.clock = simulator.monotonic
+		self.layout = BufferLayout(rx_size=0x1800)
+		self.queue = deque()
+		simulator.on_transmit = self.queue.append
+
+
+	def send_packet(self, frame, offload_checksums=False):
+		self.simulator.deliver(frame)
+
+
+	def wait_for_packet(self, timeout=None):
+		return len(self.queue) > 0
+
+
+	def receive_packet_into(self, buf):
+		frame = self.queue.popleft()
+		buf[:len(frame)] = frame
+
+		return len(frame)
+
+
+def try_call(function, *args):
+	try:
+		return function(*args)
+	except BlockingIOError:
+		return None
+
+
+# Both stacks run non-blocking in one loop, every call polls its stack once;
+# polling the chip is what moves simulated time on while they wait.
+def tcp_transfer(spi_clock_hz, send):
+	simulator = Enc28j60Simulator(spi_clock_hz=spi_clock_hz)
+	driver = Enc28j60(MY_MAC, spi=simulator, layout=BufferLayout(rx_size=0x1200, tx_slots=2))
+	driver.initialize()
+	stack = NetworkStack(driver, "10.0.1.254")
+	partner = NetworkStack(LinkPartner(OTHER_MAC, simulator), "10.0.1.1")
+
+	listener = partner.listen(5001)
+	listener.settimeout(0)
+	client = stack.tcp_socket()
+	client.settimeout(0)
+	address = ("10.0.1.1", 5001)
+	try_call(client.connect, address)
+	accepted = None
+
+	while accepted is None:
+		if client.connected:
+			try_call(client.recv, 1)		# nothing comes yet, it keeps the client stack going
+		else:
+			try_call(client.connect, address)
+
+		accepted = try_call(listener.accept)
+
+	server = accepted[0]
+	server.settimeout(0)
+	(sender, receiver) = (client, server) if send else (server, client)
+
+	data = bytes(range(256)) * (TCP_TRANSFER // 256)
+	sent = 0
+	received = 0
+	start = simulator.now
+	wall_start = perf_counter()
+
+	while received < len(data):
+		if sent < len(data):
+			sent += try_call(sender.send, data[sent:sent + 8192]) or 0
+		else:
+			try_call(sender.recv, 1)		# nothing comes back, it takes in the acknowledgments
+
+		received += len(try_call(receiver.recv, 0x10000) or b"")
+
+	elapsed = simulator.now - start
+	wall_time = perf_counter() - wall_start
+
+	return (len(data) * 8 / elapsed / 1e6, wall_time * 1000)
+
+
+def run_tcp():
+	results = []
+
+	for spi_clock_hz in (2000000, 20000000):
+		for (name, send) in (("send", True), ("receive", False)):
+			row_name = "tcp {:s} {:d} MHz".format(name, spi_clock_hz // 1000000)
+			results.append((row_name,) + tcp_transfer(spi_clock_hz, send))
+
+	return results
+
+
+# results[section][row] = {column: value}
+def record(results, section, columns, rows):
+	results[section] = {row[0]: dict(zip(columns, row[1:])) for row in rows}
+
+	return rows
+
+
+# How fast a row runs depends on the process as well (memory layout, load on
+# the host), so a real regression has to show in other processes as well:
+# the timings are taken once more by a fresh one and the better of the runs
+# is kept.
+def measure_again(results, capture):
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, "again.json")
+		command = [sys.executable, os.path.abspath(__file__), "--timings-only", "--json", path]
+
+		if capture is not None:
+			command.append(capture)
+
+		subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+		with open(path) as file:
+			again = json.load(file)["results"]
+
+	for (section, rows) in again.items():
+		for (name, values) in rows.items():
+			for (column, value) in values.items():
+				results[section][name][column] = min(value, results[section][name][column])
+
+
+# Rows worse than baseline by more than threshold; exact results must not get
+# worse at all
+def compare(results, baseline, threshold):
+	regressions = []
+
+	for (section, rows) in results.items():
+		for (name, values) in rows.items():
+			old_values = baseline.get(section, {}).get(name, {})
+
+			for (column, value) in values.items():
+				old = old_values.get(column)
+
+				if old is None or (section, column) in REFERENCE_COLUMNS:
+					continue
+
+				exact = (section, None) in EXACT_COLUMNS or (section, column) in EXACT_COLUMNS
+				limit = 0.0 if exact else threshold
+
+				if column in HIGHER_IS_BETTER:
+					regressed = value < old * (1 - limit - 1e-6)
+				else:
+					regressed = value > old * (1 + limit + 1e-6)
+
+				if regressed:
+					regressions.append("{:s} / {:s} / {:s}: {:.2f} -> {:.2f} ({:+.0%})".format(
+						section, name, column, old, value, value / old - 1 if old else float("inf")))
+
+	return regressions
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("capture", nargs="?", help="pcap or pcapng file to replay")
+	parser.add_argument("--json", help="write the results to this file")
+	parser.add_argument("--baseline", help="compare with results saved by --json")
+	parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 = 10%%")
+	parser.add_argument("--timings-only", action="store_true", help="leave out the simulator sections")
+	args = parser.parse_args()
+
+	results = {}
+
+	log("{:<28s} {:>10s} {:>10s} {:>8s}".format("parser (us/frame)", "eager", "lazy", "speedup"))
+
+	for (name, eager, lazy) in record(results, "parsers", ("eager", "lazy"), run_parsers()):
+		log("{:<28s} {:>10.2f} {:>10.2f} {:>7.1f}x".format(name, eager, lazy, eager / lazy))
+
+	for (name, eager, lazy) in record(results, "mix", ("eager", "lazy"), run_mix()):
+		log("{:<28s} {:>10.2f} {:>10.2f} {:>7.1f}x".format(name, eager, lazy, eager / lazy))
+
+	log()
+	log("{:<28s} {:>10s} {:>10s}".format("codec (ns/op)", "parse", "serialize"))
+
+	for (name, parse_time, serialize_time) in record(results, "codecs", ("parse", "serialize"), run_codecs()):
+		log("{:<28s} {:>10.0f} {:>10.0f}".format(name, parse_time, serialize_time))
+
+	log()
+	log("{:<28s} {:>10s} {:>10s}".format("checksum (ns/op)", "loop", "module"))
+
+	for (name, loop, module) in record(results, "checksums", ("loop", "module"), run_checksums()):
+		log("{:<28s} {:>10.0f} {:>10.0f}".format(name, loop, module))
+
+	log()
+	log("{:<28s} {:>10s} {:>10s}".format("echo reply (ns/op)", "rebuild", "in place"))
+
+	for (name, rebuild, in_place) in record(results, "echo", ("rebuild", "in place"), run_echo()):
+		log("{:<28s} {:>10.0f} {:>10.0f}".format(name, rebuild, in_place))
+
+	if not args.timings_only:
+		log()
+		log("{:<28s} {:>10s} {:>10s} {:>10s} {:>10s}".format("driver spi (per frame)", "calls", "messages", "bytes", "bus us"))
+
+		for (name, calls, transactions, count, bus_time) in record(results, "spi", ("calls", "transactions", "bytes", "bus us"), run_spi()):
+			log("{:<28s} {:>10.1f} {:>10.1f} {:>10.0f} {:>10.0f}".format(name, calls, transactions, count, bus_time))
+
+		log()
+		log("{:<28s} {:>10s} {:>10s}".format("tcp 256 KB", "Mbit/s", "wall ms"))
+
+		for (name, rate, wall_time) in record(results, "tcp", ("Mbit/s", "wall ms"), run_tcp()):
+			log("{:<28s} {:>10.2f} {:>10.0f}".format(name, rate, wall_time))
+
+	if args.capture is not None:
+		log()
+		log("{:<28s} {:>10s} {:>10s}".format("replay (us/frame)", "eager", "lazy"))
+
+		for (name, eager, lazy) in record(results, "replay", ("eager", "lazy"), run_replay(args.capture)):
+			log("{:<28s} {:>10.2f} {:>10.2f}".format(name, eager, lazy))
+
+	if args.json is not None:
+		with open(args.json, "w") as file:
+			json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, file, indent=1)
+
+	if args.baseline is not None:
+		with open(args.baseline) as file:
+			baseline = json.load(file)["results"]
+
+		threshold = max(args.threshold, 3 * timing_noise())
+		regressions = compare(results, baseline, threshold)
+
+		for _ in range(CONFIRMATIONS):
+			if len(regressions) == 0:
+				break
+
+			log()
+			log("{:d} regressions, measuring the timings again in a new process".format(len(regressions)))
+			measure_again(results, args.capture)
+			regressions = compare(results, baseline, threshold)
+
+		log()
+		log("{:d} regressions against {:s}, timings allowed {:.0%} slower".format(len(regressions), args.baseline, threshold))
+
+		for regression in regressions:
+			log("  " + regression)
+
+		if len(regressions) > 0:
+			sys.exit(1)
@@ -0,0 +1,183 @@
+from collections import OrderedDict, deque
+import time
+
+from ethernet.mac_address import MacAddress
+from ethernet.ip4_address import Ip4Address
+from ethernet.arp_frame import ArpFrame, REQUEST
+from ethernet.ethernet_frame import EthernetFrame
+
+BROADCAST = MacAddress(0xFFFFFFFFFFFF)
+UNKNOWN = MacAddress(0)
+
+# entry fields; mac_address is None while the entry is incomplete
+MAC_ADDRESS = 0
+EXPIRES = 1		# end of life for complete entries, next request for incomplete ones
+QUEUE = 2
+TRIES = 3
+
+
+# Neighbour cache, RFC 826 style. Entries live for ttl seconds, at most size
+# of them are kept and the least recently used one goes first. Frames for an
+# address that is being resolved wait in a short queue and are sent with the
+# destination filled in once the reply arrives.
+#
+# send is called with complete Ethernet frames, e.g. Enc28j60.send_packet.
+
+class ArpCache(object):
+	def __init__(self, send, mac_address, ip_address, size=64, ttl=300.0, retry_interval=1.0, retries=3, \
+			queue_size=3, learn_gratuitous=True, clock=time.monotonic):
+		self.send = send
+		self.mac_address = MacAddress(mac_address)
+		self.ip_address = Ip4Address(ip_address)
+		self.size = size
+		self.ttl = ttl
+		self.retry_interval = retry_interval
+		self.retries = retries
+		self.queue_size = queue_size
+		self.learn_gratuitous = learn_gratuitous
+		self.clock = clock
+		self.entries = OrderedDict()
+		self.requests = 0
+		self.unresolved = 0
+
+
+	def __len__(self):
+		return len(self.entries)
+
+
+	def __contains__(self, ip_address):
+		return self.lookup(ip_address) is not None
+
+
+	# The MAC address for ip_address, or None when it is unknown, still being
+	# resolved or has expired.
+	def lookup(self, ip_address):
+		ip_address = Ip4Address(ip_address)
+		entry = self.entries.get(ip_address)
+
+		if entry is None or entry[MAC_ADDRESS] is None:
+			return None
+
+		if entry[EXPIRES] <= self.clock():
+			del self.entries[ip_address]
+			return None
+
+		self.entries.move_to_end(ip_address)
+
+		return entry[MAC_ADDRESS]
+
+
+	def update(self, ip_address, mac_address):
+		ip_address = Ip4Address(ip_address)
+		mac_address = MacAddress(mac_address)
+		entry = self.entries.get(ip_address)
+		expires = self.clock() + self.ttl
+
+		if entry is None:
+			self.insert(ip_address, [mac_address, expires, None, 0])
+			return
+
+		queue = entry[QUEUE]
+		entry[:] = [mac_address, expires, None, 0]
+		self.entries.move_to_end(ip_address)
+
+		if queue is not None:
+			for frame in queue:
+				frame[0:6] = bytes(mac_address)
+				self.send(frame)
+
+
+	def insert(self, ip_address, entry):
+		while len(self.entries) >= self.size:
+			(_, evicted) = self.entries.popitem(last=False)
+
+			if evicted[MAC_ADDRESS] is None:
+				self.unresolved += len(evicted[QUEUE])
+
+		self.entries[ip_address] = entry
+
+
+	# Send an Ethernet frame to ip_address, filling in the destination MAC. If
+	# the address is not known yet the frame is copied and queued and a request
+	# goes out. Returns True when the frame was sent right away.
+	def send_to(self, ip_address, frame):
+		ip_address = Ip4Address(ip_address)
+		mac_address = self.lookup(ip_address)
+
+		if mac_address is not None:
+			frame = bytearray(frame)
+			frame[0:6] = bytes(mac_address)
+			self.send(frame)
+			return True
+
+		entry = self.entries.get(ip_address)
+
+		if entry is None:
+			entry = [None, self.clock(), deque(maxlen=self.queue_size), 0]
+			self.insert(ip_address, entry)
+
+		if len(entry[QUEUE]) == self.queue_size:
+			self.unresolved += 1
+
+		entry[QUEUE].append(bytearray(frame))
+
+		if entry[TRIES] == 0:
+			self.request(ip_address, entry)
+
+		return False
+
+
+	def request(self, ip_address, entry):
+		entry[TRIES] += 1
+		entry[EXPIRES] = self.clock() + self.retry_interval
+		self.requests += 1
+
+		arp = ArpFrame(0x0001, 0x0800, 6, 4, REQUEST, self.mac_address, self.ip_address, UNKNOWN, ip_address)
+		self.send(bytes(EthernetFrame(BROADCAST, self.mac_address, 0x0806, arp)))
+
+
+	# Learn from a received ArpFrame (or ArpFrameView). Like RFC 826, existing
+	# entries are refreshed from any packet and new ones are only created by
+	# packets addressed to us, or by gratuitous announcements if enabled.
+	def handle(self, arp):
+		if arp.htype != 0x0001 or arp.ptype != 0x0800 or arp.hlen != 6 or arp.plen != 4:
+			return
+
+		sender = arp.spa
+
+		if sender == self.ip_address or int(sender) == 0:
+			return
+
+		if sender in self.entries or arp.tpa == self.ip_address or (self.learn_gratuitous and arp.tpa == sender):
+			self.update(sender, arp.sha)
+
+
+	# Age the cache: retry or give up on incomplete entries and drop expired
+	# ones. Call it now and then, e.g. from the receive loop.
+	def poll(self):
+		now = self.clock()
+
+		for (ip_address, entry) in list(self.entries.items()):
+			if entry[EXPIRES] > now:
+				continue
+
+			if entry[MAC_ADDRESS] is not None:
+				del self.entries[ip_address]
+			elif entry[TRIES] < self.retries:
+				self.request(ip_address, entry)
+			else:
+				self.unresolved += len(entry[QUEUE])
+				del self.entries[ip_address]
+
+
+	def __repr__(self):
+		now = self.clock()
+		parts = []
+
+		for (ip_address, entry) in self.entries.items():
+			if entry[MAC_ADDRESS] is None:
+				parts.append("{} (incomplete, {:d} queued)".format(ip_address, len(entry[QUEUE])))
+			else:
+				parts.append("{} at {} ({:.0f}s)".format(ip_address, entry[MAC_ADDRESS], entry[EXPIRES] - now))
+
+		return "\n".join(parts)
@@ -1,27 +1,35 @@
 # https://en.wikipedia.org/wiki/Address_Resolution_Protocol#Packet_structure
 
-REPLY = 0x02
+import struct
+
 from ethernet.mac_address import MacAddress
 from ethernet.ip4_address import Ip4Address
 
+REQUEST = 0x01
+REPLY = 0x02
+
+HEADER = struct.Struct("!HHBBH")    # htype, ptype, hlen, plen, oper
+PADDING = bytes(18)                 # pads an Ethernet/IPv4 ARP frame to 60 bytes
+
 
 class ArpFrame:
+    __slots__ = ("htype", "ptype", "hlen", "plen", "oper", "sha", "spa", "tha", "tpa")
+
     @classmethod
-    def from_buffer(cls, buf):
-        hlen = buf[4]
-        plen=buf[5]
-        sha_pos = 8
+    def from_buffer(cls, buf, offset=0, length=None):
+        (htype, ptype, hlen, plen, oper) = HEADER.unpack_from(buf, offset)
+        sha_pos = offset + 8
         spa_pos = sha_pos + hlen
         tha_pos = spa_pos + plen
         tpa_pos = tha_pos + hlen
         tend_pos = tpa_pos + plen
 
         return cls(
-            htype=buf[0] * 256 + buf[1],
-            ptype=buf[2] * 256 + buf[3],
+            htype=htype,
+            ptype=ptype,
             hlen=hlen,
             plen=plen,
-            oper=buf[6] * 256 + buf[7],
+            oper=oper,
             sha=MacAddress(buf[sha_pos:spa_pos]),
             spa=Ip4Address(buf[spa_pos:tha_pos]),
             tha=MacAddress(buf[tha_pos:tpa_pos]),
@@ -55,24 +63,14 @@ class ArpFrame:
         self.tpa = tpa
 
     def __bytes__(self):
-        ba = bytearray()
-
-        ba.append((self.htype >> 8) & 0xFF)
-        ba.append(self.htype & 0xFF)
-        ba.append((self.ptype >> 8) & 0xFF)
-        ba.append(self.ptype & 0xFF)
-        ba.append(self.hlen)
-        ba.append(self.plen)
-        ba.append(0)
-        ba.append(REPLY)
-
-        ba.extend(bytes(self.sha))
-        ba.extend(bytes(self.spa))
-        ba.extend(bytes(self.tha))
-        ba.extend(bytes(self.tpa))
-        ba.extend([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-
-        return bytes(ba)
+        return b"".join((
+            HEADER.pack(self.htype, self.ptype, self.hlen, self.plen, self.oper),
+            bytes(self.sha),
+            bytes(self.spa),
+            bytes(self.tha),
+            bytes(self.tpa),
+            PADDING
+        ))
 
     def __repr__(self):
         parts = [
@@ -0,0 +1,88 @@
+from ethernet.arp_frame import ArpFrame
+from ethernet.mac_address import MacAddress
+from ethernet.ip4_address import Ip4Address
+
+
+# Lazy ArpFrame, see EthernetFrameView.
+
+class ArpFrameView(ArpFrame):
+	__slots__ = ("buf", "offset", "end", "_addresses")
+
+	@classmethod
+	def from_buffer(cls, buf, offset=0, length=None):
+		return cls(buf, offset, length)
+
+
+	def __init__(self, buf, offset=0, length=None):
+		self.buf = buf
+		self.offset = offset
+		self.end = len(buf) if length is None else offset + length
+		self._addresses = None
+
+
+	@property
+	def htype(self):
+		return self.buf[self.offset] * 256 + self.buf[self.offset + 1]
+
+
+	@property
+	def ptype(self):
+		return self.buf[self.offset + 2] * 256 + self.buf[self.offset + 3]
+
+
+	@property
+	def hlen(self):
+		return self.buf[self.offset + 4]
+
+
+	@property
+	def plen(self):
+		return self.buf[self.offset + 5]
+
+
+	@property
+	def oper(self):
+		return self.buf[self.offset + 6] * 256 + self.buf[self.offset + 7]
+
+
+	@property
+	def sha(self):
+		return self.addresses()[0]
+
+
+	@property
+	def spa(self):
+		return self.addresses()[1]
+
+
+	@property
+	def tha(self):
+		return self.addresses()[2]
+
+
+	@property
+	def tpa(self):
+		return self.addresses()[3]
+
+
+	def addresses(self):
+		if self._addresses is None:
+			buf = self.buf
+			sha_pos = self.offset + 8
+			spa_pos = sha_pos + self.hlen
+			tha_pos = spa_pos + self.plen
+			tpa_pos = tha_pos + self.hlen
+			tend_pos = tpa_pos + self.plen
+
+			self._addresses = (
+				MacAddress(buf[sha_pos:spa_pos]),
+				Ip4Address(buf[spa_pos:tha_pos]),
+				MacAddress(buf[tha_pos:tpa_pos]),
+				Ip4Address(buf[tpa_pos:tend_pos]),
+			)
+
+		return self._addresses
+
+
+	def __bytes__(self):
+		return bytes(self.buf[self.offset:self.end])
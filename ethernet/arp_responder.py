@@ -0,0 +1,39 @@
+from ethernet.arp_frame import HEADER, REQUEST, REPLY, PADDING
+
+ETHERNET_ARP = HEADER.pack(0x0001, 0x0800, 6, 4, REQUEST)	# Ethernet/IPv4 request header
+
+
+# Answers ARP requests for our IPv4 address. The reply is a prebuilt 60 byte
+# frame; answering a request copies the sender addresses from the receive
+# buffer into it, nothing else is built or parsed.
+
+class ArpResponder(object):
+	def __init__(self, mac_address, ip_address):
+		mac_addr = bytes(mac_address)
+		self.ip_address = bytes(ip_address)
+		self.template = bytearray(
+			bytes(6) + mac_addr + b"\x08\x06" +
+			HEADER.pack(0x0001, 0x0800, 6, 4, REPLY) +
+			mac_addr + self.ip_address + bytes(10) +
+			PADDING
+		)
+		self.view = memoryview(self.template)
+		self.replies = 0
+
+
+	# Patch the reply for the request frame in buf and return a view of it, or
+	# None when buf is no Ethernet/IPv4 ARP request for our address. The view
+	# is only valid until the next call.
+	def reply(self, buf, offset=0):
+		if len(buf) - offset < 42 or buf[offset + 12] != 0x08 or buf[offset + 13] != 0x06:
+			return None
+
+		if buf[offset + 14:offset + 22] != ETHERNET_ARP or buf[offset + 38:offset + 42] != self.ip_address:
+			return None
+
+		template = self.template
+		template[0:6] = buf[offset + 22:offset + 28]		# to the sender
+		template[32:42] = buf[offset + 22:offset + 32]	# target = sender hardware and protocol address
+		self.replies += 1
+
+		return self.view
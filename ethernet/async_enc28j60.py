@@ -0,0 +1,177 @@
+import asyncio
+
+from ethernet.constants import *
+from ethernet.enc28j60 import Enc28j60
+
+
+# asyncio front end for an Enc28j60. Every wait of the blocking driver - clock
+# start after reset, MII busy, receive and free transmit slots - becomes an
+# await. The INT line is watched with loop.add_reader() when the driver has an
+# interrupt with a fileno(); otherwise pending work is polled every
+# poll_interval seconds. The SPI transfers themselves stay synchronous, they
+# take microseconds.
+#
+# Do not mix the blocking wait_for_packet() of the driver with this class.
+
+class AsyncEnc28j60(object):
+	def __init__(self, mac_address, bus=0, device=0, spi=None, interrupt=None, layout=None, driver=None):
+		if driver is None:
+			driver = Enc28j60(mac_address, bus, device, spi, interrupt, layout)
+
+		self.driver = driver
+		self.mac_address = driver.mac_address
+		self.interrupt = driver.interrupt
+		self.poll_interval = 0.001
+		self.recheck_interval = 0.1		# PKTIF is unreliable (Rev. B7 Silicon Errata point 6)
+		self.loop = None
+		self.rx_event = asyncio.Event()
+		self.tx_event = asyncio.Event()
+
+
+	async def initialize(self):
+		driver = self.driver
+
+		if driver.spi is None:
+			from ethernet.spi_device import SpiDevice
+			driver.spi = SpiDevice(driver.bus, driver.device)
+
+		driver.start_reset()
+
+		while not driver.clock_ready():
+			await asyncio.sleep(self.poll_interval)
+
+		# configure() does one PHY write, a single 10.24us MII wait
+		with driver.transaction():
+			driver.configure()
+
+		self.loop = asyncio.get_running_loop()
+
+		if self.interrupt is not None:
+			self.loop.add_reader(self.interrupt.fileno(), self.on_interrupt)
+
+
+	def close(self):
+		if self.loop is not None and self.interrupt is not None:
+			self.loop.remove_reader(self.interrupt.fileno())
+
+		self.loop = None
+
+
+	# INT fell: acknowledge the chip and wake whoever waits for it
+	def on_interrupt(self):
+		self.interrupt.clear()
+		flags = self.driver.service_interrupt()
+
+		if flags & (EIR_PKTIF | EIR_RXERIF) != 0:
+			self.rx_event.set()
+
+		if flags & (EIR_TXIF | EIR_TXERIF) != 0:
+			self.tx_event.set()
+
+
+	# Wait for event, or for poll_interval without an interrupt line. Callers
+	# check the chip again afterwards, so a missed event only costs time.
+	async def wait(self, event):
+		if self.interrupt is None:
+			await asyncio.sleep(self.poll_interval)
+			return
+
+		try:
+			await asyncio.wait_for(event.wait(), self.recheck_interval)
+		except asyncio.TimeoutError:
+			pass
+
+		event.clear()
+
+
+	async def read_phy(self, addr):
+		driver = self.driver
+		driver.start_phy_read(addr)
+
+		while driver.phy_busy():
+			await asyncio.sleep(0)
+
+		return driver.finish_phy_read()
+
+
+	async def write_phy(self, addr, value):
+		driver = self.driver
+		driver.start_phy_write(addr, value)
+
+		while driver.phy_busy():
+			await asyncio.sleep(0)
+
+
+	# See Enc28j60.is_link_up, only the wait for the first scan result differs
+	async def is_link_up(self):
+		driver = self.driver
+
+		if driver.link_up is not None and self.interrupt is not None:
+			return driver.link_up
+
+		if not driver.link_scan:
+			return driver.update_link(await self.read_phy(PHSTAT2) & PHSTAT2_LSTAT == PHSTAT2_LSTAT)
+
+		if not driver.scanning:
+			driver.start_link_scan()
+
+			while not driver.link_scan_ready():
+				await asyncio.sleep(0)
+
+		return driver.update_link(driver.scanned_link_up())
+
+
+	async def wait_for_packet(self):
+		driver = self.driver
+
+		if len(driver.tx_pending) > 0:
+			driver.kick_transmit()
+
+		while driver.read_byte(EPKTCNT) == 0:
+			if driver.tx_active is not None:
+				driver.kick_transmit()
+
+			await self.wait(self.rx_event)
+
+
+	# Next good frame as a bytearray
+	async def recv(self):
+		while True:
+			await self.wait_for_packet()
+			frame = self.driver.receive_packet()
+
+			if len(frame) > 0:
+				return frame
+
+
+	# Next good frame copied into buf, returns its length
+	async def recv_into(self, buf):
+		while True:
+			await self.wait_for_packet()
+			length = self.driver.receive_packet_into(buf)
+
+			if length > 0:
+				return length
+
+
+	async def wait_for_slot(self):
+		driver = self.driver
+
+		while len(driver.tx_free) == 0:
+			if not driver.kick_transmit():
+				await self.wait(self.tx_event)
+
+
+	# Queue frame for transmission, waiting for a free transmit slot first
+	async def send(self, frame, offload_checksums=False):
+		await self.wait_for_slot()
+		self.driver.send_packet(frame, offload_checksums)
+
+
+	# Wait until every queued frame has left the chip
+	async def flush(self):
+		driver = self.driver
+
+		while driver.tx_active is not None:
+			if not driver.kick_transmit():
+				await self.wait(self.tx_event)
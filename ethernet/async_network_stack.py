@@ -0,0 +1,52 @@
+import asyncio
+import errno
+
+from ethernet.network_stack import NetworkStack
+from ethernet.async_udp_socket import AsyncUdpSocket
+
+
+# NetworkStack driven by an AsyncEnc28j60. run() is the receive loop as a task
+# on the event loop; ARP, ping and UDP are handled there and AsyncUdpSocket
+# users await their datagrams next to it. The loop also runs the ARP retries
+# and expiry when no frames arrive. Replies from the handlers are queued with
+# the blocking send_packet(), which only waits while every transmit slot is
+# taken.
+#
+# TCP is not offered: TcpConnection and TcpListener wait in the blocking
+# NetworkStack.poll(), which must not run next to the receive task.
+
+class AsyncNetworkStack(NetworkStack):
+	def __init__(self, nic, ip_address, netmask="255.255.255.0", gateway=None):
+		NetworkStack.__init__(self, nic.driver, ip_address, netmask, gateway)
+		self.nic = nic
+
+
+	def socket(self, queue_size=16):
+		return AsyncUdpSocket(self, queue_size)
+
+
+	def tcp_socket(self, send_buffer_size=None, receive_buffer_size=None):
+		raise OSError(errno.EOPNOTSUPP, "TCP needs a blocking NetworkStack")
+
+
+	def listen(self, port, backlog=4):
+		raise OSError(errno.EOPNOTSUPP, "TCP needs a blocking NetworkStack")
+
+
+	async def run(self):
+		nic = self.nic
+		view = self.view
+
+		while True:
+			timeout = self.poll_timers(self.arp_cache.retry_interval)
+
+			try:
+				length = await asyncio.wait_for(nic.recv_into(self.buf), timeout)
+			except asyncio.TimeoutError:
+				continue
+
+			self.process(view[:length])
+
+
+	def start(self):
+		return asyncio.get_running_loop().create_task(self.run())
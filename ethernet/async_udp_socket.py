@@ -0,0 +1,52 @@
+import asyncio
+
+from ethernet.udp_socket import UdpSocket
+
+
+# UdpSocket for an AsyncNetworkStack: the receive calls and sendto are
+# coroutines. Use asyncio.wait_for() for timeouts.
+
+class AsyncUdpSocket(UdpSocket):
+	def __init__(self, stack, queue_size=16):
+		UdpSocket.__init__(self, stack, queue_size)
+		self.readable = asyncio.Event()
+
+
+	async def sendto(self, data, address):
+		await self.stack.nic.wait_for_slot()
+
+		return UdpSocket.sendto(self, data, address)
+
+
+	async def recvfrom(self, bufsize):
+		(data, address) = await self.receive()
+
+		return (bytes(data[:bufsize]), address)
+
+
+	async def recv_into(self, buf, nbytes=0):
+		return (await self.recvfrom_into(buf, nbytes))[0]
+
+
+	async def recvfrom_into(self, buf, nbytes=0):
+		(data, address) = await self.receive()
+		count = min(len(data), nbytes or len(buf))
+		buf[:count] = data[:count]
+
+		return (count, address)
+
+
+	async def receive(self):
+		if self.port is None:
+			raise OSError("socket is not bound")
+
+		while len(self.queue) == 0:
+			self.readable.clear()
+			await self.readable.wait()
+
+		return self.queue.popleft()
+
+
+	def deliver(self, data, address):
+		UdpSocket.deliver(self, data, address)
+		self.readable.set()
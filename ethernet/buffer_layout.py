@@ -0,0 +1,57 @@
+from ethernet.constants import *
+
+SRAM_SIZE = 0x2000
+TX_CONTROL_SIZE = 1		# per-packet control byte in front of the frame
+TX_STATUS_SIZE = 7		# transmit status vector written after the frame
+TX_SLOT_SIZE = 0x600	# default slot, the size of the original TX region
+
+
+# Split of the 8 KB buffer memory into the circular receive buffer at the bottom
+# and a number of equally sized transmit slots above it. The defaults give the
+# original RXSTART_INIT..RXSTOP_INIT / TXSTART_INIT..TXSTOP_INIT layout.
+
+class BufferLayout(object):
+	def __init__(self, rx_size=RXSTOP_INIT - RXSTART_INIT + 1, tx_slots=1, tx_slot_size=TX_SLOT_SIZE):
+		# The RXSTART_INIT must be zero. See Rev. B4 Silicon Errata point 5.
+		self.rx_start = RXSTART_INIT
+		self.rx_end = RXSTART_INIT + rx_size - 1
+		self.tx_slot_size = tx_slot_size
+		self.tx_slots = [self.rx_end + 1 + index * tx_slot_size for index in range(tx_slots)]
+		self.tx_start = self.rx_end + 1
+		self.tx_end = self.tx_start + tx_slots * tx_slot_size - 1
+
+		# ERXRDPT has to be odd, so the ring has to end on an odd address
+		if rx_size % 2 != 0:
+			raise ValueError("receive buffer size must be even, got {:d}".format(rx_size))
+
+		if rx_size < HEADER_SIZE + MAX_FRAMELEN + 4:
+			raise ValueError("receive buffer of {:d} bytes cannot hold a full frame".format(rx_size))
+
+		if tx_slots < 1:
+			raise ValueError("at least one transmit slot is required")
+
+		if tx_slot_size % 2 != 0 or tx_slot_size < TX_CONTROL_SIZE + MAX_FRAMELEN + TX_STATUS_SIZE:
+			raise ValueError("transmit slot size {:d} is odd or cannot hold a full frame".format(tx_slot_size))
+
+		if self.tx_end >= SRAM_SIZE:
+			raise ValueError("layout needs {:d} bytes, buffer memory has {:d}".format(self.tx_end + 1, SRAM_SIZE))
+
+
+	@property
+	def rx_size(self):
+		return self.rx_end - self.rx_start + 1
+
+
+	@property
+	def tx_capacity(self):
+		return self.tx_slot_size - TX_CONTROL_SIZE - TX_STATUS_SIZE
+
+
+	def __repr__(self):
+		parts = [
+			"rx  = {:04x}-{:04x}".format(self.rx_start, self.rx_end),
+			"tx  = {:04x}-{:04x}".format(self.tx_start, self.tx_end),
+			"slots = {:d} x {:d}".format(len(self.tx_slots), self.tx_slot_size),
+		]
+
+		return "\n".join(parts)
@@ -0,0 +1,50 @@
+# RFC 1071 internet checksum and RFC 1624 incremental updates
+#
+# 2**16 == 1 (mod 0xFFFF), so the one's complement sum of the 16 bit words of a
+# buffer is the buffer read as one big integer, folded mod 0xFFFF. That lets
+# int.from_bytes do the word loop in C for any bytes-like object.
+
+
+def ones_complement_sum(data, total=0):
+	value = int.from_bytes(data, "big")
+
+	if len(data) % 2 != 0:
+		value <<= 8
+
+	value += total
+
+	if value == 0:
+		return 0
+
+	return (value - 1) % 0xFFFF + 1		# a non-zero sum is never 0x0000 in one's complement
+
+
+def internet_checksum(data, total=0):
+	return ~ones_complement_sum(data, total) & 0xFFFF
+
+
+# Sum of the TCP/UDP pseudo header; pass it as total to internet_checksum()
+# together with the transport header and payload.
+def pseudo_header_sum(source_address, destination_address, protocol, length):
+	return ones_complement_sum(bytes(source_address) + bytes(destination_address), protocol + length)
+
+
+def transport_checksum(source_address, destination_address, protocol, data):
+	total = pseudo_header_sum(source_address, destination_address, protocol, len(data))
+
+	return internet_checksum(data, total)
+
+
+# A checksummed buffer, checksum field included, sums to 0xFFFF
+def verify_checksum(data, total=0):
+	return ones_complement_sum(data, total) == 0xFFFF
+
+
+# New checksum after a 16 bit word of the checksummed data changed from old to
+# new, HC' = ~(~HC + ~m + m') (RFC 1624, eqn. 3)
+def update_checksum(checksum, old, new):
+	total = (~checksum & 0xFFFF) + (~old & 0xFFFF) + new
+	total = (total & 0xFFFF) + (total >> 16)
+	total = (total & 0xFFFF) + (total >> 16)
+
+	return ~total & 0xFFFF
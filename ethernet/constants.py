@@ -119,6 +119,20 @@ PHIE = 0x12
 PHIR = 0x13
 PHLCON = 0x14
 
+# PHY PHSTAT1 register flags
+PHSTAT1_LLSTAT = 0x0004
+
+# PHY PHSTAT2 register flags
+PHSTAT2_LSTAT = 0x0400
+
+# PHY PHIE register flags
+PHIE_PGEIE = 0x0002
+PHIE_PLNKIE = 0x0010
+
+# PHY PHIR register flags
+PHIR_PGIF = 0x0004
+PHIR_PLNKIF = 0x0010
+
 # ERXFCON register flags
 ERXFCON_BCEN = 0x01
 ERXFCON_MCEN = 0x02
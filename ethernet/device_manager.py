@@ -0,0 +1,443 @@
+import math
+import select
+import threading
+import time
+
+from ethernet.constants import MAX_FRAMELEN
+from ethernet.receive_filter import ReceiveFilter
+
+# interface counters
+RECEIVED = 0
+FORWARDED = 1			# frames sent out for another interface
+FILTERED = 2			# not forwarded, the destination is on the port it came from
+INTERRUPTS = 3
+ERRORS = 4				# exceptions raised by the handler or the timers
+
+
+# Several Enc28j60 in one host, e.g. the two or three ports of a gateway. An
+# interface has a name, a driver, an optional handler that gets every frame
+# received on it (NetworkStack.process, ProtocolRegistry.dispatch) and
+# optional timers, called like NetworkStack.poll_timers with a timeout they may
+# cut down.
+#
+# SPI access is serialized per bus: drivers on the same bus (different chip
+# selects of one controller) share a lock, drivers on separate buses run
+# concurrently. An interface gets up to max_frames frames per turn before the
+# next one on its bus, so a busy port cannot starve a quiet one.
+#
+# poll() serves every interface from the calling thread, start() runs one
+# thread per bus instead. Waiting is a single poll(2) over the INT lines
+# (interrupts with a fileno()); interfaces without one are checked every
+# poll_interval seconds. Handlers and timers run with the lock of their bus
+# held and may use their own driver. Other interfaces are reached through
+# send(), which queues what a handler sends to another bus until its lock is
+# released, so a thread never holds two bus locks. An exception from a handler
+# or timer is counted and passed to on_handler_error, and the interface keeps
+# running; only errors of the drivers themselves end a bus thread.
+#
+# A stack added with add_stack() has its poll() pointed at the manager, so its
+# blocking sockets keep every interface served while they wait. With bus
+# threads running, other threads call into the stack only with lock(name)
+# held and without blocking; blocking TCP calls need poll() instead.
+#
+# forward() adds routes: frames received on an interface are also sent out on
+# others, straight from the receive buffer they were read into and before the
+# handler sees it, so a forwarded frame costs the two SPI transfers and no
+# copy in between. With learning the routes form a transparent bridge: source
+# addresses are learnt per interface, unicast frames only go where their
+# destination was last seen and are dropped when that is the port they came
+# from, everything else is flooded along the routes. Bridge ports need a
+# receive filter that passes every frame, see promiscuous().
+
+class DeviceManager(object):
+	def __init__(self, max_frames=4, learning=False, clock=time.monotonic, sleep=time.sleep):
+		self.max_frames = max_frames
+		self.learning = learning
+		self.clock = clock
+		self.sleep = sleep
+		self.poll_interval = 0.001
+		self.recheck_interval = 0.1		# PKTIF is unreliable (Rev. B7 Silicon Errata point 6)
+		self.address_age = 300.0		# IEEE 802.1D default ageing time
+		self.drivers = {}
+		self.handlers = {}
+		self.timers = {}
+		self.routes = {}
+		self.buses = {}
+		self.bus_locks = {}
+		self.buffers = {}
+		self.views = {}
+		self.counters = {}
+		self.checked = {}
+		self.stacks = {}
+		self.local = threading.local()	# bus and queued sends of a running handler
+		self.pending = set()			# INT line fell
+		self.busy = set()				# used up max_frames last turn
+		self.addresses = {}				# learnt source address: [name, time]
+		self.threads = []
+		self.running = False
+		self.error = None
+		self.on_handler_error = None		# called with the interface name and the exception
+
+
+	# Add driver as interface name. bus defaults to driver.bus; give drivers that
+	# bring their own transport distinct buses if they do not share one.
+	def add(self, name, driver, handler=None, timers=None, bus=None):
+		if name in self.drivers:
+			raise ValueError("interface {} exists".format(name))
+
+		if self.running:
+			raise ValueError("stop() the manager before adding interfaces")
+
+		bus = driver.bus if bus is None else bus
+		self.drivers[name] = driver
+		self.handlers[name] = handler
+		self.timers[name] = timers
+		self.routes[name] = []
+		self.buses[name] = bus
+		self.bus_locks.setdefault(bus, threading.RLock())
+		self.buffers[name] = bytearray(MAX_FRAMELEN)
+		self.views[name] = memoryview(self.buffers[name])
+		self.counters[name] = [0, 0, 0, 0, 0]
+		self.checked[name] = self.clock()
+
+		return driver
+
+
+	def add_stack(self, name, stack, bus=None):
+		self.add(name, stack.driver, stack.process, stack.poll_timers, bus)
+		self.stacks[name] = stack
+		stack.poll = self.poll_stack
+
+		return stack.driver
+
+
+	def remove(self, name):
+		if self.running:
+			raise ValueError("stop() the manager before removing interfaces")
+
+		for table in (self.drivers, self.handlers, self.timers, self.routes, self.buses, self.buffers, \
+				self.views, self.counters, self.checked):
+			del table[name]
+
+		if name in self.stacks:
+			del self.stacks.pop(name).poll
+
+		for routes in self.routes.values():
+			if name in routes:
+				routes.remove(name)
+
+		for (address, entry) in list(self.addresses.items()):
+			if entry[0] == name:
+				del self.addresses[address]
+
+		self.pending.discard(name)
+		self.busy.discard(name)
+
+
+	def lock(self, name):
+		return self.bus_locks[self.buses[name]]
+
+
+	def initialize(self):
+		for (name, driver) in self.drivers.items():
+			with self.lock(name):
+				driver.initialize()
+
+
+	# Frames received on source are also sent out on each of destinations
+	def forward(self, source, *destinations):
+		for name in (source,) + destinations:
+			if name not in self.drivers:
+				raise ValueError("no interface {}".format(name))
+
+		for name in destinations:
+			if name != source and name not in self.routes[source]:
+				self.routes[source].append(name)
+
+
+	# Forward in both directions between every pair of names
+	def bridge(self, *names):
+		for name in names:
+			self.forward(name, *names)
+
+
+	# Pass every frame with a valid CRC, as a bridge port must
+	def promiscuous(self, name):
+		with self.lock(name):
+			return self.drivers[name].set_receive_filter(ReceiveFilter())
+
+
+	def send(self, name, frame):
+		deferred = getattr(self.local, "deferred", None)
+
+		if deferred is not None and self.buses[name] != self.local.bus:
+			deferred.append((name, bytes(frame)))
+			return
+
+		with self.lock(name):
+			self.drivers[name].send_packet(frame)
+
+
+	# Call function with the lock of the bus of name held and send what it
+	# queued for other buses afterwards. Returns default when function raised.
+	def call_locked(self, name, function, *args, default=None):
+		self.local.bus = self.buses[name]
+		self.local.deferred = []
+		result = default
+
+		try:
+			with self.lock(name):
+				result = function(*args)
+		except Exception as error:
+			self.counters[name][ERRORS] += 1
+
+			if self.on_handler_error is not None:
+				self.on_handler_error(name, error)
+		finally:
+			deferred = self.local.deferred
+			self.local.deferred = None
+
+		for (port, frame) in deferred:
+			self.send(port, frame)
+
+		return result
+
+
+	# Receive up to max_frames frames on name and hand each to the handler and
+	# the routes. Returns the number of frames taken off the chip.
+	def service(self, name):
+		driver = self.drivers[name]
+		lock = self.lock(name)
+		buf = self.buffers[name]
+		view = self.views[name]
+		counters = self.counters[name]
+		count = 0
+
+		self.busy.discard(name)
+		self.checked[name] = self.clock()
+
+		while count < self.max_frames:
+			with lock:
+				if name in self.pending:
+					self.pending.discard(name)
+					driver.service_interrupt()
+
+				if not driver.wait_for_packet(0):
+					return count
+
+				length = driver.receive_packet_into(buf)
+				count += 1
+
+				if length == 0:
+					continue
+
+				frame = view[:length]
+				counters[RECEIVED] += 1
+				local = self.learn(name, frame)
+
+			# before the handler, which may turn the frame into its reply in place,
+			# and outside the lock: a thread on the other bus may be forwarding to us
+			for port in self.route(name, frame):
+				with self.lock(port):
+					self.drivers[port].send_packet(frame)
+					self.counters[port][FORWARDED] += 1
+
+			handler = self.handlers[name]
+
+			if handler is not None and local:
+				self.call_locked(name, handler, frame)
+
+		self.busy.add(name)
+
+		return count
+
+
+	# Record where the source of frame is. Returns False for a bridged frame to
+	# somebody else, which the handler does not need to see.
+	def learn(self, name, frame):
+		if not self.learning:
+			return True
+
+		if frame[6] & 0x01 == 0:
+			self.addresses[bytes(frame[6:12])] = [name, self.clock()]
+
+		return frame[0] & 0x01 == 0x01 or bytes(frame[0:6]) == bytes(self.drivers[name].mac_address)
+
+
+	# Interfaces frame goes out on next
+	def route(self, name, frame):
+		routes = self.routes[name]
+
+		if len(routes) == 0 or bytes(frame[0:6]) == bytes(self.drivers[name].mac_address):
+			return ()
+
+		if not self.learning or frame[0] & 0x01 == 0x01:
+			return routes
+
+		entry = self.addresses.get(bytes(frame[0:6]))
+
+		if entry is None or self.clock() - entry[1] > self.address_age:
+			return routes
+
+		if entry[0] == name:
+			self.counters[name][FILTERED] += 1
+			return ()
+
+		return (entry[0],) if entry[0] in routes else ()
+
+
+	def run_timers(self, names, timeout):
+		for name in names:
+			timers = self.timers[name]
+
+			if timers is not None:
+				timeout = self.call_locked(name, timers, timeout, default=timeout)
+
+		return timeout
+
+
+	# One turn for each of names that may have work: its INT line fell, it had
+	# more than max_frames pending last time, it has no INT line, or it was
+	# not looked at for recheck_interval seconds
+	def serve(self, names):
+		now = self.clock()
+		count = 0
+
+		for name in names:
+			if name in self.pending or name in self.busy or self.drivers[name].interrupt is None \
+					or now - self.checked[name] >= self.recheck_interval:
+				count += self.service(name)
+
+		return count
+
+
+	# Wait up to timeout seconds for the INT line of one of names to fall, no
+	# longer than poll_interval if one of them has none. A timeout of 0 only
+	# collects the edges that are already there.
+	def wait(self, names, timeout):
+		lines = {}
+
+		for name in names:
+			interrupt = self.drivers[name].interrupt
+
+			if interrupt is None:
+				timeout = min(timeout, self.poll_interval)
+			else:
+				lines[interrupt.fileno()] = name
+
+		if len(lines) == 0:
+			if timeout > 0:
+				self.sleep(timeout)
+
+			return
+
+		poller = select.poll()
+
+		for fd in lines:
+			poller.register(fd, select.POLLIN)
+
+		for (fd, _) in poller.poll(max(math.ceil(timeout * 1000), 0)):
+			name = lines[fd]
+			self.drivers[name].interrupt.clear()
+			self.pending.add(name)
+			self.counters[name][INTERRUPTS] += 1
+
+
+	# Run the timers of names, then receive, dispatch and forward what is pending,
+	# waiting up to timeout seconds for the first frame. Returns the number of
+	# frames handled.
+	def poll_interfaces(self, names, timeout=0):
+		timeout = self.run_timers(names, timeout)
+		deadline = None if timeout is None else self.clock() + timeout
+		wait = 0
+
+		while True:
+			self.wait(names, wait)
+			count = self.serve(names)
+			remaining = None if deadline is None else deadline - self.clock()
+
+			if count > 0 or (remaining is not None and remaining <= 0):
+				return count
+
+			wait = self.recheck_interval if remaining is None else min(remaining, self.recheck_interval)
+
+
+	def poll(self, timeout=0):
+		return self.poll_interfaces(list(self.drivers), timeout)
+
+
+	# Stands in for NetworkStack.poll() of the stacks added with add_stack()
+	def poll_stack(self, timeout=0, max_frames=None):
+		if not self.running:
+			return self.poll(timeout)
+
+		if timeout is None or timeout > 0:
+			self.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+
+		return 0
+
+
+	# One thread per bus, each serving the interfaces on its bus
+	def start(self):
+		if self.running:
+			return
+
+		self.running = True
+		self.error = None
+		buses = {}
+
+		for (name, bus) in self.buses.items():
+			buses.setdefault(bus, []).append(name)
+
+		for (bus, names) in buses.items():
+			thread = threading.Thread(target=self.run_bus, args=(names,), name="enc28j60 bus {}".format(bus))
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+
+	def run_bus(self, names):
+		try:
+			while self.running:
+				self.poll_interfaces(names, self.recheck_interval)
+		except Exception as error:
+			self.error = error
+			self.running = False
+
+
+	# Stop the bus threads. Raises what ended one of them early, if anything did.
+	def stop(self):
+		self.running = False
+
+		for thread in self.threads:
+			thread.join()
+
+		self.threads = []
+
+		if self.error is not None:
+			error = self.error
+			self.error = None
+			raise error
+
+
+	def __enter__(self):
+		self.start()
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		self.stop()
+
+
+	def __repr__(self):
+		lines = []
+
+		for (name, counters) in self.counters.items():
+			lines.append("{} (bus {}): received = {:d}, forwarded = {:d}, filtered = {:d}, interrupts = {:d}, errors = {:d}{}".format(
+				name, self.buses[name], counters[RECEIVED], counters[FORWARDED], counters[FILTERED], counters[INTERRUPTS],
+				counters[ERRORS],
+				"" if len(self.routes[name]) == 0 else ", routes to " + ", ".join(str(port) for port in self.routes[name])))
+
+		lines.append("learnt addresses = {:d}".format(len(self.addresses)))
+
+		return "\n".join(lines)
@@ -0,0 +1,229 @@
+import time
+
+# operation entry fields
+CALLS = 0
+SECONDS = 1
+MAX_SECONDS = 2
+HISTOGRAM = 3
+
+BUCKETS = 24			# bucket 0 is below 1us, bucket n is 2**(n-1) up to 2**n us
+
+# driver methods that get timed; nested calls count for each level
+OPERATIONS = (
+	"read_byte",
+	"write_byte",
+	"write_short",
+	"read_buffer",
+	"read_buffer_into",
+	"write_buffer",
+	"read_phy",
+	"write_phy",
+	"receive_packet",
+	"receive_packet_into",
+	"receive_burst",
+	"send_packet",
+	"flush_transmit",
+	"wait_for_packet",
+	"service_interrupt",
+	"dma_checksum",
+)
+
+TRANSPORT_CALLS = ("xfer2", "xfer_many", "xfer_into")
+
+
+def new_entry():
+	return [0, 0.0, 0.0, [0] * BUCKETS]
+
+
+# Opt-in counters for an Enc28j60: calls, time and a latency histogram per
+# operation, SPI calls, messages and bytes, bank switches and the busy-wait
+# polls of the MII (MISTAT.BUSY) and the transmitter (TXRTS).
+#
+# enable() wraps the methods of this one driver and of its SPI transport in
+# instance attributes and disable() removes them again, so a driver that is
+# not instrumented runs the plain methods at no cost at all. Enable it after
+# initialize(), which opens the transport.
+
+class DriverInstrumentation(object):
+	def __init__(self, driver, clock=time.perf_counter):
+		self.driver = driver
+		self.clock = clock
+		self.wrapped = []
+		self.operations = {name: new_entry() for name in OPERATIONS + TRANSPORT_CALLS}
+		self.reset()
+
+
+	def reset(self):
+		for entry in self.operations.values():
+			entry[:] = new_entry()
+
+		self.transport_calls = 0
+		self.messages = 0
+		self.bytes = 0
+		self.bank_switches = 0
+		self.phy_busy_polls = 0
+		self.tx_busy_polls = 0
+
+
+	@property
+	def enabled(self):
+		return len(self.wrapped) > 0
+
+
+	def enable(self):
+		driver = self.driver
+		spi = driver.spi
+
+		if self.enabled:
+			return self
+
+		if spi is None:
+			raise ValueError("the driver has no SPI transport yet, call initialize() first")
+
+		for name in OPERATIONS:
+			self.wrap(driver, name, self.timed(name, getattr(driver, name)))
+
+		self.wrap(driver, "set_bank", self.counted_set_bank(driver.set_bank))
+		self.wrap(driver, "phy_busy", self.counted_phy_busy(driver.phy_busy))
+		self.wrap(driver, "kick_transmit", self.counted_kick_transmit(driver.kick_transmit))
+
+		for name in TRANSPORT_CALLS:
+			function = getattr(spi, name, None)
+
+			if function is not None:
+				self.wrap(spi, name, self.timed(name, self.counted_transport(name, function)))
+
+		return self
+
+
+	def disable(self):
+		for (target, name) in reversed(self.wrapped):
+			delattr(target, name)
+
+		self.wrapped = []
+
+
+	def wrap(self, target, name, function):
+		setattr(target, name, function)
+		self.wrapped.append((target, name))
+
+
+	def timed(self, name, function):
+		entry = self.operations[name]
+		clock = self.clock
+
+		def timed_function(*args, **kwargs):
+			start = clock()
+
+			try:
+				return function(*args, **kwargs)
+			finally:
+				elapsed = clock() - start
+				entry[CALLS] += 1
+				entry[SECONDS] += elapsed
+
+				if elapsed > entry[MAX_SECONDS]:
+					entry[MAX_SECONDS] = elapsed
+
+				entry[HISTOGRAM][min(int(elapsed * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+		return timed_function
+
+
+	def counted_transport(self, name, function):
+		def counted_function(*args):
+			self.transport_calls += 1
+
+			if name == "xfer2":
+				self.messages += 1
+				self.bytes += len(args[0])
+			elif name == "xfer_many":
+				self.messages += len(args[0])
+				self.bytes += sum(len(message) for message in args[0])
+			else:
+				messages = args[2] if len(args) > 2 else ()
+				self.messages += len(messages) + 1
+				self.bytes += len(args[0]) + len(args[1]) + sum(len(message) for message in messages)
+
+			return function(*args)
+
+		return counted_function
+
+
+	def counted_set_bank(self, function):
+		driver = self.driver
+
+		def set_bank(bank):
+			before = driver.current_bank
+			function(bank)
+
+			if driver.current_bank != before:
+				self.bank_switches += 1
+
+		return set_bank
+
+
+	def counted_phy_busy(self, function):
+		def phy_busy():
+			busy = function()
+
+			if busy:
+				self.phy_busy_polls += 1
+
+			return busy
+
+		return phy_busy
+
+
+	def counted_kick_transmit(self, function):
+		def kick_transmit():
+			done = function()
+
+			if not done:
+				self.tx_busy_polls += 1
+
+			return done
+
+		return kick_transmit
+
+
+	# Plain dict copy of every counter, for logging or for the difference of two
+	# snapshots around the code of interest. Histograms map the upper bound of
+	# a bucket in microseconds to its count and leave out empty buckets.
+	def snapshot(self):
+		operations = {}
+
+		for (name, entry) in self.operations.items():
+			if entry[CALLS] == 0:
+				continue
+
+			operations[name] = {
+				"calls": entry[CALLS],
+				"seconds": entry[SECONDS],
+				"max_seconds": entry[MAX_SECONDS],
+				"histogram": {1 << index: count for (index, count) in enumerate(entry[HISTOGRAM]) if count > 0},
+			}
+
+		return {
+			"transport_calls": self.transport_calls,
+			"messages": self.messages,
+			"bytes": self.bytes,
+			"bank_switches": self.bank_switches,
+			"phy_busy_polls": self.phy_busy_polls,
+			"tx_busy_polls": self.tx_busy_polls,
+			"operations": operations,
+		}
+
+
+	def __repr__(self):
+		lines = [
+			"transport calls = {:d}, messages = {:d}, bytes = {:d}".format(self.transport_calls, self.messages, self.bytes),
+			"bank switches = {:d}, phy busy polls = {:d}, tx busy polls = {:d}".format(self.bank_switches, self.phy_busy_polls, self.tx_busy_polls),
+		]
+
+		for (name, entry) in self.operations.items():
+			if entry[CALLS] > 0:
+				lines.append("{:<20s} {:>8d} calls {:>10.1f} us avg {:>10.1f} us max".format(
+					name, entry[CALLS], entry[SECONDS] / entry[CALLS] * 1e6, entry[MAX_SECONDS] * 1e6))
+
+		return "\n".join(lines)
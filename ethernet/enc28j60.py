@@ -1,21 +1,151 @@
+from collections import deque
+from contextlib import contextmanager
+from ethernet.buffer_layout import BufferLayout
+from ethernet.checksum import internet_checksum, pseudo_header_sum
+from ethernet.receive_filter import ReceiveFilter
 from ethernet.constants import *
-import spidev
 import struct
+import time
+
+RECEIVE_HEADER = struct.Struct("<HHH")
+READ_BUFFER_COMMAND = bytes([ENC28J60_READ_BUF_MEM])
+
+# offset of the checksum field in the ICMP, TCP and UDP headers
+CHECKSUM_FIELDS = {
+	1: 2,
+	6: 16,
+	17: 6,
+}
+
+# Control registers that only the host changes. Writes are mirrored in a shadow
+# copy so that re-writing an unchanged value or reading it back costs no SPI
+# traffic. ERDPT and EWRPT also move with buffer memory access; the shadow
+# follows them.
+SHADOWED_REGISTERS = frozenset([
+	ERDPT, ERDPT + 1, EWRPT, EWRPT + 1, ETXST, ETXST + 1, ETXND, ETXND + 1,
+	ERXST, ERXST + 1, ERXND, ERXND + 1, ERXRDPT, ERXRDPT + 1,
+	EDMAST, EDMAST + 1, EDMAND, EDMAND + 1, EDMADST, EDMADST + 1,
+	EHT0, EHT1, EHT2, EHT3, EHT4, EHT5, EHT6, EHT7,
+	EPMM0, EPMM1, EPMM2, EPMM3, EPMM4, EPMM5, EPMM6, EPMM7,
+	EPMCS, EPMCS + 1, EPMO, EPMO + 1, ERXFCON,
+	MACON1, MACON3, MACON4, MABBIPG, MAIPG, MAIPG + 1, MACLCON1, MACLCON2,
+	MAMXFL, MAMXFL + 1, MIREGADR,
+	MAADR0, MAADR1, MAADR2, MAADR3, MAADR4, MAADR5,
+	ECOCON, EFLOCON, EPAUS, EPAUS + 1,
+])
 
 
 class Enc28j60(object):
-	def __init__(self, mac_address, bus=0, device=0):
+	# spi may be any transport with an xfer2() method, e.g. an Enc28j60Simulator.
+	# When omitted, initialize() opens spidev on the given bus/device. interrupt
+	# is an optional INT pin source such as GpioInterrupt; without it
+	# wait_for_packet() falls back to polling. layout is a BufferLayout that
+	# splits buffer memory between the receive ring and the transmit slots.
+	def __init__(self, mac_address, bus=0, device=0, spi=None, interrupt=None, layout=None):
 		self.mac_address = mac_address
 		self.bus = bus
 		self.device = device
 		self.current_bank = -1
-		self.spi = None
-		self.packet_ptr = RXSTART_INIT
-
-
+		self.spi = spi
+		self.layout = BufferLayout() if layout is None else layout
+		self.packet_ptr = self.layout.rx_start
+		self.tx_free = deque(self.layout.tx_slots)
+		self.tx_pending = deque()
+		self.tx_active = None
+		self.batch_depth = 0
+		self.pending = []
+		self.registers = {}
+		self.header = bytearray(HEADER_SIZE)
+		self.interrupt = interrupt
+		self.poll_interval = 0.001
+		self.recheck_interval = 0.1		# EPKTCNT is read again after this long without an interrupt
+		# a simulated transport brings its own clock
+		self.clock = getattr(spi, "monotonic", time.monotonic)
+		self.sleep = getattr(spi, "sleep", time.sleep)
+		self.receive_errors = 0
+		self.transmit_errors = 0
+		self.verify_ip_checksums = False
+		self.checksum_errors = 0
+		self.receive_filter = None
+		self.filtered_frames = 0
+		self.capture = None			# gets every good frame read, e.g. a PcapWriter
+		self.link_scan = True
+		self.scanning = False
+		self.link_up = None
+		self.on_link_change = None
+		self.on_transmit = None
+		self.on_receive_error = None
+
+
+	# Link state from a cache. With an interrupt line, LINKIF keeps link_up up
+	# to date: a check services a pending edge first and otherwise costs no SPI
+	# traffic. Without one the MII scans PHSTAT2 continuously (link_scan) and a
+	# check is a single MIRDH read.
 	@property
 	def is_link_up(self):
-		return self.read_phy(PHSTAT2) & 0x0400 == 0x0400
+		if self.link_up is not None and self.interrupt is not None:
+			if self.interrupt.clear():
+				self.service_interrupt()
+
+			return self.link_up
+
+		return self.update_link(self.read_link())
+
+
+	def read_link(self):
+		if not self.link_scan:
+			return self.read_phy(PHSTAT2) & PHSTAT2_LSTAT == PHSTAT2_LSTAT
+
+		if not self.scanning:
+			self.start_link_scan()
+
+			while not self.link_scan_ready():
+				pass
+
+		return self.scanned_link_up()
+
+
+	# Record the link state and report transitions to on_link_change
+	def update_link(self, up):
+		previous = self.link_up
+		self.link_up = up
+
+		if previous is not None and up != previous and self.on_link_change is not None:
+			self.on_link_change(up)
+
+		return up
+
+
+	# Let the MII read PHSTAT2 into MIRDH/MIRDL every 10.24us. Any other PHY
+	# access stops the scan first; the next link check starts it again.
+	def start_link_scan(self):
+		with self.transaction():
+			self.write_byte(MIREGADR, PHSTAT2)
+			self.write_byte(MICMD, MICMD_MIISCAN)
+
+		self.scanning = True
+
+
+	# MISTAT.NVALID clears once the first scan result is in MIRDH/MIRDL
+	def link_scan_ready(self):
+		return self.read_byte(MISTAT) & MISTAT_NVALID == 0
+
+
+	def scanned_link_up(self):
+		return self.read_byte(MIRDH) & (PHSTAT2_LSTAT >> 8) != 0
+
+
+	def stop_link_scan(self):
+		if not self.scanning:
+			return
+
+		self.scanning = False
+
+		with self.transaction():
+			self.write_byte(MICMD, 0x00)
+
+			while self.phy_busy():
+				pass
 
 
 	@property
@@ -25,24 +155,29 @@ class Enc28j60(object):
 
 	def initialize(self):
 		# connect and configure device
-		self.spi = spidev.SpiDev()
-		self.spi.open(self.bus, self.device)
-		self.spi.cshigh = False	# active low
-		self.spi.threewire = False
-		self.spi.lsbfirst = False
-		self.spi.loop = False
-		self.spi.bits_per_word = 8
-		self.spi.max_speed_hz = 2000000
+		if self.spi is None:
+			from ethernet.spi_device import SpiDevice
+			self.spi = SpiDevice(self.bus, self.device)
 
 		# reset device
 		self.soft_reset()
 
+		with self.transaction():
+			self.configure()
+
+
+	def configure(self):
 		# setup buffers
-		self.write_short(ERXST, RXSTART_INIT)		# Set receive buffer start address
-		self.write_short(ERXRDPT, RXSTART_INIT)		# Set receive pointer address
-		self.write_short(ERXND, RXSTOP_INIT)		# Rx End
-		self.write_short(ETXST, TXSTART_INIT)		# Tx Start
-		self.write_short(ETXND, TXSTOP_INIT)		# Tx End
+		layout = self.layout
+		self.packet_ptr = layout.rx_start
+		self.tx_free = deque(layout.tx_slots)
+		self.tx_pending = deque()
+		self.tx_active = None
+		self.write_short(ERXST, layout.rx_start)	# Set receive buffer start address
+		self.write_short(ERXRDPT, layout.rx_start)	# Set receive pointer address
+		self.write_short(ERXND, layout.rx_end)		# Rx End
+		self.write_short(ETXST, layout.tx_start)	# Tx Start
+		self.write_short(ETXND, layout.tx_end)		# Tx End
 
 		# setup MAC
 		self.write_byte(MACON1, MACON1_MARXEN | MACON1_TXPAUS | MACON1_RXPAUS)	# Enable MAC receive
@@ -67,20 +202,147 @@ class Enc28j60(object):
 		self.write_byte(MAADR1, mac_addr[4])
 		self.write_byte(MAADR0, mac_addr[5])
 
+		if self.receive_filter is not None:
+			self.program_receive_filter()
+
 		#write_phy(PHCON2, PHCON2_HDLDIS)	# No loopback of transmitted frames
+		self.write_phy(PHIE, PHIE_PGEIE | PHIE_PLNKIE)						# Report link changes
+		self.link_up = None
 
 		self.set_bank(ECON1)													# Switch to bank 0
-		self.write_op(ENC28J60_BIT_FIELD_SET, EIE, EIE_INTIE | EIE_PKTIE)		# Enable interrutps
+		self.write_op(															# Enable interrutps
+			ENC28J60_BIT_FIELD_SET,
+			EIE,
+			EIE_INTIE | EIE_PKTIE | EIE_LINKIE | EIE_TXIE | EIE_TXERIE | EIE_RXERIE
+		)
 		self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, ECON1_RXEN)				# Enable packet reception
 
 
+	# Queue SPI operations instead of sending each one as its own xfer2 call.
+	# Queued operations go out in as few transport calls as possible when the
+	# outermost transaction ends, or earlier when a read needs its result.
+	# When the transaction fails the queued writes are dropped, so the shadowed
+	# registers and the bank are read from the chip again and the receive
+	# pointer goes back to where the transaction found it.
+	@contextmanager
+	def transaction(self):
+		packet_ptr = self.packet_ptr
+		self.batch_depth += 1
+
+		try:
+			yield self
+		except BaseException:
+			self.batch_depth -= 1
+
+			if self.batch_depth == 0:
+				self.abort(packet_ptr)
+
+			raise
+
+		self.batch_depth -= 1
+
+		if self.batch_depth == 0:
+			try:
+				self.flush()
+			except BaseException:
+				self.abort(packet_ptr)
+				raise
+
+
+	def abort(self, packet_ptr):
+		self.pending = []
+		self.packet_ptr = packet_ptr
+		self.invalidate_registers()
+
+
+	def flush(self):
+		messages = self.pending
+
+		if len(messages) == 0:
+			return []
+
+		self.pending = []
+
+		if len(messages) == 1:
+			return [self.spi.xfer2(messages[0])]
+
+		xfer_many = getattr(self.spi, "xfer_many", None)
+
+		if xfer_many is None:
+			return [self.spi.xfer2(message) for message in messages]
+
+		return xfer_many(messages)
+
+
+	def transfer(self, data):
+		if self.batch_depth > 0:
+			self.pending.append(data)
+			return None
+
+		return self.spi.xfer2(data)
+
+
+	def transfer_read(self, data):
+		if len(self.pending) > 0:
+			self.pending.append(data)
+			return self.flush()[-1]
+
+		return self.spi.xfer2(data)
+
+
 	def set_bank(self, bank):
 		bank = bank & BANK_MASK
 
 		if bank != self.current_bank:
+			# only touch the select bits that differ from the current bank
+			if self.current_bank < 0:
+				clear_bits = ECON1_BSEL1 | ECON1_BSEL0
+				set_bits = bank >> 5
+			else:
+				clear_bits = (self.current_bank & ~bank) >> 5
+				set_bits = (bank & ~self.current_bank) >> 5
+
 			self.current_bank = bank
-			self.write_op(ENC28J60_BIT_FIELD_CLR, ECON1, ECON1_BSEL1 | ECON1_BSEL0)
-			self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, self.current_bank >> 5)
+
+			if clear_bits != 0:
+				self.write_op(ENC28J60_BIT_FIELD_CLR, ECON1, clear_bits)
+
+			if set_bits != 0:
+				self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, set_bits)
+
+
+	def invalidate_registers(self):
+		self.registers = {}
+		self.current_bank = -1
+
+
+	def shadow_short(self, addr):
+		low = self.registers.get(addr)
+		high = self.registers.get(addr + 1)
+
+		if low is None or high is None:
+			return None
+
+		return high << 8 | low
+
+
+	def advance_pointer(self, addr, count):
+		ptr = self.shadow_short(addr)
+
+		if ptr is None:
+			return
+
+		start = self.shadow_short(ERXST)
+		end = self.shadow_short(ERXND)
+
+		# ERDPT wraps from ERXND back to ERXST inside the receive buffer
+		if addr == ERDPT and start is not None and end is not None and start <= ptr <= end:
+			ptr = start + (ptr - start + count) % (end - start + 1)
+		else:
+			ptr = (ptr + count) & 0x1FFF
+
+		self.registers[addr] = ptr & 0xFF
+		self.registers[addr + 1] = ptr >> 8
 
 
 	def read_op(self, opcode, addr):
@@ -89,121 +351,530 @@ class Enc28j60(object):
 		if addr & 0x80:
 			data.append(0x00)
 
-		value = self.spi.xfer2(data)
+		value = self.transfer_read(data)
 		# log("op {:d} @ {:d} = {}".format(opcode, addr, value))
 
 		return value[-1]
 
 
 	def read_byte(self, addr):
-		self.set_bank(addr)
-		return self.read_op(ENC28J60_READ_CTRL_REG, addr)
+		value = self.registers.get(addr)
+
+		if value is not None:
+			return value
+
+		with self.transaction():
+			if addr & ADDR_MASK < EIE:
+				self.set_bank(addr)
+
+			return self.read_op(ENC28J60_READ_CTRL_REG, addr)
 
 
 	def read_buffer(self, size):
-		buf = [0] * size
-		buf.insert(0, ENC28J60_READ_BUF_MEM)
-		data = self.spi.xfer2(buf)
+		buf = [0] * (size + 1)
+		buf[0] = ENC28J60_READ_BUF_MEM
+		data = self.transfer_read(buf)
+		self.advance_pointer(ERDPT, size)
 
 		return data[1:]
 
 
+	# Fill buf, a writable bytearray or memoryview, from buffer memory without
+	# building intermediate lists when the transport supports xfer_into().
+	def read_buffer_into(self, buf):
+		xfer_into = getattr(self.spi, "xfer_into", None)
+
+		if xfer_into is None:
+			buf[:] = bytes(self.read_buffer(len(buf)))
+			return
+
+		messages = self.pending
+		self.pending = []
+		xfer_into(READ_BUFFER_COMMAND, buf, messages)
+		self.advance_pointer(ERDPT, len(buf))
+
+
 	def write_buffer(self, buf):
 		data = list(buf)
 		data.insert(0, ENC28J60_WRITE_BUF_MEM)
-		self.spi.xfer2(data)
+		self.transfer(data)
+		self.advance_pointer(EWRPT, len(data) - 1)
 
 
 	def write_op(self, opcode, addr, data):
+		if opcode == ENC28J60_WRITE_BUF_MEM:
+			self.advance_pointer(EWRPT, 1)
+		elif addr in self.registers:
+			if opcode == ENC28J60_BIT_FIELD_SET:
+				self.registers[addr] |= data
+			elif opcode == ENC28J60_BIT_FIELD_CLR:
+				self.registers[addr] &= ~data
+
 		addr = addr & ADDR_MASK
 
-		return self.spi.xfer2([opcode | addr, data])
+		return self.transfer([opcode | addr, data])
 
 
 	def write_byte(self, addr, value):
-		self.set_bank(addr)
-		self.write_op(ENC28J60_WRITE_CTRL_REG, addr, value)
+		if addr in SHADOWED_REGISTERS:
+			if self.registers.get(addr) == value:
+				return
+
+			self.registers[addr] = value
+
+		with self.transaction():
+			if addr & ADDR_MASK < EIE:
+				self.set_bank(addr)
+
+			self.write_op(ENC28J60_WRITE_CTRL_REG, addr, value)
 
 
 	def write_short(self, addr, value):
-		self.write_byte(addr, value & 0xFF)
-		self.write_byte(addr + 1, (value >> 8) & 0xFF)
+		# both halves go out when either changed, since some pointers only
+		# latch on the high byte write
+		if self.shadow_short(addr) == value:
+			return
 
-	def read_phy(self, addr):
-		self.write_byte(MIREGADR, addr)
-		self.write_byte(MICMD, MICMD_MIIRD)
+		with self.transaction():
+			self.registers.pop(addr, None)
+			self.registers.pop(addr + 1, None)
+			self.write_byte(addr, value & 0xFF)
+			self.write_byte(addr + 1, (value >> 8) & 0xFF)
 
-		while self.read_byte(MISTAT) & MISTAT_BUSY == MISTAT_BUSY:
-			pass
 
-		self.write_byte(MICMD, 0x00)
+	def read_phy(self, addr):
+		with self.transaction():
+			self.start_phy_read(addr)
 
-		return self.read_byte(MIRDH) * 256 + self.read_byte(MIRDL)
+			while self.phy_busy():
+				pass
+
+			return self.finish_phy_read()
 
 
 	def write_phy(self, addr, value):
-		self.write_byte(MIREGADR, addr)
-		self.write_short(MIWRL, value)
-		self.write_short(MIWRH, (value >> 8) & 0xFF)
-		
-		while self.read_byte(MISTAT) & MISTAT_BUSY == MISTAT_BUSY:
-			pass
+		with self.transaction():
+			self.start_phy_write(addr, value)
+
+			while self.phy_busy():
+				pass
+
+
+	# The MII steps of read_phy/write_phy, for callers that want to do something
+	# else during the 10.24us the MII is busy (see AsyncEnc28j60)
+	def start_phy_read(self, addr):
+		self.stop_link_scan()
+
+		with self.transaction():
+			self.write_byte(MIREGADR, addr)
+			self.write_byte(MICMD, MICMD_MIIRD)
+
+
+	def finish_phy_read(self):
+		with self.transaction():
+			self.write_byte(MICMD, 0x00)
+
+			return self.read_byte(MIRDH) * 256 + self.read_byte(MIRDL)
+
+
+	def start_phy_write(self, addr, value):
+		self.stop_link_scan()
+
+		with self.transaction():
+			self.write_byte(MIREGADR, addr)
+			self.write_byte(MIWRL, value & 0xFF)
+			self.write_byte(MIWRH, (value >> 8) & 0xFF)			# starts the MII write
+
+
+	def phy_busy(self):
+		return self.read_byte(MISTAT) & MISTAT_BUSY == MISTAT_BUSY
+
+
+	# Block until a frame is pending or timeout seconds passed. EPKTCNT is the
+	# source of truth since PKTIF is unreliable (Rev. B7 Silicon Errata point 6),
+	# so the INT line is never waited on longer than recheck_interval. A frame
+	# queued behind the one on the wire is started first, also when frames keep
+	# arriving and the wait returns at once.
+	def wait_for_packet(self, timeout=None):
+		deadline = None if timeout is None else self.clock() + timeout
+
+		if len(self.tx_pending) > 0:
+			self.kick_transmit()
+
+		while self.read_byte(EPKTCNT) == 0:
+			if self.tx_active is not None:
+				self.kick_transmit()
+
+			remaining = None if deadline is None else deadline - self.clock()
+
+			if remaining is not None and remaining <= 0:
+				return False
+
+			if self.interrupt is None:
+				self.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+			elif self.interrupt.wait(self.recheck_interval if remaining is None else min(remaining, self.recheck_interval)):
+				self.service_interrupt()
+
+		return True
+
+
+	# Read EIR and acknowledge what it reports. INTIE is dropped while flags are
+	# handled so that re-enabling it produces a fresh falling edge on INT for
+	# anything still pending. Returns the EIR flags seen.
+	def service_interrupt(self):
+		link_changed = False
+
+		with self.transaction():
+			self.write_op(ENC28J60_BIT_FIELD_CLR, EIE, EIE_INTIE)
+			flags = self.read_byte(EIR)
+
+			if flags & EIR_LINKIF == EIR_LINKIF:
+				self.read_phy(PHIR)						# reading PHIR clears LINKIF
+				link_changed = True
+
+			if flags & EIR_TXERIF == EIR_TXERIF:
+				self.reset_transmit_logic()
+
+			if flags & EIR_RXERIF == EIR_RXERIF:
+				self.receive_errors += 1
+
+			if flags & (EIR_TXIF | EIR_TXERIF | EIR_RXERIF) != 0:
+				self.write_op(ENC28J60_BIT_FIELD_CLR, EIR, flags & (EIR_TXIF | EIR_TXERIF | EIR_RXERIF))
+
+			self.write_op(ENC28J60_BIT_FIELD_SET, EIE, EIE_INTIE)
+
+			if flags & (EIR_TXIF | EIR_TXERIF) != 0 and self.tx_active is not None:
+				self.kick_transmit()
+
+		if link_changed:
+			self.update_link(self.read_link())
+
+		if flags & (EIR_TXIF | EIR_TXERIF) != 0 and self.on_transmit is not None:
+			self.on_transmit(flags & EIR_TXERIF == 0)
+
+		if flags & EIR_RXERIF == EIR_RXERIF and self.on_receive_error is not None:
+			self.on_receive_error()
+
+		return flags
 
 
 	def receive_packet(self):
-		data = []
+		with self.transaction():
+			return self._receive_packet(None)
+
+
+	# Receive the next frame into buf and return its length, 0 when nothing was
+	# pending or the frame was bad. buf is meant to be allocated once and reused;
+	# frames longer than buf are truncated. Frames parsed from a memoryview of buf
+	# refer to it and are only valid until the next call.
+	def receive_packet_into(self, buf):
+		with self.transaction():
+			return len(self._receive_packet(buf))
+
+
+	def _receive_packet(self, buf):
+		data = bytearray()
 		packet_count = self.read_byte(EPKTCNT)
 
 		if packet_count > 0:
 			# log("packet count = {:d}".format(packet_count))
 			self.write_short(ERDPT, self.packet_ptr)
-			header = self.read_buffer(HEADER_SIZE)
-			(next_packet, count, status) = struct.unpack("<HHH", bytes(header))
-			
+			self.read_buffer_into(self.header)
+			(next_packet, count, status) = RECEIVE_HEADER.unpack(self.header)
+
 			# log("header = {}".format(header))
 			# log("next={}, count={}, status={}".format(next_packet, count, status))
 			# log("packet_addr={}".format(packet_ptr))
 
+			data_ptr = self.ring_address(self.packet_ptr, HEADER_SIZE)
 			self.packet_ptr = next_packet
 			length = count - 4			# remove CRC
 
 			if status & RECEIVE_OK == RECEIVE_OK:
-				data = self.read_buffer(length)
-			
-			if self.packet_ptr - 1 > RXSTOP_INIT:
-				self.write_short(ERXRDPT, RXSTOP_INIT)
+				if buf is None:
+					data = bytearray(length)
+				else:
+					data = memoryview(buf)[:length]
+
+				if len(data) > 0:
+					self.read_buffer_into(data)
+
+				if self.capture is not None:
+					self.capture.write(data)
+
+				if not self.accept_frame(data_ptr, data):
+					data = data[:0]
+
+			self.free_receive_buffer(1)
+
+		return data
+
+
+	# Receive up to max_frames pending frames with one EPKTCNT read. Each frame
+	# is read together with its FCS, padding and the following receive header
+	# in a single buffer read that relies on ERDPT wrapping inside the receive
+	# buffer, and the space is handed back once for the whole batch.
+	def receive_burst(self, max_frames=None):
+		frames = []
+
+		with self.transaction():
+			count = self.read_byte(EPKTCNT)
+
+			if max_frames is not None:
+				count = min(count, max_frames)
+
+			if count == 0:
+				return frames
+
+			self.write_short(ERDPT, self.packet_ptr)
+			self.read_buffer_into(self.header)
+
+			for index in range(count):
+				(next_packet, byte_count, status) = RECEIVE_HEADER.unpack(self.header)
+				data_ptr = self.ring_address(self.packet_ptr, HEADER_SIZE)
+
+				# distance to the next packet: frame, FCS and alignment padding
+				span = (next_packet - data_ptr) % self.layout.rx_size
+
+				if index < count - 1:
+					data = bytearray(span + HEADER_SIZE)
+					self.read_buffer_into(data)
+					self.header[:] = data[span:]
+				else:
+					data = bytearray(span)
+					self.read_buffer_into(data)
+
+				del data[byte_count - 4:]		# remove CRC
+				self.packet_ptr = next_packet
+
+				if status & RECEIVE_OK != RECEIVE_OK:
+					continue
+
+				if self.capture is not None:
+					self.capture.write(data)
+
+				if not self.accept_frame(data_ptr, data):
+					continue
+
+				frames.append(data)
+
+			self.free_receive_buffer(count)
+
+		return frames
+
+
+	def ring_address(self, ptr, offset):
+		ptr += offset
+
+		if ptr > self.layout.rx_end:
+			ptr -= self.layout.rx_size
+
+		return ptr
+
+
+	# Software part of the receive filter and the optional checksum check for a
+	# frame that made it through the hardware filters.
+	def accept_frame(self, data_ptr, frame):
+		receive_filter = self.receive_filter
+
+		if receive_filter is not None and not receive_filter.exact and not receive_filter.matches(frame):
+			self.filtered_frames += 1
+			return False
+
+		if self.verify_ip_checksums:
+			return self.verify_ip_checksum(data_ptr, frame)
+
+		return True
+
+
+	# Check the IPv4 header checksum of a received frame, still in the receive
+	# buffer at data_ptr, with the DMA checksum engine. Anything that is not an
+	# IPv4 frame passes.
+	def verify_ip_checksum(self, data_ptr, frame):
+		if len(frame) < 34 or frame[12] != 0x08 or frame[13] != 0x00:
+			return True
+
+		ihl = (frame[14] & 0x0F) << 2
+		start = self.ring_address(data_ptr, 14)
+
+		if self.dma_checksum(start, self.ring_address(start, ihl - 1)) == 0:
+			return True
+
+		self.checksum_errors += 1
+
+		return False
+
+
+	# Internet checksum of buffer memory start..end (inclusive) computed by the
+	# DMA engine, ready to be stored in a header. Ranges starting inside the
+	# receive buffer wrap at its end.
+	def dma_checksum(self, start, end):
+		with self.transaction():
+			self.write_short(EDMAST, start)
+			self.write_short(EDMAND, end)
+			self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, ECON1_CSUMEN | ECON1_DMAST)
+
+			while self.read_byte(ECON1) & ECON1_DMAST == ECON1_DMAST:
+				pass
+
+			self.write_op(ENC28J60_BIT_FIELD_CLR, ECON1, ECON1_CSUMEN)
+
+			return self.read_byte(EDMACS + 1) << 8 | self.read_byte(EDMACS)
+
+
+	# Fill in the IPv4 header checksum and the ICMP, TCP or UDP checksum of a
+	# frame that has been copied to buffer memory at addr. The checksum fields
+	# in frame must be zero. The transport checksums get the pseudo header,
+	# which is not in buffer memory, added in software.
+	def offload_checksums(self, addr, frame):
+		if len(frame) < 34 or frame[12] != 0x08 or frame[13] != 0x00:
+			return
+
+		ihl = (frame[14] & 0x0F) << 2
+		start = 14 + ihl
+		end = 14 + (frame[16] << 8 | frame[17])
+		protocol = frame[23]
+		self.write_checksum(addr + 24, self.dma_checksum(addr + 14, addr + start - 1))
+
+		# only unfragmented datagrams carry the whole transport payload
+		if protocol not in CHECKSUM_FIELDS or frame[20] & 0x3F != 0 or frame[21] != 0 or end <= start:
+			return
+
+		checksum = self.dma_checksum(addr + start, addr + end - 1)
+
+		if protocol != 1:
+			total = pseudo_header_sum(frame[26:30], frame[30:34], protocol, end - start)
+			checksum = internet_checksum(b"", total + (~checksum & 0xFFFF))
+
+			if checksum == 0 and protocol == 17:
+				checksum = 0xFFFF
+
+		self.write_checksum(addr + start + CHECKSUM_FIELDS[protocol], checksum)
+
+
+	def write_checksum(self, addr, checksum):
+		with self.transaction():
+			self.write_short(EWRPT, addr)
+			self.write_buffer([checksum >> 8, checksum & 0xFF])
+
+
+	# Install a ReceiveFilter. Returns it compiled, its hardware and software
+	# attributes tell which rules the chip enforces. None restores the reset
+	# default of unicast and broadcast frames with a valid CRC.
+	def set_receive_filter(self, receive_filter):
+		if receive_filter is None:
+			receive_filter = ReceiveFilter().unicast().broadcast()
+
+		self.receive_filter = receive_filter.compile(self.mac_address)
+		self.program_receive_filter()
+
+		return self.receive_filter
+
+
+	def program_receive_filter(self):
+		receive_filter = self.receive_filter
+
+		with self.transaction():
+			for index in range(8):
+				self.write_byte(EHT0 + index, receive_filter.hash_table[index])
+				self.write_byte(EPMM0 + index, receive_filter.pattern_mask[index])
+
+			self.write_short(EPMCS, receive_filter.pattern_checksum)
+			self.write_short(EPMO, receive_filter.pattern_offset)
+			self.write_byte(ERXFCON, receive_filter.erxfcon)
+
+
+	# Hand the space up to packet_ptr back to the chip and decrement EPKTCNT
+	# once per frame. ERXRDPT must be odd (silicon errata), hence packet_ptr - 1
+	# or the end of the ring when packet_ptr wrapped to its start.
+	def free_receive_buffer(self, count):
+		with self.transaction():
+			if self.packet_ptr == self.layout.rx_start:
+				self.write_short(ERXRDPT, self.layout.rx_end)
 			else:
 				self.write_short(ERXRDPT, self.packet_ptr - 1)
 
-			self.write_op(ENC28J60_BIT_FIELD_SET, ECON2, ECON2_PKTDEC)
+			for index in range(count):
+				self.write_op(ENC28J60_BIT_FIELD_SET, ECON2, ECON2_PKTDEC)
 
-		return data
 
+	# Copy frame into a free transmit slot and queue it. With more than one slot
+	# the copy overlaps the transmission of the previous frame; the call only
+	# blocks while every slot is in use. With offload_checksums the IPv4 and
+	# transport checksums are computed on the chip, see offload_checksums().
+	def send_packet(self, frame, offload_checksums=False):
+		if len(frame) > self.layout.tx_capacity:
+			raise ValueError("frame of {:d} bytes exceeds the transmit slot".format(len(frame)))
+
+		while len(self.tx_free) == 0:
+			self.kick_transmit()
+
+		slot = self.tx_free.popleft()
+
+		with self.transaction():
+			self.write_short(EWRPT, slot)								# write pointer to start of slot
+			self.write_op(ENC28J60_WRITE_BUF_MEM, 0, 0x00)				# use macon3 settings
+			self.write_buffer(frame)									# copy frame into buffer
+
+			if offload_checksums:
+				self.offload_checksums(slot + 1, frame)
 
-	def send_packet(self, frame):
-		while (self.read_phy(ECON1) & ECON1_TXRTS) == ECON1_TXRTS:
-			if self.read_byte(EIR) & EIR_TXERIF == EIR_TXERIF:
-				self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, ECON1_TXRST)
-				self.write_op(ENC28J60_BIT_FIELD_CLR, ECON1, ECON1_TXRST)
+		self.tx_pending.append((slot, slot + len(frame)))
+		self.kick_transmit()
 
-		print("sending packet")
-		self.write_short(EWRPT, TXSTART_INIT)						# write pointer to start of buffer
-		self.write_short(ETXND, TXSTART_INIT + len(frame))			# set packet size
-		self.write_op(ENC28J60_WRITE_BUF_MEM, 0, 0x00)				# use macon3 settings
-		self.write_buffer(frame)									# copy frame into buffer
-		self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, ECON1_TXRTS)	# send buffer to network
 
-		# Reset the transmit logic problem. See Rev. B4 Silicon Errata point 12.
-		if self.read_byte(EIR) & EIR_TXERIF == EIR_TXERIF:
+	# Retire the frame on the wire once TXRTS dropped and start the next queued
+	# one. Returns False while the MAC is still busy.
+	def kick_transmit(self):
+		with self.transaction():
+			if self.tx_active is not None:
+				if self.read_byte(ECON1) & ECON1_TXRTS == ECON1_TXRTS:
+					return False
+
+				if self.read_byte(EIR) & EIR_TXERIF == EIR_TXERIF:
+					self.reset_transmit_logic()
+
+				self.tx_free.append(self.tx_active[0])
+				self.tx_active = None
+
+			if len(self.tx_pending) > 0:
+				self.tx_active = self.tx_pending.popleft()
+				self.write_short(ETXST, self.tx_active[0])					# set packet start
+				self.write_short(ETXND, self.tx_active[1])					# set packet end
+				self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, ECON1_TXRTS)	# send buffer to network
+
+		return True
+
+
+	# Block until every queued frame has left the chip.
+	def flush_transmit(self):
+		while self.tx_active is not None:
+			self.kick_transmit()
+
+
+	# Reset the transmit logic problem. See Rev. B4 Silicon Errata point 12.
+	def reset_transmit_logic(self):
+		with self.transaction():
+			self.write_op(ENC28J60_BIT_FIELD_SET, ECON1, ECON1_TXRST)
 			self.write_op(ENC28J60_BIT_FIELD_CLR, ECON1, ECON1_TXRST)
+			self.write_op(ENC28J60_BIT_FIELD_CLR, EIR, EIR_TXERIF)
 
-		print("packet sent")
+		self.transmit_errors += 1
 
 
 	def soft_reset(self, ):
+		self.start_reset()
+
+		while not self.clock_ready():
+			pass
+
+
+	def start_reset(self):
+		self.invalidate_registers()
+		self.scanning = False
+		self.link_up = None
 		self.write_op(ENC28J60_SOFT_RESET, 0, ENC28J60_SOFT_RESET)
 
-		status = self.read_byte(ESTAT)
 
-		while status & ESTAT_CLKRDY != ESTAT_CLKRDY:
-			status = self.read_byte(ESTAT)
+	def clock_ready(self):
+		return self.read_byte(ESTAT) & ESTAT_CLKRDY == ESTAT_CLKRDY
@@ -0,0 +1,732 @@
+import os
+import zlib
+from collections import deque
+from itertools import cycle, islice
+
+from ethernet.constants import *
+from ethernet.checksum import internet_checksum
+
+SRAM_SIZE = 0x2000
+POINTER_MASK = 0x1FFF
+REVISION = 0x06				# B7 silicon
+MIN_FRAMELEN = 60			# without FCS
+WIRE_RATE = 10000000		# 10BASE-T
+WIRE_OVERHEAD = 4 + 8 + 12	# FCS, preamble + SFD, inter-frame gap
+MII_BUSY_TIME = 10.24e-6
+DMA_BYTE_TIME = 80e-9
+CLOCK_START_TIME = 300e-6
+
+# Register reset values that differ from zero. Pointers are little endian
+# register pairs, so the high byte lives at addr + 1.
+RESET_VALUES = {
+	ERDPT: 0xFA, ERDPT + 1: 0x05,
+	ERXST: 0xFA, ERXST + 1: 0x05,
+	ERXND: 0xFF, ERXND + 1: 0x1F,
+	ERXRDPT: 0xFA, ERXRDPT + 1: 0x05,
+	ERXFCON: ERXFCON_UCEN | ERXFCON_CRCEN | ERXFCON_BCEN,
+	MAMXFL + 1: 0x06,
+	EREVID: REVISION,
+	ECOCON: 0x04,
+	EPAUS + 1: 0x10,
+	ECON2: ECON2_AUTOINC,
+}
+
+PHY_RESET_VALUES = {
+	PHHID1: 0x0083,
+	PHHID2: 0x1400,
+	PHSTAT1: 0x1800,
+	PHLCON: 0x3422,
+}
+
+
+def register_index(addr):
+	# map a register constant to its slot in the 4 x 32 register file;
+	# EIE..ECON1 are mirrored into every bank
+	if addr & ADDR_MASK >= EIE:
+		return addr & ADDR_MASK
+
+	return addr & (BANK_MASK | ADDR_MASK)
+
+
+# Software model of the ENC28J60 that plugs in wherever Enc28j60 expects an SPI
+# transport. Time is virtual: every SPI call advances the clock by its byte
+# count at spi_clock_hz plus a fixed per-call overhead, and scheduled traffic,
+# MII operations and transmissions complete against that clock.
+
+class Enc28j60Simulator(object):
+	def __init__(self, spi_clock_hz=2000000, call_overhead=20e-6, link_up=True):
+		self.spi_clock_hz = spi_clock_hz
+		self.call_overhead = call_overhead
+		self.now = 0.0
+		self.sram = bytearray(SRAM_SIZE)
+		self.registers = bytearray(4 * 32)
+		self.phy = [0] * 0x20
+		self.link_up = link_up
+		self.transmitted = deque(maxlen=1024)
+		self.on_transmit = None
+		self.interrupt = None
+		self.interrupt_asserted = False
+
+		self.calls = 0
+		self.transactions = 0
+		self.bytes = 0
+		self.received_frames = 0
+		self.dropped_frames = 0
+		self.filtered_frames = 0
+		self.transmitted_frames = 0
+
+		self._traffic = None
+		self._interval = 0.0
+		self._next_arrival = None
+		self._wire = deque()
+		self._wire_free = 0.0
+		self._clock_ready = None
+		self._mii_done = None
+		self._mii_op = None
+		self._tx_done = None
+		self._dma_done = None
+
+		self.reset_phy()
+		self.reset()
+		self._finish_reset()
+
+
+	def reset(self):
+		self.registers[:] = bytes(len(self.registers))
+
+		for addr, value in RESET_VALUES.items():
+			self.registers[register_index(addr)] = value
+
+		self._mii_done = None
+		self._tx_done = None
+		self._dma_done = None
+		self._clock_ready = self.now + CLOCK_START_TIME
+
+
+	def reset_phy(self):
+		self.phy = [0] * 0x20
+
+		for addr, value in PHY_RESET_VALUES.items():
+			self.phy[addr] = value
+
+		self._update_link_status()
+
+
+	# INT pin as an epoll-able fd, see SimulatedInterrupt
+	def interrupt_line(self):
+		if self.interrupt is None:
+			self.interrupt = SimulatedInterrupt(self)
+
+		return self.interrupt
+
+
+	def reset_counters(self):
+		self.calls = 0
+		self.transactions = 0
+		self.bytes = 0
+		self.received_frames = 0
+		self.dropped_frames = 0
+		self.filtered_frames = 0
+		self.transmitted_frames = 0
+
+
+	# SPI transport
+
+	def xfer2(self, data):
+		self.calls += 1
+		self.advance(self.call_overhead)
+
+		return self._transaction(data)
+
+
+	def xfer_many(self, messages):
+		self.calls += 1
+		self.advance(self.call_overhead)
+
+		return [self._transaction(message) for message in messages]
+
+
+	def xfer_into(self, data, view, messages=()):
+		self.calls += 1
+		self.advance(self.call_overhead)
+
+		for message in messages:
+			self._transaction(message)
+
+		self.transactions += 1
+		self.bytes += len(data) + len(view)
+		self.advance((len(data) + len(view)) * 8.0 / self.spi_clock_hz)
+
+		if data[0] == ENC28J60_READ_BUF_MEM:
+			self._read_buffer_into(view)
+
+
+	def close(self):
+		pass
+
+
+	# clock and traffic
+
+	def advance(self, seconds):
+		target = self.now + seconds
+
+		while True:
+			when, action = self._next_event()
+
+			if when is None or when > target:
+				break
+
+			self.now = max(self.now, when)
+			action()
+			self._update_interrupt()
+
+		self.now = target
+
+
+	def monotonic(self):
+		return self.now
+
+
+	def sleep(self, seconds):
+		self.advance(seconds)
+
+
+	def start_traffic(self, frames, packet_rate, count=None):
+		source = cycle(frames)
+
+		if count is not None:
+			source = islice(source, count)
+
+		self._traffic = source
+		self._interval = 1.0 / packet_rate
+		self._next_arrival = self.now
+
+
+	def stop_traffic(self):
+		self._traffic = None
+		self._next_arrival = None
+
+
+	def set_link(self, up):
+		if up == self.link_up:
+			return
+
+		self.link_up = up
+		self._update_link_status()
+		self.phy[PHIR] |= PHIR_PGIF | PHIR_PLNKIF
+		self._update_link_interrupt()
+		self._update_interrupt()
+
+
+	# wire side
+
+	# Frame sent by the link partner: it arrives once it went over the wire,
+	# after the frames that are still on their way
+	def deliver(self, frame):
+		start = max(self.now, self._wire_free)
+		self._wire_free = start + (max(len(frame), MIN_FRAMELEN) + WIRE_OVERHEAD) * 8.0 / WIRE_RATE
+		self._wire.append((self._wire_free, bytes(frame)))
+
+
+	def inject(self, frame):
+		frame = bytes(frame)
+
+		if len(frame) < MIN_FRAMELEN:
+			frame += bytes(MIN_FRAMELEN - len(frame))
+
+		if not self._get(ECON1) & ECON1_RXEN:
+			return False
+
+		if not self._accept(frame):
+			self.filtered_frames += 1
+			return False
+
+		count = len(frame) + 4
+		needed = HEADER_SIZE + count + (count & 1)
+		start = self._pointer(ERXST)
+		end = self._pointer(ERXND)
+		write_ptr = self._pointer(ERXWRPT)
+
+		if self._get(EPKTCNT) == 0xFF or needed > self._free_space(start, end, write_ptr):
+			self.dropped_frames += 1
+			self._set(EIR, self._get(EIR) | EIR_RXERIF)
+			self._update_interrupt()
+			return False
+
+		status = RECEIVE_OK
+
+		if frame[0:6] == b"\xff\xff\xff\xff\xff\xff":
+			status |= RECEIVE_BROADCAST
+		elif frame[0] & 0x01:
+			status |= RECEIVE_MULTICAST
+
+		next_ptr = start + (write_ptr - start + needed) % (end - start + 1)
+		header = bytes([next_ptr & 0xFF, next_ptr >> 8, count & 0xFF, count >> 8, status & 0xFF, status >> 8])
+		fcs = zlib.crc32(frame).to_bytes(4, "little")
+		self._write_ring(write_ptr, header + frame + fcs)
+
+		self._set16(ERXWRPT, next_ptr)
+		self._set(EPKTCNT, self._get(EPKTCNT) + 1)
+		self._set(EIR, self._get(EIR) | EIR_PKTIF)
+		self.received_frames += 1
+		self._update_interrupt()
+
+		return True
+
+
+	# ERXFCON in OR mode (AND mode is not modelled); frames always have a valid
+	# CRC here, so CRCEN never rejects anything
+	def _accept(self, frame):
+		erxfcon = self._get(ERXFCON)
+		filters = erxfcon & (ERXFCON_UCEN | ERXFCON_BCEN | ERXFCON_MCEN | ERXFCON_HTEN | ERXFCON_PMEN)
+
+		if filters == 0:
+			return True
+
+		destination = frame[0:6]
+		mac_address = bytes(self._get(register) for register in (MAADR5, MAADR4, MAADR3, MAADR2, MAADR1, MAADR0))
+
+		if erxfcon & ERXFCON_UCEN and destination == mac_address:
+			return True
+
+		if erxfcon & ERXFCON_BCEN and destination == b"\xff\xff\xff\xff\xff\xff":
+			return True
+
+		if erxfcon & ERXFCON_MCEN and destination[0] & 0x01:
+			return True
+
+		if erxfcon & ERXFCON_HTEN:
+			# bits 28:23 of the (unreflected) CRC register over the address
+			crc = int("{:032b}".format(zlib.crc32(destination) ^ 0xFFFFFFFF)[::-1], 2)
+			index = (crc >> 23) & 0x3F
+
+			if self._get(EHT0 + (index >> 3)) & (1 << (index & 0x07)):
+				return True
+
+		if erxfcon & ERXFCON_PMEN:
+			offset = self._get16(EPMO)
+			selected = bytearray()
+
+			# the whole window has to lie inside the frame including its FCS
+			if offset + 64 > len(frame) + 4:
+				return False
+
+			for bit in range(64):
+				if self._get(EPMM0 + (bit >> 3)) & (1 << (bit & 0x07)):
+					selected.append(frame[offset + bit] if offset + bit < len(frame) else 0)
+
+			if internet_checksum(selected) == self._get16(EPMCS):
+				return True
+
+		return False
+
+
+	# SPI command decoding
+
+	def _transaction(self, data):
+		self.transactions += 1
+		self.bytes += len(data)
+		self.advance(len(data) * 8.0 / self.spi_clock_hz)
+
+		opcode = data[0]
+		result = [0] * len(data)
+
+		if opcode == ENC28J60_SOFT_RESET:
+			self.reset()
+		elif opcode == ENC28J60_READ_BUF_MEM:
+			buf = bytearray(len(data) - 1)
+			self._read_buffer_into(buf)
+			result[1:] = buf
+		elif opcode == ENC28J60_WRITE_BUF_MEM:
+			self._write_buffer(data[1:])
+		else:
+			op = opcode & 0xE0
+			index = self._bank_index(opcode & ADDR_MASK)
+
+			if op == ENC28J60_READ_CTRL_REG:
+				result[-1] = self.registers[index]
+			elif op == ENC28J60_WRITE_CTRL_REG:
+				self._write_register(index, data[1])
+			elif op == ENC28J60_BIT_FIELD_SET:
+				self._write_register(index, self.registers[index] | data[1])
+			elif op == ENC28J60_BIT_FIELD_CLR:
+				self._write_register(index, self.registers[index] & ~data[1])
+
+		self._update_interrupt()
+
+		return result
+
+
+	def _bank_index(self, addr):
+		if addr >= EIE:
+			return addr
+
+		return (self.registers[ECON1] & (ECON1_BSEL1 | ECON1_BSEL0)) << 5 | addr
+
+
+	def _write_register(self, index, value):
+		old = self.registers[index]
+		self.registers[index] = value & 0xFF
+
+		if index == ECON1:
+			if value & ECON1_TXRST:
+				self._tx_done = None
+				self.registers[ECON1] &= ~ECON1_TXRTS
+			elif value & ECON1_TXRTS and not old & ECON1_TXRTS:
+				self._start_transmit()
+
+			if value & ECON1_DMAST and not old & ECON1_DMAST:
+				self._start_dma()
+		elif index == ECON2:
+			if value & ECON2_PKTDEC:
+				self.registers[ECON2] &= ~ECON2_PKTDEC
+				self._set(EPKTCNT, max(self._get(EPKTCNT) - 1, 0))
+		elif index in (register_index(ERXST), register_index(ERXST + 1)):
+			self._set16(ERXWRPT, self._pointer(ERXST))
+		elif index == register_index(MICMD):
+			if value & MICMD_MIIRD and not old & MICMD_MIIRD:
+				self._start_mii(("read", self._get(MIREGADR)))
+			elif value & MICMD_MIISCAN and not old & MICMD_MIISCAN and self._mii_done is None:
+				self._start_mii(("scan", self._get(MIREGADR)))
+				self._set(MISTAT, self._get(MISTAT) | MISTAT_SCAN | MISTAT_NVALID)
+		elif index == register_index(MIWRH):
+			self._start_mii(("write", self._get(MIREGADR), self._get16(MIWRL)))
+		elif index in (register_index(EPKTCNT), register_index(EREVID)):
+			self.registers[index] = old
+
+		# PKTIF mirrors a non-zero EPKTCNT and cannot be cleared directly
+		if self._get(EPKTCNT) > 0:
+			self.registers[EIR] |= EIR_PKTIF
+		else:
+			self.registers[EIR] &= ~EIR_PKTIF
+
+
+	# buffer memory
+
+	def _read_buffer_into(self, view):
+		start = self._pointer(ERXST)
+		end = self._pointer(ERXND)
+		ptr = self._pointer(ERDPT)
+		offset = 0
+
+		# ERDPT wraps from ERXND back to ERXST while inside the receive buffer
+		if not start <= ptr <= end:
+			start, end = 0, POINTER_MASK
+
+		while offset < len(view):
+			length = min(len(view) - offset, end - ptr + 1)
+			view[offset:offset + length] = self.sram[ptr:ptr + length]
+			offset += length
+			ptr += length
+
+			if ptr > end:
+				ptr = start
+
+		self._set16(ERDPT, ptr)
+
+
+	def _write_buffer(self, data):
+		ptr = self._pointer(EWRPT)
+
+		for value in data:
+			self.sram[ptr] = value
+			ptr = (ptr + 1) & POINTER_MASK
+
+		self._set16(EWRPT, ptr)
+
+
+	def _write_ring(self, ptr, data):
+		start = self._pointer(ERXST)
+		end = self._pointer(ERXND)
+		offset = 0
+
+		while offset < len(data):
+			length = min(len(data) - offset, end - ptr + 1)
+			self.sram[ptr:ptr + length] = data[offset:offset + length]
+			offset += length
+			ptr += length
+
+			if ptr > end:
+				ptr = start
+
+
+	def _free_space(self, start, end, write_ptr):
+		read_ptr = self._pointer(ERXRDPT)
+
+		if write_ptr > read_ptr:
+			return (end - start) - (write_ptr - read_ptr)
+		elif write_ptr == read_ptr:
+			return end - start
+		else:
+			return read_ptr - write_ptr - 1
+
+
+	# timed operations
+
+	def _next_event(self):
+		events = [
+			(self._clock_ready, self._finish_reset),
+			(self._mii_done, self._finish_mii),
+			(self._tx_done, self._finish_transmit),
+			(self._dma_done, self._finish_dma),
+			(self._next_arrival, self._arrive),
+			(self._wire[0][0] if self._wire else None, self._arrive_from_wire),
+		]
+		pending = [event for event in events if event[0] is not None]
+
+		if not pending:
+			return None, None
+
+		return min(pending, key=lambda event: event[0])
+
+
+	def _finish_reset(self):
+		self._clock_ready = None
+		self._set(ESTAT, self._get(ESTAT) | ESTAT_CLKRDY)
+
+
+	def _arrive(self):
+		frame = next(self._traffic, None)
+
+		if frame is None:
+			self.stop_traffic()
+			return
+
+		self.inject(frame)
+		self._next_arrival += self._interval
+
+
+	def _arrive_from_wire(self):
+		(_, frame) = self._wire.popleft()
+		self.inject(frame)
+
+
+	def _start_transmit(self):
+		start = self._pointer(ETXST)
+		end = self._pointer(ETXND)
+		# the first byte is the per-packet control byte
+		self._tx_frame = bytes(self.sram[start + 1:end + 1])
+		wire_length = max(len(self._tx_frame), MIN_FRAMELEN) + WIRE_OVERHEAD
+		self._tx_done = self.now + wire_length * 8.0 / WIRE_RATE
+
+
+	def _finish_transmit(self):
+		self._tx_done = None
+		frame = self._tx_frame
+		end = self._pointer(ETXND)
+		count = len(frame)
+
+		# transmit status vector follows the frame, bit 23 = transmit done
+		status = bytes([count & 0xFF, count >> 8, 0x80, 0, 0, 0, 0])
+
+		for offset, value in enumerate(status):
+			self.sram[(end + 1 + offset) & POINTER_MASK] = value
+
+		self.registers[ECON1] &= ~ECON1_TXRTS
+		self._set(EIR, self._get(EIR) | EIR_TXIF)
+		self.transmitted.append(frame)
+		self.transmitted_frames += 1
+
+		if self.on_transmit is not None:
+			self.on_transmit(frame)
+
+
+	# DMA copy, or checksum when CSUMEN is set, over EDMAST..EDMAND inclusive.
+	# A range that starts inside the receive buffer wraps at ERXND.
+	def _start_dma(self):
+		start = self._pointer(ERXST)
+		end = self._pointer(ERXND)
+		ptr = self._pointer(EDMAST)
+		last = self._pointer(EDMAND)
+
+		if not start <= ptr <= end:
+			start, end = 0, POINTER_MASK
+
+		if last >= ptr:
+			data = bytes(self.sram[ptr:last + 1])
+		else:
+			data = bytes(self.sram[ptr:end + 1]) + bytes(self.sram[start:last + 1])
+
+		self._dma_data = data
+		self._dma_done = self.now + len(data) * DMA_BYTE_TIME
+
+
+	def _finish_dma(self):
+		self._dma_done = None
+		data = self._dma_data
+
+		if self._get(ECON1) & ECON1_CSUMEN:
+			checksum = internet_checksum(data)
+			self._set(EDMACS, checksum & 0xFF)
+			self._set(EDMACS + 1, checksum >> 8)
+		else:
+			ptr = self._pointer(EDMADST)
+
+			for value in data:
+				self.sram[ptr] = value
+				ptr = (ptr + 1) & POINTER_MASK
+
+		self.registers[ECON1] &= ~ECON1_DMAST
+		self._set(EIR, self._get(EIR) | EIR_DMAIF)
+
+
+	def _start_mii(self, operation):
+		self._mii_op = operation
+		self._mii_done = self.now + MII_BUSY_TIME
+		self._set(MISTAT, self._get(MISTAT) | MISTAT_BUSY)
+
+
+	def _finish_mii(self):
+		self._mii_done = None
+		operation = self._mii_op
+
+		if operation[0] == "write":
+			self._write_phy(operation[1], operation[2])
+		else:
+			value = self._read_phy(operation[1])
+			self._set(MIRDL, value & 0xFF)
+			self._set(MIRDH, value >> 8)
+
+		# a scan repeats until MIISCAN is cleared
+		if operation[0] == "scan":
+			self._set(MISTAT, self._get(MISTAT) & ~MISTAT_NVALID)
+
+			if self._get(MICMD) & MICMD_MIISCAN:
+				self._mii_done = self.now + MII_BUSY_TIME
+				return
+
+			self._set(MISTAT, self._get(MISTAT) & ~MISTAT_SCAN)
+
+		self._set(MISTAT, self._get(MISTAT) & ~MISTAT_BUSY)
+
+
+	def _read_phy(self, addr):
+		value = self.phy[addr & 0x1F]
+
+		if addr == PHIR:
+			# reading PHIR clears the pending PHY interrupts
+			self.phy[PHIR] = 0
+			self._update_link_interrupt()
+
+		return value
+
+
+	def _write_phy(self, addr, value):
+		if addr in (PHCON1, PHCON2, PHIE, PHLCON):
+			self.phy[addr] = value
+			self._update_link_interrupt()
+
+
+	def _update_interrupt(self):
+		enabled = self.registers[EIE]
+		asserted = enabled & EIE_INTIE != 0 and enabled & self.registers[EIR] & 0x7F != 0
+
+		if asserted:
+			self.registers[ESTAT] |= ESTAT_INT
+		else:
+			self.registers[ESTAT] &= ~ESTAT_INT
+
+		# INT is active low; a falling edge is what a GPIO event reports
+		if asserted and not self.interrupt_asserted and self.interrupt is not None:
+			self.interrupt.trigger()
+
+		self.interrupt_asserted = asserted
+
+
+	def _update_link_status(self):
+		if self.link_up:
+			self.phy[PHSTAT1] |= PHSTAT1_LLSTAT
+			self.phy[PHSTAT2] |= PHSTAT2_LSTAT
+		else:
+			self.phy[PHSTAT1] &= ~PHSTAT1_LLSTAT
+			self.phy[PHSTAT2] &= ~PHSTAT2_LSTAT
+
+
+	def _update_link_interrupt(self):
+		enabled = self.phy[PHIE] & PHIE_PGEIE and self.phy[PHIE] & PHIE_PLNKIE
+
+		if enabled and self.phy[PHIR] & PHIR_PLNKIF:
+			self._set(EIR, self._get(EIR) | EIR_LINKIF)
+		else:
+			self._set(EIR, self._get(EIR) & ~EIR_LINKIF)
+
+
+	# register helpers
+
+	def _get(self, addr):
+		return self.registers[register_index(addr)]
+
+
+	def _set(self, addr, value):
+		self.registers[register_index(addr)] = value & 0xFF
+
+
+	def _get16(self, addr):
+		return self._get(addr) | self._get(addr + 1) << 8
+
+
+	def _pointer(self, addr):
+		return self._get16(addr) & POINTER_MASK
+
+
+	def _set16(self, addr, value):
+		self._set(addr, value & 0xFF)
+		self._set(addr + 1, value >> 8)
+
+
+# Stands in for GpioInterrupt: a pipe that becomes readable on each falling edge
+# of the simulated INT pin. Waiting lets virtual time pass on the simulator.
+
+class SimulatedInterrupt(object):
+	def __init__(self, simulator):
+		self.simulator = simulator
+		self.read_fd, self.write_fd = os.pipe()
+		os.set_blocking(self.read_fd, False)
+		os.set_blocking(self.write_fd, False)
+
+
+	def fileno(self):
+		return self.read_fd
+
+
+	def trigger(self):
+		try:
+			os.write(self.write_fd, b"\x00")
+		except BlockingIOError:
+			pass
+
+
+	def wait(self, timeout=None):
+		simulator = self.simulator
+		deadline = None if timeout is None else simulator.now + timeout
+
+		while not self.clear():
+			when, action = simulator._next_event()
+
+			if when is None or (deadline is not None and when > deadline):
+				if deadline is None:
+					return False
+
+				simulator.advance(max(deadline - simulator.now, 0))
+				return self.clear()
+
+			simulator.advance(max(when - simulator.now, 0))
+
+		return True
+
+
+	def clear(self):
+		triggered = False
+
+		try:
+			while len(os.read(self.read_fd, 64)) > 0:
+				triggered = True
+		except BlockingIOError:
+			pass
+
+		return triggered
+
+
+	def close(self):
+		os.close(self.read_fd)
+		os.close(self.write_fd)
@@ -1,5 +1,7 @@
 # https://en.wikipedia.org/wiki/Ethernet_frame#Structure
 
+import struct
+
 from ethernet.mac_address import MacAddress
 from ethernet.ip_frame import IpFrame
 from ethernet.arp_frame import ArpFrame
@@ -15,24 +17,36 @@ from ethernet.arp_frame import ArpFrame
 # 	0x80F3: "AARP"
 # }
 
+HEADER = struct.Struct("!6s6sH")	# destination, source, type
+
+# payload parsers by EtherType; add to it to decode more protocols
+PAYLOAD_TYPES = {
+	0x0800: IpFrame,
+	0x0806: ArpFrame,
+}
+
 # Layer 2 ethernet frame
 
 class EthernetFrame(object):
+	__slots__ = ("dst_mac_address", "src_mac_address", "type", "payload")
+
+	# Parsers read fields relative to offset instead of slicing per layer, so a
+	# memoryview buf is never copied; payloads and addresses refer back to it.
 	@classmethod
-	def from_buffer(cls, buf):
-		type=buf[12] * 256 + buf[13]
-
-		# if type >= 0x0600:
-		if type == 0x0800:
-			payload = IpFrame.from_buffer(buf[14:])
-		elif type == 0x0806:
-			payload = ArpFrame.from_buffer(buf[14:])
+	def from_buffer(cls, buf, offset=0, length=None):
+		end = len(buf) if length is None else offset + length
+		(dst_mac_addr, src_mac_addr, type) = HEADER.unpack_from(buf, offset)
+
+		parser = PAYLOAD_TYPES.get(type)
+
+		if parser is None:
+			payload = buf[offset + 14:end]
 		else:
-			payload = buf[14:]
+			payload = parser.from_buffer(buf, offset + 14, end - offset - 14)
 
 		return cls(
-			dst_mac_addr=MacAddress(buf[0:6]),
-			src_mac_addr=MacAddress(buf[6:12]),
+			dst_mac_addr=MacAddress(dst_mac_addr),
+			src_mac_addr=MacAddress(src_mac_addr),
 			type=type,
 			payload=payload
 		)
@@ -46,15 +60,7 @@ class EthernetFrame(object):
 
 
 	def __bytes__(self):
-		ba = bytearray()
-
-		ba.extend(bytes(self.dst_mac_address))
-		ba.extend(bytes(self.src_mac_address))
-		ba.append((self.type >> 8) & 0xFF)
-		ba.append(self.type & 0xFF)
-		ba.extend(bytes(self.payload))
-
-		return bytes(ba)
+		return HEADER.pack(bytes(self.dst_mac_address), bytes(self.src_mac_address), self.type) + bytes(self.payload)
 
 
 	def __repr__(self):
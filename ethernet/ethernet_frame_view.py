@@ -0,0 +1,69 @@
+from ethernet.ethernet_frame import EthernetFrame
+from ethernet.mac_address import MacAddress
+from ethernet.ip_frame_view import IpFrameView
+from ethernet.arp_frame_view import ArpFrameView
+
+PAYLOAD_TYPES = {
+	0x0800: IpFrameView,
+	0x0806: ArpFrameView,
+}
+
+
+# Lazy EthernetFrame over a receive buffer. Header fields are read from buf
+# when they are accessed; the addresses and the payload view are built on first
+# use and kept. buf must not be reused while the view is alive.
+
+class EthernetFrameView(EthernetFrame):
+	__slots__ = ("buf", "offset", "end", "_dst_mac_address", "_src_mac_address", "_payload")
+
+	@classmethod
+	def from_buffer(cls, buf, offset=0, length=None):
+		return cls(buf, offset, length)
+
+
+	def __init__(self, buf, offset=0, length=None):
+		self.buf = buf
+		self.offset = offset
+		self.end = len(buf) if length is None else offset + length
+		self._dst_mac_address = None
+		self._src_mac_address = None
+		self._payload = None
+
+
+	@property
+	def dst_mac_address(self):
+		if self._dst_mac_address is None:
+			self._dst_mac_address = MacAddress(self.buf[self.offset:self.offset + 6])
+
+		return self._dst_mac_address
+
+
+	@property
+	def src_mac_address(self):
+		if self._src_mac_address is None:
+			self._src_mac_address = MacAddress(self.buf[self.offset + 6:self.offset + 12])
+
+		return self._src_mac_address
+
+
+	@property
+	def type(self):
+		return self.buf[self.offset + 12] * 256 + self.buf[self.offset + 13]
+
+
+	@property
+	def payload(self):
+		if self._payload is None:
+			view = PAYLOAD_TYPES.get(self.type)
+			start = self.offset + 14
+
+			if view is None:
+				self._payload = self.buf[start:self.end]
+			else:
+				self._payload = view(self.buf, start, self.end - start)
+
+		return self._payload
+
+
+	def __bytes__(self):
+		return bytes(self.buf[self.offset:self.end])
@@ -0,0 +1,72 @@
+import fcntl
+import math
+import os
+import select
+import struct
+
+# linux/gpio.h (character device uAPI v1)
+GPIOHANDLE_REQUEST_INPUT = 0x01
+GPIOEVENT_REQUEST_FALLING_EDGE = 0x02
+GPIOEVENT_REQUEST = struct.Struct("=III32si")	# lineoffset, handleflags, eventflags, consumer_label, fd
+GPIOEVENT_DATA = struct.Struct("=QI4x")			# timestamp, id
+GPIO_GET_LINEEVENT_IOCTL = (3 << 30) | (GPIOEVENT_REQUEST.size << 16) | (0xB4 << 8) | 0x04
+
+
+# Falling edge events of the ENC28J60 INT pin (active low) through the gpiochip
+# character device. fileno() can be registered with select/epoll directly.
+
+class GpioInterrupt(object):
+	def __init__(self, chip="/dev/gpiochip0", line=25, consumer="enc28j60"):
+		request = bytearray(GPIOEVENT_REQUEST.pack(
+			line,
+			GPIOHANDLE_REQUEST_INPUT,
+			GPIOEVENT_REQUEST_FALLING_EDGE,
+			consumer.encode(),
+			0
+		))
+		chip_fd = os.open(chip, os.O_RDONLY)
+
+		try:
+			fcntl.ioctl(chip_fd, GPIO_GET_LINEEVENT_IOCTL, request)
+		finally:
+			os.close(chip_fd)
+
+		self.fd = GPIOEVENT_REQUEST.unpack(request)[4]
+		os.set_blocking(self.fd, False)
+		self.poller = select.poll()
+		self.poller.register(self.fd, select.POLLIN)
+
+
+	def fileno(self):
+		return self.fd
+
+
+	# Block until the line fell or timeout seconds passed. Returns True on an
+	# edge; queued events are consumed.
+	def wait(self, timeout=None):
+		if timeout is not None:
+			timeout = max(math.ceil(timeout * 1000), 0)
+
+		if len(self.poller.poll(timeout)) == 0:
+			return False
+
+		self.clear()
+
+		return True
+
+
+	# Consume queued events. Returns True if there were any.
+	def clear(self):
+		triggered = False
+
+		try:
+			while len(os.read(self.fd, GPIOEVENT_DATA.size * 16)) > 0:
+				triggered = True
+		except BlockingIOError:
+			pass
+
+		return triggered
+
+
+	def close(self):
+		os.close(self.fd)
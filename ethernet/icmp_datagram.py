@@ -1,19 +1,30 @@
 # https://en.wikipedia.org/wiki/Internet_Control_Message_Protocol#Datagram_structure
 # https://en.wikipedia.org/wiki/Ping_(networking_utility)#Echo_request
 
+import struct
+
+from ethernet.checksum import internet_checksum, verify_checksum
+
 TYPE_IPV4 = 8
 TYPE_IPV6 = 128
 
+HEADER = struct.Struct("!BBHHH")	# type, code, checksum, id, sequence number
+
 class IcmpDatagram(object):
+	__slots__ = ("type", "code", "checksum", "id", "sequence_number", "payload")
+
 	@classmethod
-	def from_buffer(cls, buf):
+	def from_buffer(cls, buf, offset=0, length=None):
+		end = len(buf) if length is None else offset + length
+		(type, code, checksum, id, sequence_number) = HEADER.unpack_from(buf, offset)
+
 		return cls(
-			type=buf[0],
-			code=buf[1],
-			checksum=buf[2] * 256 + buf[3],
-			id=buf[4] * 256 + buf[5],
-			sequence_number = buf[6] * 256 + buf[7],
-			payload=buf[8:]
+			type=type,
+			code=code,
+			checksum=checksum,
+			id=id,
+			sequence_number=sequence_number,
+			payload=buf[offset + 8:end]
 		)
 
 
@@ -27,28 +38,23 @@ class IcmpDatagram(object):
 
 
 	def __bytes__(self):
-		ba = bytearray()
+		ba = bytearray(HEADER.pack(self.type, self.code, 0, self.id, self.sequence_number))
+
+		if self.payload is not None:
+			ba.extend(self.payload)
 
-		ba.append(self.type)
-		ba.append(self.code)
-		ba.append(0, 0)
-		ba.append((id >> 8) & 0xFF)
-		ba.append(self.sequence_number)
+		struct.pack_into("!H", ba, 2, internet_checksum(ba))
 
-		# calculate checksum
-		checksum = 0
+		return bytes(ba)
 
-		for i in range(0, len(ba), 2):
-			checksum += ba[i] * 256 + ba[a + 1]
 
-		checksum = ((checksum >> 16) & 0xFFFF) + (checksum & 0xFFFF)
-		checksum += (checksum >> 16)
-		checksum = ~checksem
+	def verify_checksum(self):
+		ba = bytearray(HEADER.pack(self.type, self.code, self.checksum, self.id, self.sequence_number))
 
-		ba[2] = (checksum >> 8) & 0xFF
-		ba[3] = checksum & 0xFF
+		if self.payload is not None:
+			ba.extend(self.payload)
 
-		return bytes(ba)
+		return verify_checksum(ba)
 
 
 	def __repr__(self):
@@ -0,0 +1,56 @@
+from ethernet.icmp_datagram import IcmpDatagram
+from ethernet.checksum import verify_checksum
+
+
+# Lazy IcmpDatagram, see EthernetFrameView.
+
+class IcmpDatagramView(IcmpDatagram):
+	__slots__ = ("buf", "offset", "end")
+
+	@classmethod
+	def from_buffer(cls, buf, offset=0, length=None):
+		return cls(buf, offset, length)
+
+
+	def __init__(self, buf, offset=0, length=None):
+		self.buf = buf
+		self.offset = offset
+		self.end = len(buf) if length is None else offset + length
+
+
+	@property
+	def type(self):
+		return self.buf[self.offset]
+
+
+	@property
+	def code(self):
+		return self.buf[self.offset + 1]
+
+
+	@property
+	def checksum(self):
+		return self.buf[self.offset + 2] * 256 + self.buf[self.offset + 3]
+
+
+	@property
+	def id(self):
+		return self.buf[self.offset + 4] * 256 + self.buf[self.offset + 5]
+
+
+	@property
+	def sequence_number(self):
+		return self.buf[self.offset + 6] * 256 + self.buf[self.offset + 7]
+
+
+	@property
+	def payload(self):
+		return self.buf[self.offset + 8:self.end]
+
+
+	def verify_checksum(self):
+		return verify_checksum(self.buf[self.offset:self.end])
+
+
+	def __bytes__(self):
+		return bytes(self.buf[self.offset:self.end])
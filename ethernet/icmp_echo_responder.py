@@ -0,0 +1,62 @@
+import struct
+
+from ethernet.checksum import update_checksum
+
+WORD = struct.Struct("!H")
+
+
+# Answers ICMP echo requests for our IPv4 address by rewriting the received
+# frame into the reply: addresses swapped, TTL reset, type 8 -> 0. Both
+# checksums are adjusted for the changed words only (RFC 1624), so the cost
+# does not depend on the payload size. A request with a bad checksum gives a
+# reply with a bad checksum, see Enc28j60.verify_ip_checksums.
+
+class IcmpEchoResponder(object):
+	def __init__(self, mac_address, ip_address, ttl=64):
+		self.mac_address = bytes(mac_address)
+		self.ip_address = bytes(ip_address)
+		self.ttl = ttl
+		self.replies = 0
+
+
+	# Turn the echo request in buf (a writable buffer) into the reply and
+	# return a view of it, or None when buf holds no unfragmented echo request
+	# for our address. buf is left untouched in that case.
+	def reply(self, buf, offset=0, length=None):
+		end = len(buf) if length is None else offset + length
+		ip = offset + 14
+
+		if end - offset < 42 or buf[offset + 12] != 0x08 or buf[offset + 13] != 0x00:
+			return None
+
+		if buf[ip] >> 4 != 4 or buf[ip + 9] != 1 or buf[ip + 6] & 0x3F != 0 or buf[ip + 7] != 0:
+			return None
+
+		icmp = ip + ((buf[ip] & 0x0F) << 2)
+		(total_length,) = WORD.unpack_from(buf, ip + 2)
+
+		if ip + total_length > end or icmp + 8 > ip + total_length:
+			return None
+
+		if buf[icmp] != 8 or buf[icmp + 1] != 0 or buf[ip + 16:ip + 20] != self.ip_address:
+			return None
+
+		buf[offset:offset + 6] = buf[offset + 6:offset + 12]
+		buf[offset + 6:offset + 12] = self.mac_address
+		buf[ip + 16:ip + 20] = buf[ip + 12:ip + 16]
+		buf[ip + 12:ip + 16] = self.ip_address
+
+		# swapping the addresses leaves the IP checksum as it is, the TTL does not
+		(old,) = WORD.unpack_from(buf, ip + 8)
+		new = self.ttl << 8 | 1
+		(checksum,) = WORD.unpack_from(buf, ip + 10)
+		WORD.pack_into(buf, ip + 8, new)
+		WORD.pack_into(buf, ip + 10, update_checksum(checksum, old, new))
+
+		(checksum,) = WORD.unpack_from(buf, icmp + 2)
+		buf[icmp] = 0
+		WORD.pack_into(buf, icmp + 2, update_checksum(checksum, 0x0800, 0x0000))
+
+		self.replies += 1
+
+		return memoryview(buf)[offset:ip + total_length]
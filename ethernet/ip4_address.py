@@ -1,15 +1,79 @@
+from collections import OrderedDict
+
+INTERN_LIMIT = 4096		# addresses kept in Ip4Address.interned
+
+
+# IPv4 address held as a 32 bit int, see MacAddress. Built from bytes-like
+# objects, lists, ints or dotted quad text.
+
 class Ip4Address(object):
-	def __init__(self, buf):
-		self.address = buf
-		self.address_string = ".".join("{:d}".format(byte) for byte in buf)
+	__slots__ = ("value",)
+
+	interned = OrderedDict()		# least recently used first
+
+	def __new__(cls, address):
+		if isinstance(address, int):
+			value = address
+		elif isinstance(address, str):
+			parts = address.split(".")
+
+			if len(parts) != 4 or not all(part.isdigit() and int(part) < 256 for part in parts):
+				raise ValueError("invalid IPv4 address {!r}".format(address))
+
+			value = int.from_bytes(bytes(int(part) for part in parts), "big")
+		elif isinstance(address, Ip4Address):
+			return address
+		else:
+			if len(address) != 4:
+				raise ValueError("IPv4 address needs 4 bytes, got {:d}".format(len(address)))
+
+			value = int.from_bytes(bytes(address), "big")
+
+		if value < 0 or value > 0xFFFFFFFF:
+			raise ValueError("IPv4 address {:d} out of range".format(value))
+
+		interned = cls.interned.get(value)
+
+		if interned is not None:
+			try:
+				cls.interned.move_to_end(value)
+				return interned
+			except KeyError:		# evicted by another thread in between
+				pass
+
+		self = object.__new__(cls)
+		self.value = value
+		cls.interned[value] = self
+
+		if len(cls.interned) > INTERN_LIMIT:
+			cls.interned.popitem(last=False)
+
+		return self
+
+
+	@property
+	def address(self):
+		return self.value.to_bytes(4, "big")
+
 
 	def __bytes__(self):
-		return bytes(self.address)
+		return self.value.to_bytes(4, "big")
+
+
+	def __int__(self):
+		return self.value
 
 
 	def __eq__(self, other):
-		return self.address == other.address
+		if not isinstance(other, Ip4Address):
+			return NotImplemented
+
+		return self.value == other.value
+
+
+	def __hash__(self):
+		return self.value
 
 
 	def __repr__(self):
-		return self.address_string
+		return ".".join("{:d}".format(byte) for byte in self.value.to_bytes(4, "big"))
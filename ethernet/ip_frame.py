@@ -1,8 +1,12 @@
 # https://en.wikipedia.org/wiki/IPv4#Packet_structure
 
+import struct
+
+from ethernet.checksum import internet_checksum
 from ethernet.ip4_address import Ip4Address
 from ethernet.udp_datagram import UdpDatagram
 from ethernet.icmp_datagram import IcmpDatagram
+from ethernet.tcp_segment import TcpSegment
 
 # https://en.wikipedia.org/wiki/List_of_IP_protocol_numbers
 
@@ -16,37 +20,60 @@ PROTOCOLS = {
     132: "SCTP"
 }
 
+# version/ihl, type of service, total length, id, flags/fragment offset, ttl,
+# protocol, header checksum, source, destination
+HEADER = struct.Struct("!BBHHHBBH4s4s")
+
+# payload parsers by protocol number; add to it to decode more protocols
+PAYLOAD_TYPES = {
+    1: IcmpDatagram,
+    6: TcpSegment,
+    17: UdpDatagram,
+}
+
 class IpFrame(object):
+    __slots__ = (
+        "version", "ihl", "type_of_service", "total_length", "id", "flags", "fragment_offset",
+        "ttl", "protocol", "header_checksum", "source_address", "destination_address", "payload"
+    )
+
     @classmethod
-    def from_buffer(cls, buf):
-        ihl = buf[0] & 0x0F
-        total_length = buf[2] * 256 + buf[3]
-        protocol = buf[9]
-
-        if protocol == 1:
-            payload = IcmpDatagram.from_buffer(buf[ihl << 2:total_length])
-        elif protocol == 17:
-            payload = UdpDatagram.from_buffer(buf[ihl << 2:total_length])
+    def from_buffer(cls, buf, offset=0, length=None):
+        (version_ihl, type_of_service, total_length, id, flags_fragment_offset, ttl, protocol, \
+            header_checksum, source_address, destination_address) = HEADER.unpack_from(buf, offset)
+        ihl = version_ihl & 0x0F
+        start = offset + (ihl << 2)
+        end = offset + total_length
+
+        if length is not None:
+            end = min(end, offset + length)
+
+        parser = PAYLOAD_TYPES.get(protocol)
+
+        # fragments carry a piece of the datagram, see IpReassembler
+        if parser is None or flags_fragment_offset & 0x3FFF != 0:
+            payload = buf[start:end]
         else:
-            payload = buf[ihl << 2:total_length]
+            payload = parser.from_buffer(buf, start, end - start)
 
         return cls(
-            version=buf[0] >> 4 & 0x0F,
+            version=version_ihl >> 4,
             ihl=ihl,
-            type_of_service=buf[1],
+            type_of_service=type_of_service,
             total_length=total_length,
-            id=buf[4] * 255 + buf[5],
-            flags=buf[6] >> 5 & 0x03,
-            fragment_offset=(buf[6] & 0x3F) * 256 + buf[7],
-            ttl=buf[8],
+            id=id,
+            flags=flags_fragment_offset >> 13,
+            fragment_offset=flags_fragment_offset & 0x1FFF,
+            ttl=ttl,
             protocol=protocol,
-            header_checksum=buf[10] * 256 + buf[11],
-            source_address=Ip4Address(buf[12:16]),
-            destination_address=Ip4Address(buf[16:20]),
+            header_checksum=header_checksum,
+            source_address=Ip4Address(source_address),
+            destination_address=Ip4Address(destination_address),
             payload=payload
         )
 
 
+    @classmethod
     def from_ip_frame(cls, frame):
         return cls(
             version=frame.version,
@@ -84,26 +111,43 @@ class IpFrame(object):
         self.payload = payload
 
 
+    def pack_header(self, header_checksum):
+        return HEADER.pack(
+            self.version << 4 | self.ihl,
+            self.type_of_service,
+            self.total_length,
+            self.id,
+            self.flags << 13 | self.fragment_offset,
+            self.ttl,
+            self.protocol,
+            header_checksum,
+            bytes(self.source_address),
+            bytes(self.destination_address)
+        )
+
+
+    @property
+    def is_fragment(self):
+        return self.flags & 0x01 != 0 or self.fragment_offset != 0
+
+
+    # Options are not kept, so only 20 byte headers can be checked
+    def verify_checksum(self):
+        return internet_checksum(self.pack_header(self.header_checksum)) == 0
+
+
+    # The header checksum and a TCP or UDP checksum are computed,
+    # header_checksum is ignored.
     def __bytes__(self):
-        ba = bytearray()
-
-        ba.append(self.version << 4 | self.ihl)
-        ba.append(self.type_of_service)
-        ba.append((self.total_length >> 8) & 0xFF)
-        ba.append(self.total_length & 0xFF)
-        ba.append((self.id >> 8) & 0xFF)
-        ba.append(self.id & 0xFF)
-        ba.append(((self.flag << 5) & 0xC0) | (self.fragment_offset >> 8) & 0x3F)
-        ba.append(self.fragment_offset & 0xFF)
-        ba.append(self.ttl)
-        ba.append(self.protocol)
-        ba.append((self.header_checksum >> 8) & 0xFF)
-        ba.append(self.header_checksum & 0xFF)
-        ba.extend(bytes(self.source_address))
-        ba.extend(bytes(self.destination_address))
-        ba.extend(bytes(self.payload))
-
-        return bytes(ba)
+        header = bytearray(self.pack_header(0))
+        header[10:12] = internet_checksum(header).to_bytes(2, "big")
+
+        if isinstance(self.payload, (TcpSegment, UdpDatagram)):
+            payload = self.payload.checksummed(self.source_address, self.destination_address)
+        else:
+            payload = bytes(self.payload)
+
+        return bytes(header) + payload
 
 
     def __repr__(self):
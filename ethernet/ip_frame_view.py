@@ -0,0 +1,120 @@
+from ethernet.ip_frame import IpFrame
+from ethernet.ip4_address import Ip4Address
+from ethernet.checksum import verify_checksum
+from ethernet.icmp_datagram_view import IcmpDatagramView
+from ethernet.udp_datagram_view import UdpDatagramView
+from ethernet.tcp_segment_view import TcpSegmentView
+
+PAYLOAD_TYPES = {
+	1: IcmpDatagramView,
+	6: TcpSegmentView,
+	17: UdpDatagramView,
+}
+
+
+# Lazy IpFrame, see EthernetFrameView.
+
+class IpFrameView(IpFrame):
+	__slots__ = ("buf", "offset", "end", "_source_address", "_destination_address", "_payload")
+
+	@classmethod
+	def from_buffer(cls, buf, offset=0, length=None):
+		return cls(buf, offset, length)
+
+
+	def __init__(self, buf, offset=0, length=None):
+		self.buf = buf
+		self.offset = offset
+		self.end = len(buf) if length is None else offset + length
+		self._source_address = None
+		self._destination_address = None
+		self._payload = None
+
+
+	@property
+	def version(self):
+		return self.buf[self.offset] >> 4 & 0x0F
+
+
+	@property
+	def ihl(self):
+		return self.buf[self.offset] & 0x0F
+
+
+	@property
+	def type_of_service(self):
+		return self.buf[self.offset + 1]
+
+
+	@property
+	def total_length(self):
+		return self.buf[self.offset + 2] * 256 + self.buf[self.offset + 3]
+
+
+	@property
+	def id(self):
+		return self.buf[self.offset + 4] * 256 + self.buf[self.offset + 5]
+
+
+	@property
+	def flags(self):
+		return self.buf[self.offset + 6] >> 5
+
+
+	@property
+	def fragment_offset(self):
+		return (self.buf[self.offset + 6] & 0x1F) * 256 + self.buf[self.offset + 7]
+
+
+	@property
+	def ttl(self):
+		return self.buf[self.offset + 8]
+
+
+	@property
+	def protocol(self):
+		return self.buf[self.offset + 9]
+
+
+	@property
+	def header_checksum(self):
+		return self.buf[self.offset + 10] * 256 + self.buf[self.offset + 11]
+
+
+	@property
+	def source_address(self):
+		if self._source_address is None:
+			self._source_address = Ip4Address(self.buf[self.offset + 12:self.offset + 16])
+
+		return self._source_address
+
+
+	@property
+	def destination_address(self):
+		if self._destination_address is None:
+			self._destination_address = Ip4Address(self.buf[self.offset + 16:self.offset + 20])
+
+		return self._destination_address
+
+
+	@property
+	def payload(self):
+		if self._payload is None:
+			view = PAYLOAD_TYPES.get(self.protocol)
+			start = self.offset + (self.ihl << 2)
+			end = min(self.offset + self.total_length, self.end)
+
+			if view is None or self.buf[self.offset + 6] & 0x3F != 0 or self.buf[self.offset + 7] != 0:
+				self._payload = self.buf[start:end]
+			else:
+				self._payload = view(self.buf, start, end - start)
+
+		return self._payload
+
+
+	def verify_checksum(self):
+		return verify_checksum(self.buf[self.offset:self.offset + (self.ihl << 2)])
+
+
+	def __bytes__(self):
+		return bytes(self.buf[self.offset:min(self.offset + self.total_length, self.end)])
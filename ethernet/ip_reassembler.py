@@ -0,0 +1,182 @@
+import time
+
+from ethernet.ip_frame import IpFrame, HEADER
+from ethernet.checksum import internet_checksum
+
+# flow fields
+BUFFER = 0
+HOLES = 1			# [first, last] byte ranges still missing, last is None while open ended
+SIZE = 2			# datagram payload size, None until the last fragment arrived
+FIRST = 3			# type of service and ttl of the fragment at offset 0
+DEADLINE = 4
+FRAGMENTS = 5
+
+
+# IPv4 fragment reassembly (RFC 791, holes as in RFC 815). Fragments are
+# collected per (source, destination, id, protocol) in one of max_datagrams
+# buffers of buffer_size bytes that are allocated up front, so memory use is
+# fixed no matter what arrives:
+#
+#   * a new flow with every buffer taken evicts the flow that started first
+#   * a flow is dropped when it is not complete timeout seconds after its first
+#     fragment, grows beyond buffer_size or needs more than max_fragments
+#   * overlapping data only fills holes, bytes already received are kept, and
+#     fragments that disagree about the datagram size drop the flow
+
+class IpReassembler(object):
+	def __init__(self, max_datagrams=8, buffer_size=0x10000, max_fragments=64, timeout=30.0, clock=time.monotonic):
+		self.buffer_size = buffer_size
+		self.max_fragments = max_fragments
+		self.timeout = timeout
+		self.clock = clock
+		self.free = [bytearray(buffer_size) for _ in range(max_datagrams)]
+		self.flows = {}
+		self.reassembled = 0
+		self.dropped_fragments = 0
+		self.timeouts = 0
+		self.evictions = 0
+
+
+	# Feed an IpFrame or IpFrameView. Returns the frame itself when it is not
+	# a fragment, a reassembled IpFrame with a decoded payload when it completes
+	# a datagram and None otherwise.
+	def add(self, frame):
+		if not frame.is_fragment:
+			return frame
+
+		self.expire()
+
+		key = (frame.source_address, frame.destination_address, frame.id, frame.protocol)
+		flow = self.flows.get(key)
+		data = frame.payload
+		first = frame.fragment_offset << 3
+		last = first + len(data) - 1
+		more = frame.flags & 0x01 != 0
+
+		# all but the last fragment carry a multiple of 8 bytes
+		if len(data) == 0 or (more and len(data) % 8 != 0) or last >= self.buffer_size:
+			self.dropped_fragments += 1
+
+			if flow is not None:
+				self.drop(key)
+
+			return None
+
+		if flow is None:
+			flow = self.start(key)
+
+		flow[FRAGMENTS] += 1
+
+		if flow[FRAGMENTS] > self.max_fragments or not self.fill(flow, data, first, last, more):
+			self.dropped_fragments += flow[FRAGMENTS]
+			self.drop(key)
+			return None
+
+		if first == 0:
+			flow[FIRST] = (frame.type_of_service, frame.ttl)
+
+		if len(flow[HOLES]) > 0:
+			return None
+
+		return self.finish(key, flow)
+
+
+	def start(self, key):
+		if len(self.free) == 0:
+			oldest = min(self.flows, key=lambda key: self.flows[key][DEADLINE])
+			self.dropped_fragments += self.flows[oldest][FRAGMENTS]
+			self.evictions += 1
+			self.drop(oldest)
+
+		flow = [self.free.pop(), [[0, None]], None, None, self.clock() + self.timeout, 0]
+		self.flows[key] = flow
+
+		return flow
+
+
+	# Copy the parts of data at first..last that fall into holes and update the
+	# hole list. False when the fragment contradicts the datagram size.
+	def fill(self, flow, data, first, last, more):
+		size = flow[SIZE]
+
+		if size is not None and (last >= size or (not more and last != size - 1)):
+			return False
+
+		if not more:
+			if size is None and any(hole[1] is None and hole[0] > last + 1 for hole in flow[HOLES]):
+				return False		# data beyond the end was already received
+
+			flow[SIZE] = last + 1
+
+		buf = flow[BUFFER]
+		holes = []
+
+		for (hole_first, hole_last) in flow[HOLES]:
+			if hole_last is None and not more:
+				hole_last = last
+
+			if hole_first > last or (hole_last is not None and hole_last < first):
+				if hole_last is None or hole_first <= hole_last:
+					holes.append([hole_first, hole_last])
+				continue
+
+			start = max(first, hole_first)
+			end = last if hole_last is None else min(last, hole_last)
+			buf[start:end + 1] = data[start - first:end - first + 1]
+
+			if hole_first < first:
+				holes.append([hole_first, first - 1])
+
+			if hole_last is None:
+				holes.append([last + 1, None])
+			elif last < hole_last:
+				holes.append([last + 1, hole_last])
+
+		flow[HOLES] = holes
+
+		return True
+
+
+	def finish(self, key, flow):
+		size = flow[SIZE]
+		(source_address, destination_address, id, protocol) = key
+		(type_of_service, ttl) = flow[FIRST]
+		datagram = bytearray(HEADER.size + size)
+		HEADER.pack_into(
+			datagram,
+			0,
+			0x45,
+			type_of_service,
+			HEADER.size + size,
+			id,
+			0,
+			ttl,
+			protocol,
+			0,
+			bytes(source_address),
+			bytes(destination_address)
+		)
+		datagram[10:12] = internet_checksum(datagram[:HEADER.size]).to_bytes(2, "big")
+		datagram[HEADER.size:] = memoryview(flow[BUFFER])[:size]
+		self.drop(key)
+		self.reassembled += 1
+
+		return IpFrame.from_buffer(memoryview(datagram))
+
+
+	def drop(self, key):
+		flow = self.flows.pop(key)
+		self.free.append(flow[BUFFER])
+
+
+	def expire(self):
+		now = self.clock()
+
+		for key in [key for (key, flow) in self.flows.items() if flow[DEADLINE] <= now]:
+			self.dropped_fragments += self.flows[key][FRAGMENTS]
+			self.timeouts += 1
+			self.drop(key)
+
+
+	def __len__(self):
+		return len(self.flows)
@@ -1,16 +1,93 @@
+from collections import OrderedDict
+
+INTERN_LIMIT = 4096		# addresses kept in MacAddress.interned
+
+
+# 48 bit MAC address held as an int. Immutable, hashable and interned: the
+# INTERN_LIMIT most recently used addresses are shared, so parsing a frame
+# from a host seen lately allocates nothing, and a burst of new (or spoofed)
+# addresses only pushes out addresses nobody used since. Built from
+# bytes-like objects, lists, ints or text ("30:9c:23:0d:2d:7f" or with
+# dashes).
+
 class MacAddress(object):
-	def __init__(self, buf):
-		self.address = buf
-		self.address_string = ":".join("{:02x}".format(byte) for byte in buf)
+	__slots__ = ("value",)
+
+	interned = OrderedDict()		# least recently used first
+
+	def __new__(cls, address):
+		if isinstance(address, int):
+			value = address
+		elif isinstance(address, str):
+			parts = address.replace("-", ":").split(":")
+
+			if len(parts) != 6:
+				raise ValueError("invalid MAC address {!r}".format(address))
+
+			value = int("".join("{:0>2s}".format(part) for part in parts), 16)
+		elif isinstance(address, MacAddress):
+			return address
+		else:
+			if len(address) != 6:
+				raise ValueError("MAC address needs 6 bytes, got {:d}".format(len(address)))
+
+			value = int.from_bytes(bytes(address), "big")
+
+		if value < 0 or value > 0xFFFFFFFFFFFF:
+			raise ValueError("MAC address {:d} out of range".format(value))
+
+		interned = cls.interned.get(value)
+
+		if interned is not None:
+			try:
+				cls.interned.move_to_end(value)
+				return interned
+			except KeyError:		# evicted by another thread in between
+				pass
+
+		self = object.__new__(cls)
+		self.value = value
+		cls.interned[value] = self
+
+		if len(cls.interned) > INTERN_LIMIT:
+			cls.interned.popitem(last=False)
+
+		return self
+
+
+	@property
+	def address(self):
+		return self.value.to_bytes(6, "big")
+
+
+	@property
+	def is_multicast(self):
+		return self.value & 0x010000000000 != 0
+
+
+	@property
+	def is_broadcast(self):
+		return self.value == 0xFFFFFFFFFFFF
 
 
 	def __bytes__(self):
-		return bytes(self.address)
+		return self.value.to_bytes(6, "big")
+
+
+	def __int__(self):
+		return self.value
 
 
 	def __eq__(self, other):
-		return self.address == other.address
+		if not isinstance(other, MacAddress):
+			return NotImplemented
+
+		return self.value == other.value
+
+
+	def __hash__(self):
+		return self.value
 
 
 	def __repr__(self):
-		return self.address_string
+		return ":".join("{:02x}".format(byte) for byte in self.value.to_bytes(6, "big"))
@@ -0,0 +1,438 @@
+import errno
+
+from ethernet.constants import MAX_FRAMELEN, HEADER_SIZE
+from ethernet.ip4_address import Ip4Address
+from ethernet.arp_cache import ArpCache
+from ethernet.arp_responder import ArpResponder
+from ethernet.arp_frame_view import ArpFrameView
+from ethernet.icmp_echo_responder import IcmpEchoResponder
+from ethernet.ip_frame import HEADER as IP_HEADER
+from ethernet.ip_frame_view import IpFrameView
+from ethernet.ip_reassembler import IpReassembler
+from ethernet.icmp_datagram import HEADER as ICMP_HEADER
+from ethernet.udp_datagram import HEADER as UDP_HEADER
+from ethernet.udp_socket import UdpSocket
+from ethernet.tcp_segment import HEADER as TCP_HEADER, SYN, RST, ACK, FIN
+from ethernet.tcp_connection import TcpConnection
+from ethernet.tcp_listener import TcpListener
+from ethernet.protocol_registry import ProtocolRegistry
+from ethernet.checksum import internet_checksum, pseudo_header_sum
+
+BROADCAST = Ip4Address("255.255.255.255")
+EPHEMERAL_PORTS = range(49152, 65536)
+TRANSPORT_OFFSET = 14 + IP_HEADER.size
+UDP_OFFSET = TRANSPORT_OFFSET
+PAYLOAD_OFFSET = UDP_OFFSET + UDP_HEADER.size
+
+
+# Minimal IPv4 host on an Enc28j60: answers ARP and pings (as long as the
+# reply fits into one frame), reassembles fragments, hands UDP datagrams to
+# the UdpSocket bound to their port and runs TCP connections. poll() does the
+# receiving and the TCP timers; sockets call it while they wait. IPv4 headers
+# that are malformed or fail their checksum are dropped before anything looks
+# at the transport header behind them.
+#
+# TCP segments are sized to the chip: tcp_mss fills a frame that fits into a
+# transmit slot, and tcp_window, the largest window a connection advertises,
+# is as many full segments as the receive ring holds.
+
+class NetworkStack(object):
+	def __init__(self, driver, ip_address, netmask="255.255.255.0", gateway=None):
+		self.driver = driver
+		self.clock = driver.clock
+		self.mac_address = driver.mac_address
+		self.ip_address = Ip4Address(ip_address)
+		self.netmask = int(Ip4Address(netmask))
+		self.gateway = None if gateway is None else Ip4Address(gateway)
+		self.subnet_broadcast = Ip4Address(int(self.ip_address) | (~self.netmask & 0xFFFFFFFF))
+		self.arp_cache = ArpCache(driver.send_packet, self.mac_address, self.ip_address, clock=self.clock)
+		self.arp_responder = ArpResponder(self.mac_address, self.ip_address)
+		self.echo_responder = IcmpEchoResponder(self.mac_address, self.ip_address)
+		self.reassembler = IpReassembler(clock=self.clock)
+		self.verify_udp_checksums = True
+		self.udp_ports = {}
+		self.next_port = EPHEMERAL_PORTS.start
+		self.next_id = 0
+		self.registry = ProtocolRegistry()
+		self.registry.register_ethertype(0x0806, self.handle_arp)
+		self.registry.register_ip_protocol(1, self.handle_icmp)
+		self.registry.register_ip_protocol(17, self.handle_udp)
+		self.registry.register_ip_protocol(6, self.handle_tcp)
+
+		self.tcp_mss = min(MAX_FRAMELEN, driver.layout.tx_capacity) - TRANSPORT_OFFSET - TCP_HEADER.size
+		# receive header, frame, FCS and alignment per segment in the ring
+		segments = driver.layout.rx_size // (HEADER_SIZE + TRANSPORT_OFFSET + TCP_HEADER.size + self.tcp_mss + 5)
+		self.tcp_window = max(1, segments) * self.tcp_mss
+		self.tcp_max_connections = 16
+		self.tcp_listeners = {}
+		self.tcp_connections = {}
+		self.verify_tcp_checksums = True
+
+		self.buf = bytearray(MAX_FRAMELEN)
+		self.view = memoryview(self.buf)
+		self.send_buf = bytearray(MAX_FRAMELEN)
+		self.send_view = memoryview(self.send_buf)
+		self.send_buf[6:14] = bytes(self.mac_address) + b"\x08\x00"
+
+		self.frames = 0
+		self.unhandled = 0
+		self.no_port = 0
+		self.checksum_errors = 0
+
+
+	def socket(self, queue_size=16):
+		return UdpSocket(self, queue_size)
+
+
+	def ephemeral_port(self, in_use):
+		for _ in EPHEMERAL_PORTS:
+			port = self.next_port
+			self.next_port = port + 1 if port + 1 < EPHEMERAL_PORTS.stop else EPHEMERAL_PORTS.start
+
+			if not in_use(port):
+				return port
+
+		raise OSError(errno.EADDRINUSE, "no free ephemeral port")
+
+
+	def bind(self, udp_socket, port):
+		if port == 0:
+			port = self.ephemeral_port(lambda port: port in self.udp_ports)
+
+		if port in self.udp_ports:
+			raise OSError(errno.EADDRINUSE, "port {:d} is in use".format(port))
+
+		self.udp_ports[port] = udp_socket
+
+		return port
+
+
+	def unbind(self, port):
+		del self.udp_ports[port]
+
+
+	def tcp_socket(self, send_buffer_size=None, receive_buffer_size=None):
+		return TcpConnection(self, send_buffer_size, receive_buffer_size)
+
+
+	def listen(self, port, backlog=4):
+		if port in self.tcp_listeners:
+			raise OSError(errno.EADDRINUSE, "port {:d} is in use".format(port))
+
+		listener = TcpListener(self, port, backlog)
+		self.tcp_listeners[port] = listener
+
+		return listener
+
+
+	def unlisten(self, port):
+		del self.tcp_listeners[port]
+
+
+	# Enter connection into the connection table, on an ephemeral port unless
+	# local_port is given
+	def open_tcp(self, connection, remote_address, remote_port, local_port=None):
+		if len(self.tcp_connections) >= self.tcp_max_connections:
+			raise OSError(errno.ENOBUFS, "{:d} TCP connections are open".format(len(self.tcp_connections)))
+
+		if local_port is None:
+			ports = set(key[1] for key in self.tcp_connections)
+			local_port = self.ephemeral_port(lambda port: port in ports or port in self.tcp_listeners)
+
+		key = (self.ip_address, local_port, remote_address, remote_port)
+
+		if key in self.tcp_connections:
+			raise OSError(errno.EADDRINUSE, "connection to {}:{:d} exists".format(remote_address, remote_port))
+
+		connection.local_port = local_port
+		connection.remote_address = remote_address
+		connection.remote_port = remote_port
+		connection.key = key
+		self.tcp_connections[key] = connection
+
+
+	def close_tcp(self, connection):
+		if self.tcp_connections.get(connection.key) is connection:
+			del self.tcp_connections[connection.key]
+
+
+	# Run the TCP timers that are due and return timeout cut down to the time
+	# until the next one
+	def poll_tcp(self, timeout):
+		now = self.clock()
+		next_deadline = None
+
+		for connection in list(self.tcp_connections.values()):
+			deadline = connection.deadline
+
+			if deadline is not None and deadline <= now:
+				connection.poll_timers(now)
+				deadline = connection.deadline
+
+			if deadline is not None and (next_deadline is None or deadline < next_deadline):
+				next_deadline = deadline
+
+		if next_deadline is None:
+			return timeout
+
+		remaining = max(0.0, next_deadline - now)
+
+		return remaining if timeout is None else min(timeout, remaining)
+
+
+	# ARP retries and expiry and the TCP timers; returns timeout cut down to the
+	# next TCP deadline
+	def poll_timers(self, timeout):
+		self.arp_cache.poll()
+
+		return self.poll_tcp(timeout)
+
+
+	# Receive and dispatch what is pending, waiting up to timeout seconds for the
+	# first frame. Returns the number of frames handled.
+	def poll(self, timeout=0, max_frames=32):
+		timeout = self.poll_timers(timeout)
+		count = 0
+
+		if not self.driver.wait_for_packet(timeout):
+			return count
+
+		while count < max_frames and self.driver.wait_for_packet(0):
+			length = self.driver.receive_packet_into(self.buf)
+
+			if length > 0:
+				self.process(self.view[:length])
+				count += 1
+
+		return count
+
+
+	# Handlers for more EtherTypes or IP protocols can be added to registry
+	def process(self, frame):
+		self.frames += 1
+
+		if not self.registry.dispatch(frame):
+			self.unhandled += 1
+
+
+	def handle_arp(self, frame):
+		self.arp_cache.handle(ArpFrameView(frame, 14))
+		reply = self.arp_responder.reply(frame)
+
+		if reply is not None:
+			self.driver.send_packet(reply)
+
+
+	# Echo requests are answered in place. Fragmented ones are reassembled into
+	# the send buffer first; their reply is only sent when it fits into one
+	# frame, the stack does not fragment what it sends.
+	def handle_icmp(self, frame):
+		ip = IpFrameView(frame, 14)
+
+		if ip.is_fragment:
+			if not self.valid_ip(ip, len(frame), ICMP_HEADER.size) or ip.destination_address != self.ip_address:
+				self.unhandled += 1
+				return
+
+			ip = self.reassembler.add(ip)
+
+			if ip is None:
+				return
+
+			datagram = bytes(ip)
+			end = 14 + len(datagram)
+
+			if end > len(self.send_buf) or end > self.driver.layout.tx_capacity:
+				self.unhandled += 1
+				return
+
+			self.send_buf[0:14] = frame[0:14]
+			self.send_buf[14:end] = datagram
+			frame = self.send_view[:end]
+
+		reply = self.echo_responder.reply(frame)
+
+		if reply is not None:
+			self.driver.send_packet(reply)
+		else:
+			self.unhandled += 1
+
+
+	def accepts(self, destination):
+		return destination == self.ip_address or destination == BROADCAST or destination == self.subnet_broadcast
+
+
+	# ip (a view at offset 14 of a frame of length bytes) has a sound IPv4
+	# header followed by at least size bytes, unless it is a fragment that
+	# does not start the datagram
+	def valid_ip(self, ip, length, size):
+		ihl = ip.ihl
+
+		if ip.version != 4 or ihl < 5:
+			return False
+
+		if (ihl << 2) + (size if ip.fragment_offset == 0 else 0) > min(ip.total_length, length - 14):
+			return False
+
+		return ip.verify_checksum()
+
+
+	def handle_udp(self, frame):
+		ip = IpFrameView(frame, 14)
+
+		if not self.valid_ip(ip, len(frame), UDP_HEADER.size):
+			self.unhandled += 1
+			return
+
+		destination = ip.destination_address
+
+		if not self.accepts(destination):
+			self.unhandled += 1
+			return
+
+		ip = self.reassembler.add(ip)
+
+		if ip is None:
+			return
+
+		udp = ip.payload
+		udp_socket = self.udp_ports.get(udp.destination_port)
+
+		if udp_socket is None:
+			self.no_port += 1
+			return
+
+		if self.verify_udp_checksums and not udp.verify_checksum(ip.source_address, destination):
+			self.checksum_errors += 1
+			return
+
+		udp_socket.deliver(bytes(udp.payload), (ip.source_address, udp.source_port))
+
+
+	def handle_tcp(self, frame):
+		ip = IpFrameView(frame, 14)
+
+		if not self.valid_ip(ip, len(frame), TCP_HEADER.size):
+			self.unhandled += 1
+			return
+
+		destination = ip.destination_address
+
+		if destination != self.ip_address:
+			self.unhandled += 1
+			return
+
+		ip = self.reassembler.add(ip)
+
+		if ip is None:
+			return
+
+		segment = ip.payload
+		source = ip.source_address
+
+		if self.verify_tcp_checksums and not segment.verify_checksum(source, destination):
+			self.checksum_errors += 1
+			return
+
+		connection = self.tcp_connections.get((destination, segment.destination_port, source, segment.source_port))
+
+		if connection is not None:
+			connection.segment_arrives(segment)
+			return
+
+		flags = segment.flags
+
+		if flags & RST:
+			return
+
+		listener = self.tcp_listeners.get(segment.destination_port)
+
+		if listener is not None and flags & (SYN | ACK) == SYN:
+			if len(self.tcp_connections) < self.tcp_max_connections:
+				listener.syn_arrives(source, segment)
+
+			return
+
+		# RFC 793, 3.4: anything else is answered with a reset
+		self.no_port += 1
+
+		if flags & ACK:
+			self.send_tcp(segment.destination_port, source, segment.source_port, segment.acknowledgment_number, 0, RST, 0)
+		else:
+			length = len(segment.payload) + (1 if flags & SYN else 0) + (1 if flags & FIN else 0)
+			ack = (segment.sequence_number + length) & 0xFFFFFFFF
+			self.send_tcp(segment.destination_port, source, segment.source_port, 0, ack, RST | ACK, 0)
+
+
+	def send_udp(self, source_port, ip_address, port, data):
+		end = PAYLOAD_OFFSET + len(data)
+
+		if end > len(self.send_buf) or end > self.driver.layout.tx_capacity:
+			raise ValueError("datagram of {:d} bytes exceeds the MTU".format(len(data)))
+
+		buf = self.send_buf
+		udp_length = UDP_HEADER.size + len(data)
+		UDP_HEADER.pack_into(buf, UDP_OFFSET, source_port, port, udp_length, 0)
+		buf[PAYLOAD_OFFSET:end] = data
+		total = pseudo_header_sum(self.ip_address, ip_address, 17, udp_length)
+		checksum = internet_checksum(self.send_view[UDP_OFFSET:end], total) or 0xFFFF
+		buf[UDP_OFFSET + 6:UDP_OFFSET + 8] = checksum.to_bytes(2, "big")
+
+		self.send_ip(ip_address, 17, end)
+
+
+	def send_tcp(self, source_port, ip_address, port, seq, ack, flags, window, data=b"", options=b""):
+		header_length = TCP_HEADER.size + len(options)
+		start = TRANSPORT_OFFSET + header_length
+		end = start + len(data)
+
+		if end > len(self.send_buf) or end > self.driver.layout.tx_capacity:
+			raise ValueError("segment of {:d} bytes exceeds the MTU".format(len(data)))
+
+		buf = self.send_buf
+		TCP_HEADER.pack_into(buf, TRANSPORT_OFFSET, source_port, port, seq, ack, header_length << 2, flags, window, 0, 0)
+		buf[TRANSPORT_OFFSET + TCP_HEADER.size:start] = options
+		buf[start:end] = data
+		total = pseudo_header_sum(self.ip_address, ip_address, 6, end - TRANSPORT_OFFSET)
+		checksum = internet_checksum(self.send_view[TRANSPORT_OFFSET:end], total)
+		buf[TRANSPORT_OFFSET + 16:TRANSPORT_OFFSET + 18] = checksum.to_bytes(2, "big")
+
+		self.send_ip(ip_address, 6, end)
+
+
+	# Add the IPv4 header to the transport data at TRANSPORT_OFFSET..end of the
+	# send buffer and pass the frame on, through the ARP cache when the next
+	# hop is not resolved yet.
+	def send_ip(self, ip_address, protocol, end):
+		buf = self.send_buf
+		self.next_id = (self.next_id + 1) & 0xFFFF
+
+		IP_HEADER.pack_into(buf, 14, 0x45, 0, end - 14, self.next_id, 0x4000, 64, protocol, 0, \
+			bytes(self.ip_address), bytes(ip_address))
+		buf[24:26] = internet_checksum(self.send_view[14:TRANSPORT_OFFSET]).to_bytes(2, "big")
+
+		frame = self.send_view[:end]
+
+		if ip_address == BROADCAST or ip_address == self.subnet_broadcast:
+			buf[0:6] = b"\xff\xff\xff\xff\xff\xff"
+			self.driver.send_packet(frame)
+			return
+
+		next_hop = self.next_hop(ip_address)
+		mac_address = self.arp_cache.lookup(next_hop)
+
+		if mac_address is None:
+			self.arp_cache.send_to(next_hop, frame)
+		else:
+			buf[0:6] = bytes(mac_address)
+			self.driver.send_packet(frame)
+
+
+	def next_hop(self, ip_address):
+		if int(ip_address) & self.netmask == int(self.ip_address) & self.netmask:
+			return ip_address
+
+		if self.gateway is None:
+			raise OSError(errno.ENETUNREACH, "no route to {}".format(ip_address))
+
+		return self.gateway
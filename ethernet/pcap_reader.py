@@ -0,0 +1,98 @@
+import mmap
+import struct
+
+from ethernet.pcap_writer import PCAPNG_BLOCK, PCAPNG_PACKET
+
+PCAP_MAGIC = {
+	b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+	b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+	b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+	b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+PCAP_HEADER_SIZE = 24
+
+
+# Reads a pcap or pcapng capture through mmap. Iterating gives
+# (timestamp, frame) with frame a memoryview into the mapping, ready for
+# EthernetFrame.from_buffer() or Enc28j60Simulator.inject(); nothing is copied.
+# The views must be released before close(). pcapng files are read with the
+# little endian layout and a microsecond timestamp resolution.
+
+class PcapReader(object):
+	def __init__(self, path):
+		with open(path, "rb") as file:
+			self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		self.view = memoryview(self.map)
+		magic = bytes(self.view[0:4])
+
+		if magic == PCAPNG_MAGIC:
+			self.pcapng = True
+		elif magic in PCAP_MAGIC:
+			self.pcapng = False
+			(byte_order, self.resolution) = PCAP_MAGIC[magic]
+			self.record = struct.Struct(byte_order + "IIII")
+			self.linktype = struct.unpack_from(byte_order + "I", self.view, 20)[0]
+		else:
+			self.close()
+			raise ValueError("{} is no pcap or pcapng file".format(path))
+
+
+	def __iter__(self):
+		if self.pcapng:
+			return self.read_pcapng()
+
+		return self.read_pcap()
+
+
+	def read_pcap(self):
+		view = self.view
+		record = self.record
+		offset = PCAP_HEADER_SIZE
+
+		while offset + record.size <= len(view):
+			(seconds, fraction, captured, length) = record.unpack_from(view, offset)
+			offset += record.size
+			yield (seconds + fraction * self.resolution, view[offset:offset + captured])
+			offset += captured
+
+
+	def read_pcapng(self):
+		view = self.view
+		offset = 0
+
+		while offset + PCAPNG_BLOCK.size <= len(view):
+			(type, length) = PCAPNG_BLOCK.unpack_from(view, offset)
+
+			if length < 12:
+				raise ValueError("corrupt pcapng block at {:d}".format(offset))
+
+			if type == 0x00000006:		# enhanced packet block
+				(interface, high, low, captured, original) = PCAPNG_PACKET.unpack_from(view, offset + 8)
+				start = offset + 8 + PCAPNG_PACKET.size
+				yield ((high << 32 | low) * 1e-6, view[start:start + captured])
+			elif type == 0x00000003:	# simple packet block
+				original = struct.unpack_from("<I", view, offset + 8)[0]
+				captured = min(original, length - 16)
+				yield (0.0, view[offset + 12:offset + 12 + captured])
+
+			offset += length
+
+
+	def frames(self):
+		for (timestamp, frame) in self:
+			yield frame
+
+
+	def close(self):
+		self.view.release()
+		self.map.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
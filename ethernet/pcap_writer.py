@@ -0,0 +1,92 @@
+import struct
+import time
+
+PCAP_HEADER = struct.Struct("<IHHiIII")		# magic, version, thiszone, sigfigs, snaplen, linktype
+PCAP_RECORD = struct.Struct("<IIII")		# seconds, microseconds, captured length, original length
+PCAPNG_BLOCK = struct.Struct("<II")			# block type, block length
+PCAPNG_SECTION = struct.Struct("<IHHq")		# byte order magic, version, section length
+PCAPNG_INTERFACE = struct.Struct("<HHI")	# linktype, reserved, snaplen
+PCAPNG_PACKET = struct.Struct("<IIIII")		# interface, timestamp high, low, captured length, original length
+LINKTYPE_ETHERNET = 1
+
+
+# Writes frames to a pcap (or with pcapng=True, a pcapng) capture file.
+# Records are collected in memory and written buffer_size bytes at a time,
+# frames are cut to snaplen bytes. file is a path or a binary file object.
+# Hook it into the driver with Enc28j60.capture.
+
+class PcapWriter(object):
+	def __init__(self, file, snaplen=65535, pcapng=False, buffer_size=0x10000, clock=time.time):
+		if isinstance(file, str):
+			self.file = open(file, "wb")
+			self.owned = True
+		else:
+			self.file = file
+			self.owned = False
+
+		self.snaplen = snaplen
+		self.pcapng = pcapng
+		self.buffer_size = buffer_size
+		self.clock = clock
+		self.buffer = bytearray()
+		self.frames = 0
+
+		if pcapng:
+			self.write_block(0x0A0D0D0A, PCAPNG_SECTION.pack(0x1A2B3C4D, 1, 0, -1))
+			self.write_block(0x00000001, PCAPNG_INTERFACE.pack(LINKTYPE_ETHERNET, 0, snaplen))
+		else:
+			self.buffer += PCAP_HEADER.pack(0xA1B2C3D4, 2, 4, 0, 0, snaplen, LINKTYPE_ETHERNET)
+
+
+	def write_block(self, type, body):
+		padding = -len(body) % 4
+		length = PCAPNG_BLOCK.size + len(body) + padding + 4
+		self.buffer += PCAPNG_BLOCK.pack(type, length)
+		self.buffer += body
+		self.buffer += bytes(padding)
+		self.buffer += length.to_bytes(4, "little")
+
+
+	# Add frame (any bytes-like object) taken at timestamp, seconds since the
+	# epoch, now if None.
+	def write(self, frame, timestamp=None):
+		if timestamp is None:
+			timestamp = self.clock()
+
+		length = len(frame)
+		captured = min(length, self.snaplen)
+
+		if self.pcapng:
+			microseconds = int(timestamp * 1000000)
+			header = PCAPNG_PACKET.pack(0, microseconds >> 32, microseconds & 0xFFFFFFFF, captured, length)
+			self.write_block(0x00000006, header + bytes(frame[:captured]))
+		else:
+			seconds = int(timestamp)
+			self.buffer += PCAP_RECORD.pack(seconds, int((timestamp - seconds) * 1000000), captured, length)
+			self.buffer += frame[:captured]
+
+		self.frames += 1
+
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+
+
+	def flush(self):
+		self.file.write(self.buffer)
+		self.file.flush()
+		self.buffer.clear()
+
+
+	def close(self):
+		self.flush()
+
+		if self.owned:
+			self.file.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,69 @@
+# Dispatch of received frames to handlers by EtherType and, for IPv4, by IP
+# protocol number. Both lookups are dict hits on bytes read straight from the
+# buffer; a frame nobody registered for is dropped without building any
+# objects. Handlers are called with the frame as a memoryview and build the
+# views they need themselves.
+#
+# IPv4 frames go to the handler of their IP protocol if there is one, else to
+# an EtherType 0x0800 handler.
+
+class ProtocolRegistry(object):
+	def __init__(self):
+		self.ethertypes = {}
+		self.ip_protocols = {}
+		self.hits = {}
+		self.dropped = 0
+
+
+	def register_ethertype(self, type, handler):
+		self.ethertypes[type] = handler
+		self.hits.setdefault(("ethertype", type), 0)
+
+
+	def register_ip_protocol(self, protocol, handler):
+		self.ip_protocols[protocol] = handler
+		self.hits.setdefault(("ip", protocol), 0)
+
+
+	def unregister_ethertype(self, type):
+		del self.ethertypes[type]
+
+
+	def unregister_ip_protocol(self, protocol):
+		del self.ip_protocols[protocol]
+
+
+	# Hand frame (a bytes-like object, typically a view of the receive buffer)
+	# to its handler. Returns False when it was dropped.
+	def dispatch(self, frame):
+		if len(frame) < 14:
+			self.dropped += 1
+			return False
+
+		type = frame[12] << 8 | frame[13]
+
+		if type == 0x0800 and len(frame) >= 34:
+			handler = self.ip_protocols.get(frame[23])
+
+			if handler is not None:
+				self.hits[("ip", frame[23])] += 1
+				handler(memoryview(frame))
+				return True
+
+		handler = self.ethertypes.get(type)
+
+		if handler is None:
+			self.dropped += 1
+			return False
+
+		self.hits[("ethertype", type)] += 1
+		handler(memoryview(frame))
+
+		return True
+
+
+	def __repr__(self):
+		parts = ["{:s} {:#06x} = {:d}".format(kind, key, count) for ((kind, key), count) in sorted(self.hits.items())]
+		parts.append("dropped = {:d}".format(self.dropped))
+
+		return "\n".join(parts)
@@ -0,0 +1,224 @@
+from ethernet.constants import *
+from ethernet.checksum import internet_checksum
+
+PATTERN_WINDOW = 64			# bytes covered by EPMM0..EPMM7
+BROADCAST = b"\xff\xff\xff\xff\xff\xff"
+
+
+# Index of the EHT0..EHT7 bit that a destination address selects: bits 28:23
+# of the CRC-32 over the address, shifted in LSb first.
+def hash_table_index(address):
+	crc = 0xFFFFFFFF
+
+	for byte in bytes(address):
+		for _ in range(8):
+			if (crc >> 31) ^ (byte & 0x01):
+				crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF
+			else:
+				crc = (crc << 1) & 0xFFFFFFFF
+
+			byte >>= 1
+
+	return (crc >> 23) & 0x3F
+
+
+# Declarative receive filter. A frame is accepted when any of the rules matches
+# (the ERXFCON OR mode). compile() maps the rules onto the unicast, broadcast,
+# multicast, hash table and pattern match filters and splits them into the
+# rules the chip enforces and the ones left to matches() in software:
+#
+#   * the hash table and the pattern checksum let some other frames through,
+#     so those rules are enforced by the chip and refined in software
+#   * only one pattern fits into EPMM/EPMCS/EPMO, and predicates never fit;
+#     a rule the chip cannot express turns hardware filtering off except for
+#     the CRC check, because it would otherwise drop frames the rule accepts
+
+class ReceiveFilter(object):
+	def __init__(self, check_crc=True):
+		self.check_crc = check_crc
+		self.rules = []
+		self.hardware = []
+		self.software = []
+		self.exact = True
+		self.erxfcon = 0
+		self.hash_table = bytearray(8)
+		self.pattern_mask = bytearray(8)
+		self.pattern_checksum = 0
+		self.pattern_offset = 0
+
+
+	# frames sent to our own MAC address
+	def unicast(self):
+		return self.add("unicast", None)
+
+
+	def broadcast(self):
+		return self.add("broadcast", None)
+
+
+	# every multicast frame, broadcasts included
+	def multicast(self):
+		return self.add("multicast", None)
+
+
+	def multicast_group(self, address):
+		return self.add("group", bytes(address))
+
+
+	# frames whose bytes at offset equal data; bytes with a zero mask byte are
+	# not compared
+	def pattern(self, offset, data, mask=None):
+		data = bytes(data)
+		mask = bytes(b"\x01" * len(data) if mask is None else mask)
+
+		if len(mask) != len(data):
+			raise ValueError("pattern has {:d} bytes but mask has {:d}".format(len(data), len(mask)))
+
+		if len(data) == 0 or len(data) > PATTERN_WINDOW:
+			raise ValueError("pattern must have 1 to {:d} bytes".format(PATTERN_WINDOW))
+
+		if offset < 0 or offset + len(data) > MAX_FRAMELEN:
+			raise ValueError("pattern at offset {:d} does not fit into a frame".format(offset))
+
+		return self.add("pattern", (offset, data, mask))
+
+
+	def source(self, address):
+		return self.pattern(6, bytes(address))
+
+
+	def ethertype(self, type):
+		return self.pattern(12, type.to_bytes(2, "big"))
+
+
+	# frames for which predicate(frame) is true, always checked in software
+	def predicate(self, predicate):
+		return self.add("predicate", predicate)
+
+
+	def add(self, kind, argument):
+		self.rules.append((kind, argument))
+
+		return self
+
+
+	def compile(self, mac_address):
+		self.mac_address = bytes(mac_address)
+		self.hardware = []
+		self.software = []
+		self.exact = True
+		self.erxfcon = 0
+		self.hash_table = bytearray(8)
+		self.pattern_mask = bytearray(8)
+		self.pattern_checksum = 0
+		self.pattern_offset = 0
+
+		patterns = 0
+
+		for rule in self.rules:
+			(kind, argument) = rule
+
+			if kind == "unicast":
+				self.erxfcon |= ERXFCON_UCEN
+			elif kind == "broadcast":
+				self.erxfcon |= ERXFCON_BCEN
+			elif kind == "multicast":
+				self.erxfcon |= ERXFCON_MCEN
+			elif kind == "group":
+				index = hash_table_index(argument)
+				self.hash_table[index >> 3] |= 1 << (index & 0x07)
+				self.erxfcon |= ERXFCON_HTEN
+				self.exact = False
+			elif kind == "pattern" and patterns == 0:
+				self.program_pattern(*argument)
+				self.erxfcon |= ERXFCON_PMEN
+				self.exact = False
+				patterns += 1
+			else:
+				self.software.append(rule)
+				continue
+
+			self.hardware.append(rule)
+
+		if len(self.software) > 0:
+			self.software = list(self.rules)
+			self.hardware = []
+			self.exact = False
+			self.erxfcon = 0
+
+		if self.check_crc:
+			self.erxfcon |= ERXFCON_CRCEN
+
+		return self
+
+
+	def program_pattern(self, offset, data, mask):
+		# keep the window as low as possible, the chip only matches frames that
+		# reach the end of it
+		start = max(0, offset + len(data) - PATTERN_WINDOW)
+		selected = bytearray()
+
+		for index in range(len(data)):
+			if mask[index]:
+				bit = offset - start + index
+				self.pattern_mask[bit >> 3] |= 1 << (bit & 0x07)
+				selected.append(data[index])
+
+		self.pattern_offset = start
+		self.pattern_checksum = internet_checksum(selected)
+
+
+	def matches(self, frame):
+		return any(self.match_rule(rule, frame) for rule in self.rules)
+
+
+	def match_rule(self, rule, frame):
+		(kind, argument) = rule
+		destination = bytes(frame[0:6])
+
+		if kind == "unicast":
+			return destination == self.mac_address
+
+		if kind == "broadcast":
+			return destination == BROADCAST
+
+		if kind == "multicast":
+			return len(frame) > 0 and frame[0] & 0x01 == 0x01
+
+		if kind == "group":
+			return destination == argument
+
+		if kind == "pattern":
+			(offset, data, mask) = argument
+
+			if offset + len(data) > len(frame):
+				return False
+
+			return all(not mask[index] or frame[offset + index] == data[index] for index in range(len(data)))
+
+		return bool(argument(frame))
+
+
+	def describe(self, rule):
+		(kind, argument) = rule
+
+		if kind == "group":
+			return "group " + ":".join("{:02x}".format(byte) for byte in argument)
+
+		if kind == "pattern":
+			return "pattern @{:d} {:s}".format(argument[0], argument[1].hex())
+
+		if kind == "predicate":
+			return "predicate " + getattr(argument, "__name__", repr(argument))
+
+		return kind
+
+
+	def __repr__(self):
+		parts = [
+			"hardware = " + ", ".join(self.describe(rule) for rule in self.hardware),
+			"software = " + ", ".join(self.describe(rule) for rule in self.software),
+			"erxfcon = {:02x}".format(self.erxfcon),
+		]
+
+		return "\n".join(parts)
@@ -0,0 +1,149 @@
+import ctypes
+import fcntl
+import struct
+import spidev
+
+# struct spi_ioc_transfer from linux/spi/spidev.h
+SPI_IOC_TRANSFER = struct.Struct("=QQIIHBBBBBB")
+SPI_IOC_MAGIC = ord("k")
+SPI_MAX_TRANSFERS = 511		# the message size has to fit the 14 bit ioctl size field
+SPI_BUFFER_SIZE = 4096		# default spidev bufsiz, the byte limit per message
+
+
+def spi_ioc_message(count):
+	# _IOW(SPI_IOC_MAGIC, 0, char[SPI_MSGSIZE(count)])
+	return (1 << 30) | ((count * SPI_IOC_TRANSFER.size) << 16) | (SPI_IOC_MAGIC << 8)
+
+
+def buffer_address(buf):
+	if len(buf) == 0:
+		return 0
+
+	return ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+
+
+# Thin wrapper around spidev. Anything with a matching xfer2() can be handed to
+# Enc28j60 instead, e.g. the Enc28j60Simulator.
+
+class SpiDevice(object):
+	def __init__(self, bus=0, device=0, max_speed_hz=2000000):
+		self.bus = bus
+		self.device = device
+		self.spi = spidev.SpiDev()
+		self.spi.open(bus, device)
+		self.spi.cshigh = False	# active low
+		self.spi.threewire = False
+		self.spi.lsbfirst = False
+		self.spi.loop = False
+		self.spi.bits_per_word = 8
+		self.spi.max_speed_hz = max_speed_hz
+
+
+	def xfer2(self, data):
+		return self.spi.xfer2(data)
+
+
+	# Send several chip-select framed messages with one SPI_IOC_MESSAGE ioctl
+	# per chunk instead of one xfer2 syscall each. CS is released between
+	# messages because the ENC28J60 ends every command on the rising edge.
+	def xfer_many(self, messages):
+		results = []
+		chunk = []
+		size = 0
+
+		for message in messages:
+			if len(chunk) == SPI_MAX_TRANSFERS or (len(chunk) > 0 and size + len(message) > SPI_BUFFER_SIZE):
+				results.extend(self._ioc_message(chunk))
+				chunk = []
+				size = 0
+
+			chunk.append(message)
+			size += len(message)
+
+		if len(chunk) > 0:
+			results.extend(self._ioc_message(chunk))
+
+		return results
+
+
+	# Send data and clock len(view) more bytes straight into view, which must be
+	# a writable buffer. Queued messages may ride along in front of it.
+	def xfer_into(self, data, view, messages=()):
+		view = memoryview(view)
+
+		if len(view) == 0:
+			self.xfer_many(list(messages) + [list(data)])
+			return
+
+		chunk_size = SPI_BUFFER_SIZE - len(data)
+		size = sum(len(message) for message in messages)
+
+		if len(messages) + 2 > SPI_MAX_TRANSFERS or size + len(data) + min(len(view), chunk_size) > SPI_BUFFER_SIZE:
+			self.xfer_many(messages)
+			messages = ()
+
+		for offset in range(0, len(view), chunk_size):
+			self._ioc_message(messages, data, view[offset:offset + chunk_size])
+			messages = ()
+
+
+	def _ioc_message(self, messages, data=None, view=None):
+		if view is None and len(messages) == 1:
+			return [self.spi.xfer2(messages[0])]
+
+		tx = bytearray()
+
+		for message in messages:
+			tx.extend(message)
+
+		if data is not None:
+			tx.extend(data)
+
+		rx = bytearray(len(tx))
+		tx_addr = buffer_address(tx)
+		rx_addr = buffer_address(rx)
+		transfers = []
+		offset = 0
+
+		# (tx, rx, length, cs_change) - a NULL tx buffer shifts out zeros and a
+		# NULL rx buffer discards what comes back
+		for message in messages:
+			transfers.append((tx_addr + offset, rx_addr + offset, len(message), 1))
+			offset += len(message)
+
+		if view is not None:
+			transfers.append((tx_addr + offset, 0, len(data), 0))
+			transfers.append((0, buffer_address(view), len(view), 0))
+		else:
+			transfers[-1] = transfers[-1][:3] + (0,)
+
+		packed = bytearray(SPI_IOC_TRANSFER.size * len(transfers))
+
+		for index, (tx_buf, rx_buf, length, cs_change) in enumerate(transfers):
+			SPI_IOC_TRANSFER.pack_into(
+				packed,
+				index * SPI_IOC_TRANSFER.size,
+				tx_buf,
+				rx_buf,
+				length,
+				self.spi.max_speed_hz,
+				0,
+				8,
+				cs_change,
+				0, 0, 0, 0
+			)
+
+		fcntl.ioctl(self.spi.fileno(), spi_ioc_message(len(transfers)), packed)
+
+		results = []
+		offset = 0
+
+		for message in messages:
+			results.append(list(rx[offset:offset + len(message)]))
+			offset += len(message)
+
+		return results
+
+
+	def close(self):
+		self.spi.close()
@@ -0,0 +1,685 @@
+import errno
+import random
+
+from ethernet.ip4_address import Ip4Address
+from ethernet.tcp_segment import FIN, SYN, RST, PSH, ACK, OPTION_MSS, parse_mss
+
+CLOSED = "CLOSED"
+SYN_SENT = "SYN-SENT"
+SYN_RECEIVED = "SYN-RECEIVED"
+ESTABLISHED = "ESTABLISHED"
+FIN_WAIT_1 = "FIN-WAIT-1"
+FIN_WAIT_2 = "FIN-WAIT-2"
+CLOSE_WAIT = "CLOSE-WAIT"
+CLOSING = "CLOSING"
+LAST_ACK = "LAST-ACK"
+TIME_WAIT = "TIME-WAIT"
+
+# states in which data may still be received / sent
+RECEIVING = (ESTABLISHED, FIN_WAIT_1, FIN_WAIT_2)
+SENDING = (ESTABLISHED, CLOSE_WAIT)
+
+DEFAULT_MSS = 536
+INITIAL_RTO = 1.0
+MIN_RTO = 0.2
+MAX_RTO = 60.0
+MAX_RETRIES = 8
+DELAYED_ACK = 0.04
+TIME_WAIT_TIME = 2.0
+
+
+# signed distance from sequence number b to a
+def seq_diff(a, b):
+	return ((a - b + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+# One TCP connection on a NetworkStack (RFC 793 with RFC 1122, 5681 and 6298),
+# used like a SOCK_STREAM socket. It is kept small for a host that talks to
+# the network through a few kilobytes of buffer memory:
+#
+#   * the receive window never exceeds what the receive ring of the chip can
+#     hold (NetworkStack.tcp_window), so a peer cannot overrun it with one
+#     window of full sized segments
+#   * segments that arrive out of order are dropped and answered with a
+#     duplicate ACK; the sender's fast retransmit fills the gap
+#   * unacknowledged data stays in send_buffer, which segments are cut from
+#     again on retransmission; that goes back N, since a receiver like this
+#     one has dropped whatever followed the lost segment
+#   * slow start, congestion avoidance and fast retransmit keep the sender
+#     from flooding the link. With windows of a few segments there are not
+#     enough duplicate ACKs for the usual three, so the early retransmit
+#     threshold of RFC 5827 applies
+#   * delayed ACKs acknowledge every second segment or after DELAYED_ACK
+#     seconds
+#
+# Nothing happens in the background: the stack processes segments and timers
+# in NetworkStack.poll(), which the blocking calls here run while they wait.
+
+class TcpConnection(object):
+	def __init__(self, stack, send_buffer_size=None, receive_buffer_size=None):
+		self.stack = stack
+		self.local_port = None
+		self.remote_address = None
+		self.remote_port = None
+		self.key = None
+		self.listener = None
+		self.state = CLOSED
+		self.error = None
+		self.timeout = None
+		self.mss = stack.tcp_mss
+		self.send_mss = DEFAULT_MSS
+
+		# send sequence space: send_buffer holds the bytes from snd_una on
+		self.send_buffer = bytearray()
+		self.send_buffer_size = 4 * stack.tcp_mss if send_buffer_size is None else send_buffer_size
+		self.iss = random.getrandbits(32)
+		self.snd_una = self.iss
+		self.snd_nxt = self.iss
+		self.snd_max = self.iss			# highest snd_nxt, it goes back on retransmission
+		self.snd_wnd = 0
+		self.snd_wl1 = 0
+		self.snd_wl2 = 0
+		self.fin_queued = False
+		self.fin_sent = False
+		self.fin_seq = None
+
+		# receive sequence space
+		self.receive_buffer = bytearray()
+		self.receive_buffer_size = 2 * stack.tcp_window if receive_buffer_size is None else receive_buffer_size
+		self.rcv_nxt = 0
+		self.rcv_adv = 0
+		self.fin_received = False
+
+		# congestion control
+		self.cwnd = 0
+		self.ssthresh = 0xFFFF
+		self.dup_acks = 0
+		self.recover = self.iss			# snd_nxt at the last fast retransmit
+
+		# timers, deadlines on the clock of the stack
+		self.rto = INITIAL_RTO
+		self.srtt = None
+		self.rttvar = None
+		self.rtt_seq = None
+		self.rtt_time = None
+		self.handshake_time = None
+		self.retries = 0
+		self.retransmit_deadline = None
+		self.ack_deadline = None
+		self.pending_acks = 0
+		self.time_wait_deadline = None
+
+		self.segments_sent = 0
+		self.segments_received = 0
+		self.retransmissions = 0
+		self.out_of_order = 0
+
+
+	# None blocks, 0 makes the calls non-blocking
+	def settimeout(self, timeout):
+		self.timeout = timeout
+
+
+	@property
+	def connected(self):
+		return self.state in (ESTABLISHED, CLOSE_WAIT, FIN_WAIT_1, FIN_WAIT_2)
+
+
+	# A non-blocking connect() raises BlockingIOError (EINPROGRESS); calling it
+	# again tells whether the handshake finished (EALREADY while it has not).
+	def connect(self, address):
+		if self.state == SYN_SENT:
+			self.wait(lambda: self.state != SYN_SENT, errno.EALREADY)
+		elif self.state != CLOSED:
+			raise OSError(errno.EISCONN, "connection is {:s}".format(self.state))
+		else:
+			(ip_address, port) = address
+			self.stack.open_tcp(self, Ip4Address(ip_address), port)
+			self.state = SYN_SENT
+			self.send_syn()
+			self.wait(lambda: self.state != SYN_SENT, errno.EINPROGRESS)
+
+		if self.state not in (ESTABLISHED, CLOSE_WAIT):
+			self.raise_error()
+
+
+	# Called by a TcpListener for a SYN on its port
+	def accept_syn(self, listener, ip_address, segment):
+		self.listener = listener
+		self.stack.open_tcp(self, ip_address, segment.source_port, listener.port)
+		self.state = SYN_RECEIVED
+		self.rcv_nxt = (segment.sequence_number + 1) & 0xFFFFFFFF
+		self.rcv_adv = self.rcv_nxt
+		self.send_mss = min(parse_mss(segment.options) or DEFAULT_MSS, self.mss)
+		self.snd_wnd = segment.window
+		self.snd_wl1 = segment.sequence_number
+		self.send_syn()
+
+
+	def send_syn(self):
+		flags = SYN if self.state == SYN_SENT else SYN | ACK
+		options = bytes([OPTION_MSS, 4]) + self.mss.to_bytes(2, "big")
+		self.snd_nxt = (self.iss + 1) & 0xFFFFFFFF
+		self.snd_max = self.snd_nxt
+		self.handshake_time = self.stack.clock()
+		self.send_segment(self.iss, flags, options=options)
+		self.arm_retransmit()
+
+
+	# Queue as much of data as fits into the send buffer, waiting for room as
+	# the timeout allows. Returns the number of bytes taken.
+	def send(self, data):
+		self.wait(lambda: self.state not in SENDING or len(self.send_buffer) < self.send_buffer_size, errno.EAGAIN)
+
+		if self.state not in SENDING or self.fin_queued:
+			if self.error is not None:
+				self.raise_error()
+
+			raise OSError(errno.EPIPE, "connection is {:s}".format(self.state))
+
+		count = min(len(data), self.send_buffer_size - len(self.send_buffer))
+		self.send_buffer += data[:count]
+		self.output()
+
+		return count
+
+
+	def sendall(self, data):
+		data = memoryview(data)
+
+		while len(data) > 0:
+			data = data[self.send(data):]
+
+
+	# Up to bufsize received bytes, b"" once the peer closed its side
+	def recv(self, bufsize):
+		count = self.wait_readable()
+		data = bytes(self.receive_buffer[:min(count, bufsize)])
+		self.consume(len(data))
+
+		return data
+
+
+	def recv_into(self, buf, nbytes=0):
+		count = min(self.wait_readable(), nbytes or len(buf))
+		buf[:count] = self.receive_buffer[:count]
+		self.consume(count)
+
+		return count
+
+
+	def wait_readable(self):
+		self.wait(lambda: len(self.receive_buffer) > 0 or self.fin_received or self.state == CLOSED, errno.EAGAIN)
+
+		if len(self.receive_buffer) == 0 and self.error is not None:
+			self.raise_error()
+
+		return len(self.receive_buffer)
+
+
+	# Drop count bytes from the receive buffer and tell the peer when the
+	# window grew by a segment or more (receiver side silly window avoidance)
+	def consume(self, count):
+		del self.receive_buffer[:count]
+
+		if self.state in RECEIVING and self.receive_window() - seq_diff(self.rcv_adv, self.rcv_nxt) >= self.mss:
+			self.send_ack()
+
+
+	# Wait until condition() holds, running the stack meanwhile
+	def wait(self, condition, blocking_errno):
+		stack = self.stack
+		deadline = None if self.timeout is None else stack.clock() + self.timeout
+
+		# one pass over what the chip holds, even when not blocking
+		if not condition():
+			stack.poll(0)
+
+		while not condition():
+			remaining = None if deadline is None else deadline - stack.clock()
+
+			if remaining is not None and remaining <= 0:
+				if self.timeout == 0:
+					raise BlockingIOError(blocking_errno, "operation would block")
+
+				raise TimeoutError("timed out")
+
+			stack.poll(remaining)
+
+
+	def raise_error(self):
+		code = errno.ENOTCONN if self.error is None else self.error
+
+		raise OSError(code, "connection {:s}: {:s}".format(self.state, errno.errorcode.get(code, "")))
+
+
+	# Send FIN once the send buffer is empty; the closing handshake goes on in
+	# poll(). Unfinished handshakes are dropped.
+	def close(self):
+		if self.state in (CLOSED, SYN_SENT, SYN_RECEIVED):
+			self.terminate(None)
+		elif not self.fin_queued:
+			self.fin_queued = True
+			self.output()
+
+
+	def abort(self):
+		if self.state not in (CLOSED, SYN_SENT, TIME_WAIT):
+			self.send_segment(self.snd_nxt, RST | ACK)
+
+		self.terminate(errno.ECONNABORTED)
+
+
+	def terminate(self, error):
+		if self.error is None:
+			self.error = error
+
+		self.state = CLOSED
+		self.retransmit_deadline = None
+		self.ack_deadline = None
+		self.time_wait_deadline = None
+		self.stack.close_tcp(self)
+
+
+	def receive_window(self):
+		return max(0, min(self.stack.tcp_window, self.receive_buffer_size - len(self.receive_buffer), 0xFFFF))
+
+
+	def send_segment(self, seq, flags, data=b"", options=b""):
+		window = self.receive_window()
+		# never move the right edge of the window back (RFC 793, 3.7)
+		window = max(window, seq_diff(self.rcv_adv, self.rcv_nxt))
+		self.rcv_adv = (self.rcv_nxt + window) & 0xFFFFFFFF
+
+		self.stack.send_tcp(self.local_port, self.remote_address, self.remote_port, seq, \
+			self.rcv_nxt if flags & ACK else 0, flags, window, data, options)
+		self.segments_sent += 1
+
+		if flags & ACK:
+			self.ack_deadline = None
+			self.pending_acks = 0
+
+
+	def send_ack(self):
+		self.send_segment(self.snd_nxt, ACK)
+
+
+	def arm_retransmit(self):
+		self.retransmit_deadline = self.stack.clock() + self.rto
+
+
+	# Send what the send buffer, the peer's window and the congestion window
+	# allow, and the FIN after the last byte when close() was called
+	def output(self):
+		if self.state not in (ESTABLISHED, CLOSE_WAIT, FIN_WAIT_1, LAST_ACK, CLOSING):
+			return
+
+		window = min(self.snd_wnd, self.cwnd)
+
+		while not self.fin_sent:
+			in_flight = seq_diff(self.snd_nxt, self.snd_una)
+			unsent = len(self.send_buffer) - in_flight
+
+			if unsent <= 0:
+				break
+
+			size = min(unsent, self.send_mss, window - in_flight)
+
+			if size <= 0:
+				# zero window: probe with one byte, repeated by the timer
+				if self.snd_wnd == 0 and in_flight == 0:
+					size = 1
+				else:
+					break
+			elif size < self.send_mss and size < unsent and in_flight > 0:
+				break			# wait for the window to open a full segment
+
+			data = self.send_buffer[in_flight:in_flight + size]
+			flags = ACK | PSH if size == unsent else ACK
+			new = seq_diff(self.snd_nxt, self.snd_max) >= 0
+			self.send_segment(self.snd_nxt, flags, data)
+			self.snd_nxt = (self.snd_nxt + size) & 0xFFFFFFFF
+
+			# Karn: only new data is timed
+			if new:
+				self.snd_max = self.snd_nxt
+
+				if self.rtt_seq is None:
+					self.rtt_seq = self.snd_nxt
+					self.rtt_time = self.stack.clock()
+
+			if self.retransmit_deadline is None:
+				self.arm_retransmit()
+
+			if self.snd_wnd == 0:
+				break
+
+		if self.fin_queued and not self.fin_sent and seq_diff(self.snd_nxt, self.snd_una) == len(self.send_buffer):
+			self.fin_seq = self.snd_nxt
+			self.send_segment(self.snd_nxt, FIN | ACK)
+			self.snd_nxt = (self.snd_nxt + 1) & 0xFFFFFFFF
+			self.snd_max = self.snd_nxt
+			self.fin_sent = True
+
+			if self.state == ESTABLISHED:
+				self.state = FIN_WAIT_1
+			elif self.state == CLOSE_WAIT:
+				self.state = LAST_ACK
+
+			if self.retransmit_deadline is None:
+				self.arm_retransmit()
+
+
+	# A segment for this connection arrived; segment is a TcpSegment(View)
+	# whose payload is only valid during the call
+	def segment_arrives(self, segment):
+		self.segments_received += 1
+		flags = segment.flags
+		seq = segment.sequence_number
+		ack = segment.acknowledgment_number
+
+		if self.state == SYN_SENT:
+			self.syn_sent_arrives(segment, flags, seq, ack)
+			return
+
+		data = segment.payload
+		length = len(data) + (1 if flags & SYN else 0) + (1 if flags & FIN else 0)
+
+		if not self.acceptable(seq, length):
+			if not flags & RST:
+				self.send_ack()
+
+			return
+
+		if flags & RST:
+			self.terminate(errno.ECONNREFUSED if self.state == SYN_RECEIVED else errno.ECONNRESET)
+			return
+
+		if flags & SYN:
+			self.send_ack()			# a SYN inside the window, see RFC 5961, 4.2
+			return
+
+		if not flags & ACK:
+			return
+
+		if self.state == SYN_RECEIVED:
+			if seq_diff(ack, self.snd_una) <= 0 or seq_diff(ack, self.snd_nxt) > 0:
+				self.stack.send_tcp(self.local_port, self.remote_address, self.remote_port, ack, 0, RST, 0)
+				return
+
+			self.established(segment)
+
+			if self.listener is not None:
+				self.listener.established(self)
+
+		if not self.process_ack(segment, seq, ack, len(data) == 0 and not flags & FIN):
+			return
+
+		if len(data) > 0 and self.state in RECEIVING:
+			self.receive_data(seq, data)
+
+		if flags & FIN and seq_diff((seq + len(data)) & 0xFFFFFFFF, self.rcv_nxt) == 0 and not self.fin_received:
+			self.receive_fin()
+
+		self.output()
+
+
+	def syn_sent_arrives(self, segment, flags, seq, ack):
+		if flags & ACK and ack != self.snd_nxt:
+			if not flags & RST:
+				self.stack.send_tcp(self.local_port, self.remote_address, self.remote_port, ack, 0, RST, 0)
+
+			return
+
+		if flags & RST:
+			if flags & ACK:
+				self.terminate(errno.ECONNREFUSED)
+
+			return
+
+		if not flags & SYN or not flags & ACK:
+			return				# simultaneous open is not supported
+
+		self.rcv_nxt = (seq + 1) & 0xFFFFFFFF
+		self.rcv_adv = self.rcv_nxt
+		self.send_mss = min(parse_mss(segment.options) or DEFAULT_MSS, self.mss)
+		self.snd_wl1 = seq
+		self.established(segment)
+		self.send_ack()
+		self.output()
+
+
+	def established(self, segment):
+		self.state = ESTABLISHED
+		self.snd_una = segment.acknowledgment_number
+		self.snd_wnd = segment.window
+		self.snd_wl2 = segment.acknowledgment_number
+		self.cwnd = min(4 * self.send_mss, max(2 * self.send_mss, 4380))		# RFC 5681, 3.1
+		self.retries = 0
+		self.retransmit_deadline = None
+
+		# the handshake gives the first RTT sample
+		if self.retransmissions == 0:
+			self.update_rtt(self.stack.clock() - self.handshake_time)
+
+
+	# RFC 793, 3.3: does the segment overlap the receive window?
+	def acceptable(self, seq, length):
+		window = max(self.receive_window(), seq_diff(self.rcv_adv, self.rcv_nxt))
+		start = seq_diff(seq, self.rcv_nxt)
+
+		if length == 0:
+			return 0 <= start < max(window, 1)
+
+		if window == 0:
+			return False
+
+		return start < window and start + length > 0
+
+
+	# Returns False when the segment is to be dropped
+	def process_ack(self, segment, seq, ack, pure_ack):
+		acked = seq_diff(ack, self.snd_una)
+
+		if acked > seq_diff(self.snd_max, self.snd_una):
+			self.send_ack()			# acknowledges something not sent yet
+			return False
+
+		window = segment.window
+
+		if acked > 0:
+			data_acked = min(acked, len(self.send_buffer))
+			del self.send_buffer[:data_acked]
+			self.snd_una = ack
+
+			if seq_diff(ack, self.snd_nxt) > 0:
+				self.snd_nxt = ack			# sent before going back
+
+			if self.rtt_seq is not None and seq_diff(ack, self.rtt_seq) >= 0:
+				self.update_rtt(self.stack.clock() - self.rtt_time)
+				self.rtt_seq = None
+
+			if self.cwnd < self.ssthresh:
+				self.cwnd += min(acked, self.send_mss)
+			else:
+				self.cwnd += max(1, self.send_mss * self.send_mss // self.cwnd)
+
+			self.dup_acks = 0
+			self.retries = 0
+
+			if self.snd_una == self.snd_max:
+				self.retransmit_deadline = None
+			else:
+				self.arm_retransmit()
+
+			if self.fin_seq is not None and seq_diff(ack, self.fin_seq) > 0:
+				self.fin_sent = True
+				self.fin_acked()
+		elif acked == 0 and pure_ack and window == self.snd_wnd and self.snd_una != self.snd_max \
+				and seq_diff(self.snd_una, self.recover) >= 0:
+			self.dup_acks += 1
+
+			if self.dup_acks == self.duplicate_threshold():
+				self.fast_retransmit()
+
+		# RFC 793, 3.9: take the window from the most recent segment
+		if seq_diff(seq, self.snd_wl1) > 0 or (seq == self.snd_wl1 and seq_diff(ack, self.snd_wl2) >= 0):
+			self.snd_wnd = window
+			self.snd_wl1 = seq
+			self.snd_wl2 = ack
+
+		return self.state != CLOSED
+
+
+	def fin_acked(self):
+		if self.state == FIN_WAIT_1:
+			self.state = FIN_WAIT_2
+		elif self.state == CLOSING:
+			self.enter_time_wait()
+		elif self.state == LAST_ACK:
+			self.terminate(None)
+
+
+	def receive_data(self, seq, data):
+		skip = seq_diff(self.rcv_nxt, seq)
+
+		if skip < 0:
+			self.out_of_order += 1
+			self.send_ack()			# duplicate ACK for the sender's fast retransmit
+			return
+
+		data = data[skip:skip + max(0, self.receive_buffer_size - len(self.receive_buffer))]
+
+		if len(data) == 0:
+			self.send_ack()
+			return
+
+		self.receive_buffer += data
+		self.rcv_nxt = (self.rcv_nxt + len(data)) & 0xFFFFFFFF
+		self.pending_acks += 1
+
+		# RFC 1122, 4.2.3.2: ACK at least every second full sized segment
+		if self.pending_acks >= 2 or skip > 0:
+			self.send_ack()
+		elif self.ack_deadline is None:
+			self.ack_deadline = self.stack.clock() + DELAYED_ACK
+
+
+	def receive_fin(self):
+		self.fin_received = True
+		self.rcv_nxt = (self.rcv_nxt + 1) & 0xFFFFFFFF
+		self.send_ack()
+
+		if self.state == ESTABLISHED:
+			self.state = CLOSE_WAIT
+		elif self.state == FIN_WAIT_1:
+			self.state = CLOSING
+		elif self.state == FIN_WAIT_2:
+			self.enter_time_wait()
+
+
+	def enter_time_wait(self):
+		self.state = TIME_WAIT
+		self.retransmit_deadline = None
+		self.time_wait_deadline = self.stack.clock() + TIME_WAIT_TIME
+
+
+	# RFC 6298, 2
+	def update_rtt(self, rtt):
+		if self.srtt is None:
+			self.srtt = rtt
+			self.rttvar = rtt / 2
+		else:
+			self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+			self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+		self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+
+	# RFC 5827: with fewer than four segments in flight one duplicate ACK less
+	# than segments in flight is enough
+	def duplicate_threshold(self):
+		segments = -(-seq_diff(self.snd_max, self.snd_una) // self.send_mss)
+
+		return segments - 1 if 2 <= segments < 4 else 3
+
+
+	def fast_retransmit(self):
+		self.ssthresh = max(seq_diff(self.snd_max, self.snd_una) // 2, 2 * self.send_mss)
+		self.cwnd = self.ssthresh
+		self.recover = self.snd_max
+		self.go_back()
+
+
+	# Send everything from snd_una on again
+	def go_back(self):
+		self.retransmissions += 1
+		self.rtt_seq = None				# Karn: no samples from retransmitted data
+		self.dup_acks = 0
+		self.snd_nxt = self.snd_una
+		self.fin_sent = False
+		self.output()
+		self.arm_retransmit()
+
+
+	# Next time poll_timers() has something to do, None when idle
+	@property
+	def deadline(self):
+		deadlines = [d for d in (self.retransmit_deadline, self.ack_deadline, self.time_wait_deadline) if d is not None]
+
+		return min(deadlines) if len(deadlines) > 0 else None
+
+
+	def poll_timers(self, now):
+		if self.ack_deadline is not None and now >= self.ack_deadline:
+			self.send_ack()
+
+		if self.time_wait_deadline is not None and now >= self.time_wait_deadline:
+			self.terminate(None)
+			return
+
+		if self.retransmit_deadline is not None and now >= self.retransmit_deadline:
+			self.retransmit_timeout()
+
+
+	def retransmit_timeout(self):
+		# probing a zero window goes on for as long as the peer answers
+		if self.snd_wnd != 0 or self.state in (SYN_SENT, SYN_RECEIVED):
+			self.retries += 1
+
+		if self.retries > MAX_RETRIES:
+			self.abort()
+			self.error = errno.ETIMEDOUT
+			return
+
+		self.rto = min(self.rto * 2, MAX_RTO)
+
+		if self.state in (SYN_SENT, SYN_RECEIVED):
+			self.retransmissions += 1
+			self.send_syn()
+			return
+
+		# RFC 5681, 3.1: back to one segment
+		self.ssthresh = max(seq_diff(self.snd_max, self.snd_una) // 2, 2 * self.send_mss)
+		self.cwnd = self.send_mss
+		self.go_back()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
+
+
+	def __repr__(self):
+		parts = [
+			"TCP {}:{} -> {}:{} {:s}".format(self.stack.ip_address, self.local_port, self.remote_address, self.remote_port, self.state),
+			"snd una = {:d}, nxt = {:d}, wnd = {:d}, cwnd = {:d}, buffered = {:d}".format(
+				seq_diff(self.snd_una, self.iss), seq_diff(self.snd_nxt, self.iss), self.snd_wnd, self.cwnd, len(self.send_buffer)),
+			"rcv nxt = {:d}, buffered = {:d}, window = {:d}".format(self.rcv_nxt, len(self.receive_buffer), self.receive_window()),
+			"rto = {:.3f}, retransmissions = {:d}, out of order = {:d}".format(self.rto, self.retransmissions, self.out_of_order),
+		]
+
+		return "\n".join(parts)
@@ -0,0 +1,93 @@
+import errno
+from collections import deque
+
+from ethernet.tcp_connection import TcpConnection, SYN_RECEIVED
+
+
+# Passive open on a port of a NetworkStack, like a listening SOCK_STREAM
+# socket. A SYN starts a TcpConnection as long as fewer than backlog
+# connections are in the handshake or waiting for accept(); further SYNs are
+# ignored and retried by the peer.
+
+class TcpListener(object):
+	def __init__(self, stack, port, backlog=4):
+		self.stack = stack
+		self.port = port
+		self.backlog = backlog
+		self.pending = []
+		self.queue = deque()
+		self.timeout = None
+		self.refused = 0
+
+
+	# None blocks, 0 makes accept() non-blocking
+	def settimeout(self, timeout):
+		self.timeout = timeout
+
+
+	# Next established connection as (TcpConnection, (Ip4Address, port))
+	def accept(self):
+		stack = self.stack
+		deadline = None if self.timeout is None else stack.clock() + self.timeout
+
+		# one pass over what the chip holds, even when not blocking
+		if len(self.queue) == 0 and self.port is not None:
+			stack.poll(0)
+
+		while len(self.queue) == 0:
+			if self.port is None:
+				raise OSError(errno.EBADF, "listener is closed")
+
+			remaining = None if deadline is None else deadline - stack.clock()
+
+			if remaining is not None and remaining <= 0:
+				if self.timeout == 0:
+					raise BlockingIOError(errno.EAGAIN, "no connection pending")
+
+				raise TimeoutError("timed out")
+
+			stack.poll(remaining)
+
+		connection = self.queue.popleft()
+
+		return (connection, (connection.remote_address, connection.remote_port))
+
+
+	# called by the stack for a SYN to our port without a connection
+	def syn_arrives(self, ip_address, segment):
+		self.pending = [connection for connection in self.pending if connection.state == SYN_RECEIVED]
+
+		if len(self.pending) + len(self.queue) >= self.backlog:
+			self.refused += 1
+			return
+
+		connection = TcpConnection(self.stack)
+		connection.accept_syn(self, ip_address, segment)
+		self.pending.append(connection)
+
+
+	def established(self, connection):
+		if connection in self.pending:
+			self.pending.remove(connection)
+
+		self.queue.append(connection)
+
+
+	def close(self):
+		if self.port is not None:
+			self.stack.unlisten(self.port)
+			self.port = None
+
+		for connection in self.pending + list(self.queue):
+			connection.abort()
+
+		self.pending = []
+		self.queue.clear()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,144 @@
+# https://en.wikipedia.org/wiki/Transmission_Control_Protocol#TCP_segment_structure
+
+import struct
+
+from ethernet.checksum import transport_checksum, pseudo_header_sum, verify_checksum
+
+# source port, destination port, sequence number, acknowledgment number, data
+# offset, flags, window, checksum, urgent pointer
+HEADER = struct.Struct("!HHIIBBHHH")
+
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+PSH = 0x08
+ACK = 0x10
+URG = 0x20
+
+FLAG_NAMES = ((URG, "URG"), (ACK, "ACK"), (PSH, "PSH"), (RST, "RST"), (SYN, "SYN"), (FIN, "FIN"))
+
+OPTION_END = 0
+OPTION_NOP = 1
+OPTION_MSS = 2
+
+
+# MSS from the options of a SYN, None when there is none
+def parse_mss(options):
+	index = 0
+
+	while index < len(options):
+		kind = options[index]
+
+		if kind == OPTION_END:
+			break
+
+		if kind == OPTION_NOP:
+			index += 1
+			continue
+
+		if index + 1 >= len(options) or options[index + 1] < 2:
+			break
+
+		if kind == OPTION_MSS and options[index + 1] == 4 and index + 4 <= len(options):
+			return options[index + 2] * 256 + options[index + 3]
+
+		index += options[index + 1]
+
+	return None
+
+
+class TcpSegment(object):
+	__slots__ = (
+		"source_port", "destination_port", "sequence_number", "acknowledgment_number", "data_offset",
+		"flags", "window", "checksum", "urgent_pointer", "options", "payload"
+	)
+
+	@classmethod
+	def from_buffer(cls, buf, offset=0, length=None):
+		end = len(buf) if length is None else offset + length
+		(source_port, destination_port, sequence_number, acknowledgment_number, data_offset, flags, \
+			window, checksum, urgent_pointer) = HEADER.unpack_from(buf, offset)
+		start = offset + (data_offset >> 4 << 2)
+
+		return cls(
+			source_port=source_port,
+			destination_port=destination_port,
+			sequence_number=sequence_number,
+			acknowledgment_number=acknowledgment_number,
+			data_offset=data_offset >> 4,
+			flags=flags,
+			window=window,
+			checksum=checksum,
+			urgent_pointer=urgent_pointer,
+			options=buf[offset + HEADER.size:start],
+			payload=buf[start:end]
+		)
+
+
+	def __init__(self, source_port=0, destination_port=0, sequence_number=0, acknowledgment_number=0, \
+			data_offset=5, flags=0, window=0, checksum=0, urgent_pointer=0, options=b"", payload=None):
+		self.source_port = source_port
+		self.destination_port = destination_port
+		self.sequence_number = sequence_number
+		self.acknowledgment_number = acknowledgment_number
+		self.data_offset = data_offset
+		self.flags = flags
+		self.window = window
+		self.checksum = checksum
+		self.urgent_pointer = urgent_pointer
+		self.options = options
+		self.payload = payload
+
+
+	def pack_header(self, checksum):
+		return HEADER.pack(
+			self.source_port,
+			self.destination_port,
+			self.sequence_number,
+			self.acknowledgment_number,
+			self.data_offset << 4,
+			self.flags,
+			self.window,
+			checksum,
+			self.urgent_pointer
+		) + bytes(self.options)
+
+
+	def __bytes__(self):
+		return self.pack_header(self.checksum) + bytes(self.payload or b"")
+
+
+	# Serialized with the checksum over the pseudo header, header and payload
+	def checksummed(self, source_address, destination_address):
+		data = bytearray(self.pack_header(0))
+		data.extend(self.payload or b"")
+		checksum = transport_checksum(source_address, destination_address, 6, data)
+		data[16:18] = checksum.to_bytes(2, "big")
+
+		return bytes(data)
+
+
+	def verify_checksum(self, source_address, destination_address):
+		data = bytes(self)
+
+		return verify_checksum(data, pseudo_header_sum(source_address, destination_address, 6, len(data)))
+
+
+	def describe_flags(self):
+		return "|".join(name for (flag, name) in FLAG_NAMES if self.flags & flag) or "-"
+
+
+	def __repr__(self):
+		parts = [
+			"TCP",
+			"src port = {}".format(self.source_port),
+			"dst port = {}".format(self.destination_port),
+			"seq      = {}".format(self.sequence_number),
+			"ack      = {}".format(self.acknowledgment_number),
+			"flags    = {}".format(self.describe_flags()),
+			"window   = {}".format(self.window),
+			"checksum = {}".format(self.checksum),
+			"payload  = {}".format(self.payload)
+		]
+
+		return "\n  ".join(parts)
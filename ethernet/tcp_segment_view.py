@@ -0,0 +1,83 @@
+from ethernet.tcp_segment import TcpSegment, HEADER
+from ethernet.checksum import pseudo_header_sum, verify_checksum
+
+
+# Lazy TcpSegment, see EthernetFrameView.
+
+class TcpSegmentView(TcpSegment):
+	__slots__ = ("buf", "offset", "end")
+
+	@classmethod
+	def from_buffer(cls, buf, offset=0, length=None):
+		return cls(buf, offset, length)
+
+
+	def __init__(self, buf, offset=0, length=None):
+		self.buf = buf
+		self.offset = offset
+		self.end = len(buf) if length is None else offset + length
+
+
+	@property
+	def source_port(self):
+		return self.buf[self.offset] * 256 + self.buf[self.offset + 1]
+
+
+	@property
+	def destination_port(self):
+		return self.buf[self.offset + 2] * 256 + self.buf[self.offset + 3]
+
+
+	@property
+	def sequence_number(self):
+		return int.from_bytes(self.buf[self.offset + 4:self.offset + 8], "big")
+
+
+	@property
+	def acknowledgment_number(self):
+		return int.from_bytes(self.buf[self.offset + 8:self.offset + 12], "big")
+
+
+	@property
+	def data_offset(self):
+		return self.buf[self.offset + 12] >> 4
+
+
+	@property
+	def flags(self):
+		return self.buf[self.offset + 13]
+
+
+	@property
+	def window(self):
+		return self.buf[self.offset + 14] * 256 + self.buf[self.offset + 15]
+
+
+	@property
+	def checksum(self):
+		return self.buf[self.offset + 16] * 256 + self.buf[self.offset + 17]
+
+
+	@property
+	def urgent_pointer(self):
+		return self.buf[self.offset + 18] * 256 + self.buf[self.offset + 19]
+
+
+	@property
+	def options(self):
+		return self.buf[self.offset + HEADER.size:self.offset + (self.data_offset << 2)]
+
+
+	@property
+	def payload(self):
+		return self.buf[self.offset + (self.data_offset << 2):self.end]
+
+
+	def verify_checksum(self, source_address, destination_address):
+		data = self.buf[self.offset:self.end]
+
+		return verify_checksum(data, pseudo_header_sum(source_address, destination_address, 6, len(data)))
+
+
+	def __bytes__(self):
+		return bytes(self.buf[self.offset:self.end])
@@ -0,0 +1,131 @@
+import unittest
+
+from ethernet.buffer_layout import BufferLayout
+from ethernet.enc28j60 import Enc28j60
+from ethernet.enc28j60_simulator import Enc28j60Simulator
+from ethernet.mac_address import MacAddress
+from ethernet.receive_filter import ReceiveFilter
+
+MY_MAC = MacAddress("02:03:04:05:06:07")
+
+
+def driver(interrupt=False, layout=None, spi_clock_hz=20000000):
+	simulator = Enc28j60Simulator(spi_clock_hz=spi_clock_hz)
+	enc = Enc28j60(MY_MAC, spi=simulator, interrupt=simulator.interrupt_line() if interrupt else None, layout=layout)
+	enc.initialize()
+	enc.set_receive_filter(ReceiveFilter())
+
+	return (simulator, enc)
+
+
+def frame(index, size=60):
+	return bytes(MY_MAC) + bytes(6) + b"\x88\xb5" + bytes([index & 0xFF]) * (size - 14)
+
+
+class Enc28j60Test(unittest.TestCase):
+	def test_link_flap_with_interrupt(self):
+		(simulator, enc) = driver(interrupt=True)
+		changes = []
+		enc.on_link_change = changes.append
+
+		self.assertTrue(enc.is_link_up)
+
+		# without any wait_for_packet() in between
+		simulator.set_link(False)
+		self.assertFalse(enc.is_link_up)
+		self.assertFalse(enc.is_link_up)
+		simulator.set_link(True)
+		self.assertTrue(enc.is_link_up)
+
+		self.assertEqual(changes, [False, True])
+
+
+	def test_link_flap_polled(self):
+		(simulator, enc) = driver()
+
+		self.assertTrue(enc.is_link_up)
+		simulator.set_link(False)
+		self.assertFalse(enc.is_link_up)
+		simulator.set_link(True)
+		self.assertTrue(enc.is_link_up)
+
+
+	# Frames that wrap around the end of the receive ring come out intact,
+	# one at a time and in bursts
+	def test_receive_across_ring_wrap(self):
+		(simulator, enc) = driver(layout=BufferLayout(rx_size=0x800))
+		buf = bytearray(1518)
+		sent = [frame(index, 60 + index * 37 % 540) for index in range(60)]		# three fit into the ring
+
+		for (index, data) in enumerate(sent):
+			simulator.inject(data)
+
+			if index % 3 == 2:
+				received = [bytes(data) for data in enc.receive_burst()]
+				self.assertEqual(received, sent[index - 2:index + 1])
+
+		for index in range(60):
+			simulator.inject(sent[index])
+			length = enc.receive_packet_into(buf)
+			self.assertEqual(bytes(buf[:length]), sent[index])
+
+
+	# With two transmit slots the second frame is queued behind the first and
+	# has to leave while frames keep arriving, not only once the link is quiet
+	def test_queued_frame_leaves_under_receive_load(self):
+		(simulator, enc) = driver(layout=BufferLayout(tx_slots=2))
+		buf = bytearray(1518)
+
+		for index in range(2000):
+			simulator.deliver(frame(index, 214))
+
+		enc.send_packet(frame(1, 1400))
+		enc.send_packet(frame(2, 1400))
+		start = simulator.now
+
+		while simulator.now - start < 0.2:
+			if enc.wait_for_packet(0):
+				enc.receive_packet_into(buf)
+
+		self.assertEqual(simulator.transmitted_frames, 2)
+		self.assertEqual(len(enc.tx_pending), 0)
+
+
+	def test_send_blocks_only_while_every_slot_is_taken(self):
+		(simulator, enc) = driver(layout=BufferLayout(tx_slots=3))
+
+		for index in range(10):
+			enc.send_packet(frame(index, 600))
+
+		enc.flush_transmit()
+
+		self.assertEqual([data[14] for data in simulator.transmitted], list(range(10)))
+		self.assertEqual(len(enc.tx_free), 3)
+
+
+	# An exception in the middle of a receive drops the queued writes; the
+	# shadow registers must not claim they happened, and the frame is read
+	# again afterwards
+	def test_failed_transaction_resyncs_shadow(self):
+		(simulator, enc) = driver()
+		sent = [frame(index) for index in range(3)]
+
+		for data in sent:
+			simulator.inject(data)
+
+		def fail(data):
+			enc.capture = None
+			raise RuntimeError("capture failed")
+
+		enc.capture = type("Capture", (object,), {"write": staticmethod(fail)})
+
+		with self.assertRaises(RuntimeError):
+			enc.receive_packet()
+
+		self.assertEqual(enc.registers, {})
+		self.assertEqual(enc.current_bank, -1)
+		self.assertEqual([bytes(enc.receive_packet()) for _ in range(3)], sent)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,103 @@
+import random
+import unittest
+
+from ethernet.ip_frame_view import IpFrameView
+from ethernet.ip_reassembler import IpReassembler
+from ethernet.test_network_stack import ip_frame
+
+MORE_FRAGMENTS = 0x2000
+
+
+# Fragments of a UDP datagram with the given payload, size bytes of data each.
+# Returns the datagram and the fragments.
+def fragments(payload, size, id=1234):
+	datagram = bytes([0, 7, 0, 7]) + (8 + len(payload)).to_bytes(2, "big") + bytes(2) + payload
+	pieces = []
+
+	for first in range(0, len(datagram), size):
+		more = MORE_FRAGMENTS if first + size < len(datagram) else 0
+		frame = ip_frame(17, datagram[first:first + size], id=id, flags_offset=more | first >> 3)
+		pieces.append(IpFrameView(frame, 14))
+
+	return (datagram, pieces)
+
+
+class IpReassemblerTest(unittest.TestCase):
+	def setUp(self):
+		self.now = 0.0
+		self.reassembler = IpReassembler(max_datagrams=2, buffer_size=4096, clock=lambda: self.now)
+
+
+	def add_all(self, pieces):
+		results = [self.reassembler.add(piece) for piece in pieces]
+
+		self.assertTrue(all(result is None for result in results[:-1]))
+
+		return results[-1]
+
+
+	def test_unfragmented_frame_is_passed_through(self):
+		frame = IpFrameView(ip_frame(17, bytes(16)), 14)
+
+		self.assertIs(self.reassembler.add(frame), frame)
+
+
+	def test_fragments_in_any_order(self):
+		(datagram, pieces) = fragments(random.Random(1).randbytes(1000), 200)
+		random.Random(2).shuffle(pieces)
+
+		result = self.add_all(pieces)
+
+		self.assertEqual(result.total_length, 20 + len(datagram))
+		self.assertEqual(result.payload.destination_port, 7)
+		self.assertEqual(bytes(result.payload.payload), datagram[8:])
+		self.assertEqual(len(self.reassembler), 0)
+		self.assertEqual(self.reassembler.reassembled, 1)
+
+
+	# Duplicated and overlapping pieces only fill holes
+	def test_duplicates_and_overlaps(self):
+		(datagram, pieces) = fragments(random.Random(3).randbytes(1000), 200)
+		(_, halves) = fragments(random.Random(3).randbytes(1000), 96)
+
+		result = self.add_all(pieces[:2] + halves[:6] + pieces[1:])
+
+		self.assertEqual(bytes(result.payload.payload), datagram[8:])
+
+
+	def test_incomplete_datagram_times_out(self):
+		(_, pieces) = fragments(bytes(1000), 200)
+
+		for piece in pieces[:-1]:
+			self.reassembler.add(piece)
+
+		self.now += self.reassembler.timeout
+		self.assertIsNone(self.reassembler.add(pieces[-1]))
+
+		self.assertEqual(self.reassembler.timeouts, 1)
+		self.assertEqual(len(self.reassembler), 1)			# the last piece started a new flow
+
+
+	def test_oldest_flow_is_evicted(self):
+		flows = [fragments(bytes(400), 200, id)[1] for id in (1, 2, 3)]
+
+		for pieces in flows:
+			self.now += 1.0
+			self.reassembler.add(pieces[0])
+
+		self.assertEqual(self.reassembler.evictions, 1)
+		self.assertIsNone(self.reassembler.add(flows[0][1]))
+		self.assertIsNotNone(self.add_all(flows[2][1:]))
+
+
+	# All but the last fragment carry a multiple of 8 bytes
+	def test_misaligned_fragment_is_dropped(self):
+		(_, pieces) = fragments(bytes(1000), 100)
+
+		self.assertIsNone(self.reassembler.add(pieces[0]))
+		self.assertEqual(self.reassembler.dropped_fragments, 1)
+		self.assertEqual(len(self.reassembler), 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
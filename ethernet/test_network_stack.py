@@ -0,0 +1,218 @@
+import errno
+import unittest
+from collections import deque
+
+from ethernet.buffer_layout import BufferLayout
+from ethernet.checksum import internet_checksum, pseudo_header_sum
+from ethernet.ip4_address import Ip4Address
+from ethernet.enc28j60 import Enc28j60
+from ethernet.enc28j60_simulator import Enc28j60Simulator
+from ethernet.mac_address import MacAddress
+from ethernet.network_stack import NetworkStack
+from ethernet.tcp_segment import SYN, RST, ACK
+
+MY_MAC = MacAddress("02:03:04:05:06:07")
+PEER_MAC = MacAddress("02:00:00:00:00:01")
+MY_IP = "10.0.1.254"
+PEER_IP = "10.0.1.1"
+
+
+# The wire side of a simulated chip as a driver for a second NetworkStack:
+# what it sends arrives at the chip over the wire, what the chip transmits is
+# queued for it. drop, when given, is asked for every frame in either
+# direction whether it gets lost.
+
+class LinkPartner(object):
+	def __init__(self, simulator, drop=None):
+		self.mac_address = PEER_MAC
+		self.simulator = simulator
+		self.clock = simulator.monotonic
+		self.layout = BufferLayout(rx_size=0x1800)
+		self.queue = deque()
+		self.drop = drop
+		simulator.on_transmit = self.transmitted
+
+
+	def transmitted(self, frame):
+		if self.drop is None or not self.drop(frame):
+			self.queue.append(frame)
+
+
+	def send_packet(self, frame, offload_checksums=False):
+		if self.drop is None or not self.drop(frame):
+			self.simulator.deliver(frame)
+
+
+	def wait_for_packet(self, timeout=None):
+		return len(self.queue) > 0
+
+
+	def receive_packet_into(self, buf):
+		frame = self.queue.popleft()
+		buf[:len(frame)] = frame
+
+		return len(frame)
+
+
+# A NetworkStack on a simulated chip and one on its link partner
+def stacks(drop=None, spi_clock_hz=20000000, layout=None):
+	simulator = Enc28j60Simulator(spi_clock_hz=spi_clock_hz)
+	layout = BufferLayout(rx_size=0x1200, tx_slots=2) if layout is None else layout
+	driver = Enc28j60(MY_MAC, spi=simulator, layout=layout)
+	driver.initialize()
+
+	return (simulator, NetworkStack(driver, MY_IP), NetworkStack(LinkPartner(simulator, drop), PEER_IP))
+
+
+def try_call(function, *args):
+	try:
+		return function(*args)
+	except BlockingIOError:
+		return None
+
+
+# Ethernet frame to us holding an IPv4 header with the given fields in front
+# of payload. The header checksum is computed unless checksum is given.
+def ip_frame(protocol, payload, ihl=5, version=4, total_length=None, checksum=None, id=1234, flags_offset=0, \
+		frame_length=None):
+	header = bytearray(ihl << 2 if ihl >= 5 else 20)
+	header[0] = version << 4 | ihl
+	total_length = len(header) + len(payload) if total_length is None else total_length
+	header[2:4] = total_length.to_bytes(2, "big")
+	header[4:6] = id.to_bytes(2, "big")
+	header[6:8] = flags_offset.to_bytes(2, "big")
+	header[8] = 64
+	header[9] = protocol
+	header[12:16] = bytes([10, 0, 1, 1])
+	header[16:20] = bytes([10, 0, 1, 254])
+	header[10:12] = (internet_checksum(header) if checksum is None else checksum).to_bytes(2, "big")
+	frame = bytearray(bytes(MY_MAC) + bytes(PEER_MAC) + b"\x08\x00" + header + bytes(payload))
+
+	if frame_length is not None:
+		frame = frame[:frame_length] + bytes(max(0, frame_length - len(frame)))
+
+	return frame
+
+
+# Frame to us with a 20 byte TCP header from PEER_IP, checksummed
+def tcp_frame(flags, port, seq, data_offset=5):
+	segment = bytearray(20)
+	segment[0:2] = (40000).to_bytes(2, "big")
+	segment[2:4] = port.to_bytes(2, "big")
+	segment[4:8] = seq.to_bytes(4, "big")
+	segment[12] = data_offset << 4
+	segment[13] = flags
+	segment[14:16] = (1024).to_bytes(2, "big")
+	total = pseudo_header_sum(Ip4Address(PEER_IP), Ip4Address(MY_IP), 6, len(segment))
+	segment[16:18] = internet_checksum(segment, total).to_bytes(2, "big")
+
+	return ip_frame(6, segment)
+
+
+class NetworkStackTest(unittest.TestCase):
+	def setUp(self):
+		(self.simulator, self.stack, self.partner) = stacks()
+
+
+	def test_udp_datagram_reaches_bound_socket(self):
+		receiver = self.stack.socket()
+		receiver.bind(5000)
+		receiver.settimeout(0.1)
+		self.partner.arp_cache.update(MY_IP, MY_MAC)
+		sender = self.partner.socket()
+		sender.sendto(b"hello", (MY_IP, 5000))
+
+		(data, (ip_address, port)) = receiver.recvfrom(64)
+
+		self.assertEqual(data, b"hello")
+		self.assertEqual(str(ip_address), PEER_IP)
+		self.assertEqual(port, sender.port)
+
+
+	# Headers the stack must not trust: each is dropped and counted, none
+	# reaches a socket or raises
+	def test_malformed_ip_headers_are_dropped(self):
+		receiver = self.stack.socket()
+		receiver.bind(7)
+		udp = bytes([0, 7, 0, 7, 0, 12, 0, 0]) + b"ping"
+		tcp = bytes([0, 7, 0, 80]) + bytes(16)
+		frames = []
+
+		for (protocol, payload) in ((17, udp), (6, tcp)):
+			frames += [
+				ip_frame(protocol, bytes(payload), ihl=15, frame_length=60),	# header runs past the frame
+				ip_frame(protocol, payload, ihl=4),
+				ip_frame(protocol, payload, version=6),
+				ip_frame(protocol, payload, checksum=0x1234),
+				ip_frame(protocol, payload, total_length=24),					# no room for the transport header
+				ip_frame(protocol, payload[:4]),								# truncated transport header
+			]
+
+		for frame in frames:
+			self.stack.process(memoryview(frame))
+
+		self.assertEqual(self.stack.unhandled, len(frames))
+		self.assertEqual(len(receiver.queue), 0)
+		self.assertEqual(self.stack.checksum_errors, 0)
+
+
+	def test_fragment_without_transport_header_is_dropped(self):
+		frame = ip_frame(6, bytes(8), flags_offset=0x2000)		# more fragments, 8 of 20 header bytes
+
+		self.stack.process(memoryview(frame))
+
+		self.assertEqual(self.stack.unhandled, 1)
+		self.assertEqual(len(self.stack.reassembler), 0)
+
+
+	# RFC 793, 3.4: a SYN to a port nobody listens on is answered with RST|ACK
+	def test_syn_to_closed_port_is_reset(self):
+		self.stack.arp_cache.update(PEER_IP, PEER_MAC)
+
+		self.stack.process(memoryview(tcp_frame(SYN, 80, 1000)))
+		self.simulator.advance(0.01)
+
+		self.assertEqual(self.stack.no_port, 1)
+		self.assertEqual(len(self.partner.driver.queue), 1)
+		reply = self.partner.driver.queue[0]
+		self.assertEqual(reply[47], RST | ACK)
+		self.assertEqual(int.from_bytes(reply[42:46], "big"), 1001)
+
+
+	# A data offset beyond the end of the segment leaves no options and no
+	# payload, the SYN is answered as usual
+	def test_tcp_data_offset_past_segment_end(self):
+		self.stack.arp_cache.update(PEER_IP, PEER_MAC)
+		self.stack.listen(80)
+
+		self.stack.process(memoryview(tcp_frame(SYN, 80, 1000, data_offset=15)))
+		self.simulator.advance(0.01)
+
+		self.assertEqual(len(self.stack.tcp_connections), 1)
+		self.assertEqual(self.partner.driver.queue[0][47], SYN | ACK)
+
+
+	def test_connect_to_closed_port_is_refused(self):
+		client = self.stack.tcp_socket()
+		client.settimeout(0)
+
+		with self.assertRaises(BlockingIOError):
+			client.connect((PEER_IP, 81))
+
+		for _ in range(1000):
+			try:
+				client.connect((PEER_IP, 81))
+			except BlockingIOError:
+				self.partner.poll(0)
+				continue
+			except OSError as error:
+				self.assertEqual(error.errno, errno.ECONNREFUSED)
+				break
+		else:
+			self.fail("connect() did not fail")
+
+		self.assertEqual(self.partner.no_port, 1)
+
+
+if __name__ == "__main__":
+	unittest.main()
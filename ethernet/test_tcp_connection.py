@@ -0,0 +1,121 @@
+import errno
+import random
+import unittest
+
+from ethernet.tcp_connection import ESTABLISHED, TIME_WAIT, CLOSED, TIME_WAIT_TIME
+from ethernet.test_network_stack import stacks, try_call, PEER_IP
+
+
+# Both stacks run in one loop, each round polls them once; polling the chip is
+# what moves simulated time on. A round in which nothing arrived skips a
+# millisecond ahead, so retransmission timeouts come around without spinning
+# through them.
+
+class TcpConnectionTest(unittest.TestCase):
+	def run_until(self, condition, rounds=100000):
+		for _ in range(rounds):
+			if condition():
+				return
+
+			if self.stack.poll(0) + self.partner.poll(0) == 0:
+				self.simulator.advance(0.001)
+
+		self.fail("condition not met after {:d} rounds".format(rounds))
+
+
+	def connect(self, drop=None):
+		(self.simulator, self.stack, self.partner) = stacks(drop)
+		listener = self.partner.listen(5001)
+		listener.settimeout(0)
+		client = self.stack.tcp_socket()
+		client.settimeout(0)
+
+		try_call(client.connect, (PEER_IP, 5001))
+		self.run_until(lambda: client.connected and len(listener.queue) > 0)
+		(server, _) = listener.accept()
+		server.settimeout(0)
+
+		return (client, server)
+
+
+	def transfer(self, sender, receiver, data):
+		sent = 0
+		received = bytearray()
+
+		for _ in range(100000):
+			if len(received) == len(data):
+				return bytes(received)
+
+			if sent < len(data):
+				sent += try_call(sender.send, data[sent:sent + 8192]) or 0
+
+			count = len(received)
+			received += try_call(receiver.recv, 0x10000) or b""
+
+			if len(received) == count and self.stack.poll(0) + self.partner.poll(0) == 0:
+				self.simulator.advance(0.001)
+
+		self.fail("transfer stalled after {:d} of {:d} bytes".format(len(received), len(data)))
+
+
+	def test_transfer_in_both_directions(self):
+		(client, server) = self.connect()
+		data = random.Random(1).randbytes(100000)
+
+		self.assertEqual(client.state, ESTABLISHED)
+		self.assertEqual(self.transfer(client, server, data), data)
+		self.assertEqual(self.transfer(server, client, data[::-1]), data[::-1])
+		self.assertEqual(client.retransmissions + server.retransmissions, 0)
+
+
+	# A tenth of the frames get lost either way; retransmission has to
+	# deliver every byte in order all the same
+	def test_lossy_transfer(self):
+		for (seed, upload) in ((1, True), (2, False)):
+			loss = random.Random(seed)
+			(client, server) = self.connect(lambda frame: loss.random() < 0.1)
+			(sender, receiver) = (client, server) if upload else (server, client)
+			data = random.Random(seed).randbytes(50000)
+
+			self.assertEqual(self.transfer(sender, receiver, data), data)
+			self.assertGreater(sender.retransmissions, 0)
+
+
+	def test_close_in_both_directions(self):
+		(client, server) = self.connect()
+		client.close()
+		self.run_until(lambda: try_call(server.recv, 64) == b"")
+		server.close()
+		self.run_until(lambda: client.state == TIME_WAIT and server.state == CLOSED)
+
+		self.simulator.advance(TIME_WAIT_TIME)
+		self.stack.poll(0)
+
+		self.assertEqual(client.state, CLOSED)
+		self.assertEqual(len(self.stack.tcp_connections), 0)
+		self.assertEqual(len(self.partner.tcp_connections), 0)
+
+
+	def test_abort_resets_the_peer(self):
+		(client, server) = self.connect()
+		client.abort()
+		self.run_until(lambda: server.state == CLOSED)
+
+		with self.assertRaises(OSError) as context:
+			server.recv(64)
+
+		self.assertEqual(context.exception.errno, errno.ECONNRESET)
+
+
+	def test_send_after_close_fails(self):
+		(client, server) = self.connect()
+		client.close()
+
+		with self.assertRaises(OSError) as context:
+			client.send(b"late")
+
+		self.assertEqual(context.exception.errno, errno.EPIPE)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,14 +1,25 @@
 # https://en.wikipedia.org/wiki/User_Datagram_Protocol#Packet_structure
 
+import struct
+
+from ethernet.checksum import transport_checksum, pseudo_header_sum, verify_checksum
+
+HEADER = struct.Struct("!HHHH")    # source port, destination port, length, checksum
+
 class UdpDatagram:
+    __slots__ = ("source_port", "destination_port", "length", "checksum", "payload")
+
     @classmethod
-    def from_buffer(cls, buf):
+    def from_buffer(cls, buf, offset=0, length=None):
+        end = len(buf) if length is None else offset + length
+        (source_port, destination_port, udp_length, checksum) = HEADER.unpack_from(buf, offset)
+
         return cls(
-           source_port=buf[0] * 256 + buf[1],
-           destination_port=buf[2] * 256 + buf[3],
-           length=buf[4] * 256 + buf[5],
-           checksum=buf[6] * 256 + buf[7],
-           payload=buf[8:]
+           source_port=source_port,
+           destination_port=destination_port,
+           length=udp_length,
+           checksum=checksum,
+           payload=buf[offset + 8:end]
         )
 
 
@@ -20,6 +31,36 @@ class UdpDatagram:
         self.payload = payload
 
 
+    def __bytes__(self):
+        header = HEADER.pack(self.source_port, self.destination_port, self.length, self.checksum)
+
+        return header + bytes(self.payload or b"")
+
+
+    # Serialized with the checksum over the pseudo header, header and payload
+    def checksummed(self, source_address, destination_address):
+        data = bytearray(HEADER.pack(self.source_port, self.destination_port, self.length, 0))
+        data.extend(self.payload or b"")
+        checksum = transport_checksum(source_address, destination_address, 17, data)
+
+        if checksum == 0:
+            checksum = 0xFFFF    # zero means no checksum
+
+        data[6:8] = checksum.to_bytes(2, "big")
+
+        return bytes(data)
+
+
+    # A zero checksum was not computed by the sender and always passes
+    def verify_checksum(self, source_address, destination_address):
+        if self.checksum == 0:
+            return True
+
+        data = bytes(self)
+
+        return verify_checksum(data, pseudo_header_sum(source_address, destination_address, 17, len(data)))
+
+
     def __repr__(self):
         parts = [
             "UDP",
@@ -0,0 +1,56 @@
+from ethernet.udp_datagram import UdpDatagram
+from ethernet.checksum import pseudo_header_sum, verify_checksum
+
+
+# Lazy UdpDatagram, see EthernetFrameView.
+
+class UdpDatagramView(UdpDatagram):
+	__slots__ = ("buf", "offset", "end")
+
+	@classmethod
+	def from_buffer(cls, buf, offset=0, length=None):
+		return cls(buf, offset, length)
+
+
+	def __init__(self, buf, offset=0, length=None):
+		self.buf = buf
+		self.offset = offset
+		self.end = len(buf) if length is None else offset + length
+
+
+	@property
+	def source_port(self):
+		return self.buf[self.offset] * 256 + self.buf[self.offset + 1]
+
+
+	@property
+	def destination_port(self):
+		return self.buf[self.offset + 2] * 256 + self.buf[self.offset + 3]
+
+
+	@property
+	def length(self):
+		return self.buf[self.offset + 4] * 256 + self.buf[self.offset + 5]
+
+
+	@property
+	def checksum(self):
+		return self.buf[self.offset + 6] * 256 + self.buf[self.offset + 7]
+
+
+	@property
+	def payload(self):
+		return self.buf[self.offset + 8:self.end]
+
+
+	def verify_checksum(self, source_address, destination_address):
+		if self.checksum == 0:
+			return True
+
+		data = self.buf[self.offset:self.end]
+
+		return verify_checksum(data, pseudo_header_sum(source_address, destination_address, 17, len(data)))
+
+
+	def __bytes__(self):
+		return bytes(self.buf[self.offset:self.end])
@@ -0,0 +1,110 @@
+from collections import deque
+
+from ethernet.ip4_address import Ip4Address
+
+
+# Datagram socket on a NetworkStack, modelled on socket.socket(AF_INET,
+# SOCK_DGRAM). Received datagrams wait in a queue of queue_size entries; what
+# arrives while it is full is counted in dropped. Addresses are
+# (Ip4Address, port) tuples, text and bytes are accepted for the address.
+
+class UdpSocket(object):
+	def __init__(self, stack, queue_size=16):
+		self.stack = stack
+		self.port = None
+		self.queue = deque()
+		self.queue_size = queue_size
+		self.timeout = None
+		self.received = 0
+		self.dropped = 0
+
+
+	def bind(self, port):
+		if self.port is not None:
+			raise OSError("socket is already bound to port {:d}".format(self.port))
+
+		self.port = self.stack.bind(self, port)
+
+
+	# None blocks, 0 makes the receive calls non-blocking
+	def settimeout(self, timeout):
+		self.timeout = timeout
+
+
+	def sendto(self, data, address):
+		if self.port is None:
+			self.bind(0)
+
+		(ip_address, port) = address
+		self.stack.send_udp(self.port, Ip4Address(ip_address), port, data)
+
+		return len(data)
+
+
+	def recvfrom(self, bufsize):
+		(data, address) = self.receive()
+
+		return (bytes(data[:bufsize]), address)
+
+
+	def recv_into(self, buf, nbytes=0):
+		return self.recvfrom_into(buf, nbytes)[0]
+
+
+	def recvfrom_into(self, buf, nbytes=0):
+		(data, address) = self.receive()
+		count = min(len(data), nbytes or len(buf))
+		buf[:count] = data[:count]
+
+		return (count, address)
+
+
+	def receive(self):
+		if self.port is None:
+			raise OSError("socket is not bound")
+
+		stack = self.stack
+		deadline = None if self.timeout is None else stack.clock() + self.timeout
+
+		# one pass over what the chip holds, even when not blocking
+		if len(self.queue) == 0:
+			stack.poll(0)
+
+		while len(self.queue) == 0:
+			remaining = None if deadline is None else deadline - stack.clock()
+
+			if remaining is not None and remaining <= 0:
+				if self.timeout == 0:
+					raise BlockingIOError("no datagram queued")
+
+				raise TimeoutError("timed out")
+
+			stack.poll(remaining)
+
+		return self.queue.popleft()
+
+
+	# called by the stack for every datagram to our port
+	def deliver(self, data, address):
+		if len(self.queue) >= self.queue_size:
+			self.dropped += 1
+			return
+
+		self.queue.append((data, address))
+		self.received += 1
+
+
+	def close(self):
+		if self.port is not None:
+			self.stack.unbind(self.port)
+			self.port = None
+
+		self.queue.clear()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
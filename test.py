@@ -3,12 +3,16 @@
 import sys
 from time import sleep
 
+from ethernet.constants import MAX_FRAMELEN
 from ethernet.mac_address import MacAddress
 from ethernet.ip4_address import Ip4Address
 from ethernet.enc28j60 import Enc28j60
-from ethernet.ethernet_frame import EthernetFrame
-from ethernet.arp_frame import ArpFrame
-from ethernet.icmp_datagram import IcmpDatagram
+from ethernet.receive_filter import ReceiveFilter
+from ethernet.protocol_registry import ProtocolRegistry
+from ethernet.ethernet_frame_view import EthernetFrameView
+from ethernet.arp_cache import ArpCache
+from ethernet.arp_responder import ArpResponder
+from ethernet.icmp_echo_responder import IcmpEchoResponder
 
 
 def log(message=""):
@@ -20,12 +24,59 @@ if __name__ == "__main__":
 	mac_addr = MacAddress([0x02, 0x03, 0x04, 0x05, 0x06, 0x07])
 	ip_addr = Ip4Address([10, 0, 1, 254])
 	filter_mac_address = None  # MacAddress([0x30, 0x9c, 0x23, 0x0d, 0x2d, 0x7f])
+	interrupt = None  # ethernet.gpio_interrupt.GpioInterrupt("/dev/gpiochip0", 25)
 
-	driver = Enc28j60(mac_addr)
+	driver = Enc28j60(mac_addr, interrupt=interrupt)
 	driver.initialize()
 	log("ENC28J60 Revision {:d}".format(driver.revision))
+	arp_cache = ArpCache(driver.send_packet, mac_addr, ip_addr, clock=driver.clock)
+	arp_responder = ArpResponder(mac_addr, ip_addr)
+	echo_responder = IcmpEchoResponder(mac_addr, ip_addr)
+
+	if filter_mac_address is not None:
+		log(driver.set_receive_filter(ReceiveFilter().source(filter_mac_address)))
 
 	packet_number = 0
+	buf = bytearray(MAX_FRAMELEN)
+	view = memoryview(buf)
+
+	def log_frame(packet):
+		global packet_number
+		packet_number += 1
+		log()
+		log("#{:d}\n{}".format(packet_number, EthernetFrameView.from_buffer(packet)))
+
+
+	def on_icmp(packet):
+		if packet[14 + ((packet[14] & 0x0F) << 2)] == 8:
+			log("ICMP Request")
+
+		log_frame(packet)
+		reply = echo_responder.reply(packet)
+
+		if reply is not None:
+			driver.send_packet(reply)
+
+
+	def on_arp(packet):
+		arp_cache.handle(EthernetFrameView.from_buffer(packet).payload)
+		reply = arp_responder.reply(packet)
+
+		if reply is not None:
+			log("ARP for my IP")
+			driver.send_packet(reply)
+			log(arp_cache)
+
+		log_frame(packet)
+
+
+	# everything else is dropped after looking at its EtherType
+	registry = ProtocolRegistry()
+	registry.register_ip_protocol(1, on_icmp)
+	registry.register_ethertype(0x0800, log_frame)
+	registry.register_ethertype(0x0806, on_arp)
+
+	driver.on_link_change = lambda up: log("link " + ("up" if up else "down"))
 
 	while True:
 		if not driver.is_link_up:
@@ -33,45 +84,18 @@ if __name__ == "__main__":
 			sleep(1)
 			continue
 
-		packet = driver.receive_packet()
+		arp_cache.poll()
+
+		if not driver.wait_for_packet(1):
+			continue
+
+		length = driver.receive_packet_into(buf)
+		packet = view[:length]
 
-		if len(packet) == 0:
+		if length == 0:
 			continue
-		elif len(packet) >= 14:
-			frame = EthernetFrame.from_buffer(packet)
-
-			if filter_mac_address is not None and frame.src_mac_address != filter_mac_address:
-				continue
-
-			if frame.type in (0x0800, 0x0806):
-			# if frame.type == 0x0806:
-				packet_number += 1
-				log()
-
-				if frame.type == 0x0800:	# IPv4
-					if frame.payload.protocol == 1:
-						if frame.payload.payload.type == 8:
-							log("ICMP Request")
-							current_datagram = frame.payload.payload
-							new_datagram = IcmpDatagram()
-							new_datagram.id = current_datagram.id
-							new_datagram.sequence_number = current_datagram.sequence_number
-							# build ip frame
-							# build ethernet frame
-							# send frame
-				elif frame.type == 0x0806:	# ARP
-					if frame.payload.tpa == ip_addr:
-						print("ARP for my IP")
-						new_arp_frame = ArpFrame.from_arp_frame(frame.payload)
-						new_arp_frame.tha = new_arp_frame.sha
-						new_arp_frame.tpi = new_arp_frame.spa
-						new_arp_frame.sha = driver.mac_address
-						new_arp_frame.spa = ip_addr
-						log(new_arp_frame)
-						new_frame = EthernetFrame(frame.src_mac_address, driver.mac_address, 0x0806, new_arp_frame)
-						driver.send_packet(bytes(new_frame))
-				
-				log("#{:d}\n{}".format(packet_number, frame))
+		elif length >= 14:
+			registry.dispatch(packet)
 		else:
 			log("possibly invalid packet: " + " ".join(["{:02x}".format(byte) for byte in packet]))
 